@@ -0,0 +1,82 @@
+"""
+Compares the code dvcc generates with register allocation against naive
+code that keeps every value in memory. Every C program is compiled both
+ways and run on the simulator, and the instructions each executed (one
+cycle apiece on the DaVinci CPU) and the words of text each took are
+printed side by side.
+
+    python benchmarks/compiler.py
+    python benchmarks/compiler.py my_program.c --budget 100000000
+
+The exit status is 1 when the two disagree on a result, or the allocated
+code doesn't execute fewer instructions than the naive code
+"""
+
+import glob
+import os
+import sys
+from argparse import ArgumentParser
+from typing import List, Optional, Tuple
+
+from assembler.assembler import assemble_image
+from assembler.compiler import compile_program
+from assembler.regalloc import RESULT
+from assembler.sim import DEFAULT_BUDGET, Machine
+
+EXAMPLES = os.path.join(os.path.dirname(__file__), "..", "examples")
+
+
+def measure(source: str, naive: bool, budget: int) -> Tuple[int, int, int]:
+    """
+    Returns what main returned, the instructions executed and the words of
+    text
+    """
+    image = assemble_image(compile_program(source, naive))
+    machine = Machine.from_image(image)
+    machine.run(budget)
+    if not machine.halted:
+        raise Exception(f"Still running after {budget} instructions")
+    return machine.regs[RESULT], machine.executed, len(image.text)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = ArgumentParser("dvcc register allocation benchmark")
+    parser.add_argument(
+        "FILES",
+        nargs="*",
+        help="C programs (default: the examples)",
+    )
+    parser.add_argument(
+        "--budget",
+        type=int,
+        default=DEFAULT_BUDGET,
+        help="instructions each run may take",
+    )
+    args = parser.parse_args(argv)
+
+    files = args.FILES or sorted(glob.glob(os.path.join(EXAMPLES, "*.c")))
+    print(
+        f"{'program':<16} {'naive':>10} {'allocated':>10} {'speedup':>8}"
+        f" {'naive words':>12} {'words':>6}"
+    )
+    failed = False
+    for path in files:
+        with open(path) as f:
+            source = f.read()
+        result, naive, naive_words = measure(source, True, args.budget)
+        allocated_result, allocated, words = measure(source, False, args.budget)
+        verdict = ""
+        if allocated_result != result:
+            verdict = f"  results differ: {result} and {allocated_result}"
+        elif allocated >= naive:
+            verdict = "  NOT FASTER"
+        failed = failed or bool(verdict)
+        print(
+            f"{os.path.basename(path):<16} {naive:>10} {allocated:>10}"
+            f" {naive / allocated:>7.2f}x {naive_words:>12} {words:>6}{verdict}"
+        )
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
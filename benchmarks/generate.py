@@ -0,0 +1,134 @@
+"""
+Generates synthetic DaVinci programs for benchmarking. Programs are made of
+functions built from short labelled blocks: arithmetic, array walks that
+load their base with la, counted loops, forward branches and calls to
+earlier functions, followed by a main that calls them. Every function gets
+a .data array to walk, so the data segment grows with the program
+"""
+
+import random
+import sys
+from argparse import ArgumentParser
+from typing import List
+
+REGISTERS = [f"r{i}" for i in range(1, 30)]  # r0 and r31 have special uses
+R_TYPES = ["add", "sub", "mul", "and", "or", "nor", "slt"]
+I_TYPES = ["addi", "muli", "andi", "ori", "slti"]
+
+
+class Generator:
+    def __init__(self, seed: int):
+        self.rng = random.Random(seed)
+        self.text: List[str] = []
+        self.data: List[str] = []
+        self.functions: List[str] = []
+        self.count = 0  # instructions so far
+        self.labels = 0
+
+    def reg(self) -> str:
+        return self.rng.choice(REGISTERS)
+
+    def label(self, prefix: str) -> str:
+        self.labels += 1
+        return f"{prefix}_{self.labels}"
+
+    def emit(self, line: str):
+        self.text.append(f"    {line};")
+        self.count += 1
+
+    def place(self, label: str):
+        self.text.append(f"{label}:")
+
+    def arithmetic(self):
+        for _ in range(self.rng.randint(2, 6)):
+            if self.rng.random() < 0.5:
+                op = self.rng.choice(R_TYPES)
+                self.emit(f"{op} {self.reg()}, {self.reg()}, {self.reg()}")
+            elif self.rng.random() < 0.8:
+                op = self.rng.choice(I_TYPES)
+                self.emit(
+                    f"{op} {self.reg()}, {self.reg()}, {self.rng.randint(-99, 99)}"
+                )
+            else:
+                op = self.rng.choice(["sll", "srl"])
+                self.emit(f"{op} {self.reg()}, {self.reg()}, {self.rng.randint(0, 31)}")
+
+    def array_walk(self, array: str, length: int):
+        base, count, value = self.reg(), self.reg(), self.reg()
+        loop = self.label("walk")
+        self.emit(f"la {base}, {array}")
+        self.emit(f"addi {count}, {count}, {length}")
+        self.place(loop)
+        self.emit(f"lw {value}, {base}, 0")
+        self.emit(f"add {value}, {value}, {value}")
+        self.emit(f"sw {value}, {base}, 0")
+        self.emit(f"addi {base}, {base}, 1")
+        self.emit(f"addi {count}, {count}, -1")
+        self.emit(f"bne {count}, r0, {loop}")
+
+    def forward_branch(self):
+        skip = self.label("skip")
+        self.emit(f"beq {self.reg()}, {self.reg()}, {skip}")
+        self.arithmetic()
+        self.place(skip)
+
+    def call(self):
+        if not self.functions:
+            self.arithmetic()
+            return
+        self.emit("sub r0, r0, r0")
+        self.emit("add r0, r0, r31")
+        self.emit("push")
+        self.emit(f"jal {self.rng.choice(self.functions[-64:])}")
+        self.emit("pop")
+        self.emit("add r31, r0, r0")
+
+    def function(self):
+        name = f"f{len(self.functions)}"
+        array = f"{name}_data"
+        length = self.rng.randint(16, 256)
+        values = ", ".join(str(self.rng.randint(-1000, 1000)) for _ in range(length))
+        self.data.append(f"{array}: {values};")
+
+        self.place(name)
+        blocks = [self.arithmetic, self.forward_branch, self.call]
+        for _ in range(self.rng.randint(3, 10)):
+            self.place(self.label("block"))
+            self.rng.choice(blocks)()
+        self.array_walk(array, length)
+        self.emit("jr r31")
+        self.functions.append(name)
+
+    def main(self, calls: int):
+        self.place("main")
+        for name in self.rng.sample(self.functions, min(calls, len(self.functions))):
+            self.emit(f"jal {name}")
+
+    def source(self) -> str:
+        lines = [".data", *self.data, "", ".text", *self.text, ""]
+        return "\n".join(lines)
+
+
+def generate(instructions: int, seed: int = 0) -> str:
+    """
+    Returns the source of a program with roughly the given number of
+    instructions
+    """
+    generator = Generator(seed)
+    calls = max(1, min(100, instructions // 100))
+    while generator.count + calls < instructions:
+        generator.function()
+    generator.main(calls)
+    return generator.source()
+
+
+def main():
+    parser = ArgumentParser("Synthetic program generator")
+    parser.add_argument("INSTRUCTIONS", type=int, help="approximate program size")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    sys.stdout.write(generate(args.INSTRUCTIONS, args.seed))
+
+
+if __name__ == "__main__":
+    main()
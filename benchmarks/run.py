@@ -0,0 +1,247 @@
+"""
+Times the assembler on generated programs and compares the results with
+stored baselines. Every stage is timed on its own (the best of a few runs),
+then run once more under tracemalloc for its peak memory. End to end runs
+time the dvassembler command in a fresh process and take its peak RSS.
+
+    python benchmarks/run.py                      # compare with baselines.json
+    python benchmarks/run.py --update             # store new baselines
+    python benchmarks/run.py --sizes 1000000      # a single 1M program
+    python benchmarks/run.py --jobs 4             # also time -j 4
+
+The exit status is 1 when any time or peak memory is more than --threshold
+worse than its baseline. Baselines are only comparable on the machine they
+were recorded on, so record them again with --update after moving
+"""
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from argparse import ArgumentParser
+from typing import Callable, Dict, List, Optional, Tuple
+
+from assembler.assembler import assemble_image, layout_image, resolve
+from assembler.grammar import lex, parse_program, process
+from assembler.parallel import process_parallel
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from generate import generate  # noqa: E402
+
+DEFAULT_SIZES = [1_000, 10_000, 100_000]
+DEFAULT_BASELINES = os.path.join(os.path.dirname(__file__), "baselines.json")
+DEFAULT_THRESHOLD = 0.3
+
+Result = Dict[str, float]  # seconds, lines_per_second, peak_bytes
+
+
+def measure(fn: Callable[[], object], repeat: int, memory: bool) -> Tuple[float, int]:
+    """
+    Returns the best time of repeat calls to fn, and its peak traced memory
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    peak = 0
+    if memory:
+        tracemalloc.start()
+        fn()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return best, peak
+
+
+# runs dvassembler, then reports its own peak memory on the last line of
+# standard error. The child's rusage can't be used from here, because on
+# Linux it starts out with the peak of the process that forked it
+CHILD = """
+import resource, sys
+from assembler.dvassembler import main
+sys.argv[0] = "dvassembler"
+main()
+peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+try:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                peak = int(line.split()[1]) * 1024
+except OSError:
+    pass
+print(peak, file=sys.stderr)
+"""
+
+
+def end_to_end(path: str, repeat: int, jobs: int = 1) -> Tuple[float, int]:
+    """
+    Runs dvassembler in a new process, returning the best wall time and its
+    peak resident memory
+    """
+    command = [sys.executable, "-c", CHILD, path, "-o", os.devnull]
+    if jobs > 1:
+        command += ["--jobs", str(jobs)]
+    best = float("inf")
+    peak = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        process = subprocess.run(command, stderr=subprocess.PIPE, text=True)
+        elapsed = time.perf_counter() - start
+        if process.returncode != 0:
+            raise Exception(f"dvassembler failed on {path}:\n{process.stderr}")
+        best = min(best, elapsed)
+        peak = max(peak, int(process.stderr.split()[-1]))
+    return best, peak
+
+
+def run_size(size: int, repeat: int, memory: bool, jobs: int = 1) -> Dict[str, Result]:
+    source = generate(size)
+    lines = source.count("\n")
+    tokens = list(lex(source))
+    program = parse_program(tokens)
+
+    timings = {
+        "lex": measure(lambda: list(lex(source)), repeat, memory),
+        "parse": measure(lambda: parse_program(tokens), repeat, memory),
+        "assemble": measure(lambda: assemble_image(program), repeat, memory),
+    }
+    if jobs > 1:
+        # lexing and parsing together, which is what --jobs splits up
+        timings["process"] = measure(lambda: process(source), repeat, False)
+        # peak memory is traced in this process only, which misses the workers
+        timings[f"process -j{jobs}"] = measure(
+            lambda: process_parallel(source, jobs=jobs), repeat, False
+        )
+        timings[f"assemble -j{jobs}"] = measure(
+            lambda: layout_image(resolve(program), jobs), repeat, False
+        )
+    del tokens, program
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, f"synthetic_{size}.asm")
+        with open(path, "w") as f:
+            f.write(source)
+        timings["end-to-end"] = end_to_end(path, repeat)
+        if jobs > 1:
+            timings[f"end-to-end -j{jobs}"] = end_to_end(path, repeat, jobs)
+
+    return {
+        stage: {
+            "seconds": seconds,
+            "lines_per_second": lines / seconds,
+            "peak_bytes": peak,
+        }
+        for stage, (seconds, peak) in timings.items()
+    }
+
+
+def compare(
+    results: Dict[str, Dict[str, Result]],
+    baselines: Dict[str, Dict[str, Result]],
+    threshold: float,
+) -> List[str]:
+    """
+    Returns a description of every regression past threshold
+    """
+    regressions = []
+    for size, stages in results.items():
+        for stage, result in stages.items():
+            baseline = baselines.get(size, {}).get(stage)
+            if baseline is None:
+                continue
+            for metric in ["seconds", "peak_bytes"]:
+                before, after = baseline[metric], result[metric]
+                if before > 0 and after > before * (1 + threshold):
+                    regressions.append(
+                        f"{stage} on {size} instructions: {metric} went from "
+                        f"{before:.4g} to {after:.4g} (+{(after / before - 1) * 100:.0f}%)"
+                    )
+    return regressions
+
+
+def print_results(
+    results: Dict[str, Dict[str, Result]],
+    baselines: Dict[str, Dict[str, Result]],
+):
+    print(
+        f"{'size':>9} {'stage':<15} {'time (ms)':>10} {'lines/s':>11} "
+        f"{'peak (MiB)':>11} {'vs baseline':>12}"
+    )
+    for size, stages in results.items():
+        for stage, result in stages.items():
+            baseline = baselines.get(size, {}).get(stage)
+            change = ""
+            if baseline is not None and baseline["seconds"] > 0:
+                change = f"{(result['seconds'] / baseline['seconds'] - 1) * 100:+.0f}%"
+            print(
+                f"{size:>9} {stage:<15} {result['seconds'] * 1000:>10.1f} "
+                f"{result['lines_per_second']:>11.0f} "
+                f"{result['peak_bytes'] / (1 << 20):>11.1f} {change:>12}"
+            )
+
+
+def load_baselines(path: str) -> Dict[str, Dict[str, Result]]:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = ArgumentParser("DaVinci assembler benchmarks")
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=DEFAULT_SIZES,
+        help="program sizes in instructions",
+    )
+    parser.add_argument("--repeat", type=int, default=5, help="runs per measurement")
+    parser.add_argument("--baselines", type=str, default=DEFAULT_BASELINES)
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=DEFAULT_THRESHOLD,
+        help="fail when anything is this fraction worse than its baseline",
+    )
+    parser.add_argument(
+        "--update", action="store_true", help="store the results as the baselines"
+    )
+    parser.add_argument(
+        "--no-memory",
+        action="store_true",
+        help="skip the tracemalloc runs, which are slow on big programs",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        metavar="N",
+        help="also time assembling with --jobs N",
+    )
+    args = parser.parse_args(argv)
+
+    baselines = load_baselines(args.baselines)
+    results = {
+        str(size): run_size(size, args.repeat, not args.no_memory, args.jobs)
+        for size in args.sizes
+    }
+    print_results(results, baselines)
+
+    if args.update:
+        baselines.update(results)
+        with open(args.baselines, "w") as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+            f.write("\n")
+        return 0
+    regressions = compare(results, baselines, args.threshold)
+    for regression in regressions:
+        print(f"REGRESSION {regression}", file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
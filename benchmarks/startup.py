@@ -0,0 +1,88 @@
+"""
+Times how long dvassembler takes to start: `dvassembler --version`, which
+should load next to nothing, and assembling a one-instruction file. Each is
+run in a fresh interpreter, and the time of an interpreter that does nothing
+is subtracted so that the budgets mean the same on fast and slow machines.
+
+    python benchmarks/startup.py
+    python benchmarks/startup.py --repeat 50 --version-budget 20
+
+The exit status is 1 when either is over its budget. Bytecode is written
+and reused as it would be for an installed package, even if
+PYTHONDONTWRITEBYTECODE is set, and every command is run once before timing
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+from typing import List, Optional
+
+# what the dvassembler console script runs, without the launcher in front
+ENTRY = "import sys; from assembler.dvassembler import main; sys.exit(main())"
+TINY = ".text\nmain: jr r31;\n"
+DEFAULT_VERSION_BUDGET = 30  # ms on top of the bare interpreter
+DEFAULT_TINY_BUDGET = 60
+
+
+def best_time(command: List[str], repeat: int, env: dict) -> float:
+    """
+    Returns the best wall time of repeat runs of command, in seconds
+    """
+    subprocess.run(command, env=env, stdout=subprocess.DEVNULL, check=True)
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(command, env=env, stdout=subprocess.DEVNULL, check=True)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = ArgumentParser("dvassembler startup benchmark")
+    parser.add_argument("--repeat", type=int, default=20, help="runs per command")
+    parser.add_argument(
+        "--version-budget",
+        type=float,
+        default=DEFAULT_VERSION_BUDGET,
+        metavar="MS",
+        help="allowed milliseconds for --version past interpreter startup",
+    )
+    parser.add_argument(
+        "--tiny-budget",
+        type=float,
+        default=DEFAULT_TINY_BUDGET,
+        metavar="MS",
+        help="allowed milliseconds to assemble a tiny file past interpreter startup",
+    )
+    args = parser.parse_args(argv)
+
+    env = dict(os.environ)
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    with tempfile.TemporaryDirectory() as directory:
+        tiny = os.path.join(directory, "tiny.asm")
+        with open(tiny, "w") as f:
+            f.write(TINY)
+        interpreter = best_time([sys.executable, "-c", "pass"], args.repeat, env)
+        runs = [
+            (
+                "--version",
+                [sys.executable, "-c", ENTRY, "--version"],
+                args.version_budget,
+            ),
+            ("tiny file", [sys.executable, "-c", ENTRY, tiny], args.tiny_budget),
+        ]
+        print(f"{'interpreter':<12} {interpreter * 1000:>8.1f} ms")
+        over = False
+        for name, command, budget in runs:
+            extra = (best_time(command, args.repeat, env) - interpreter) * 1000
+            verdict = "ok" if extra <= budget else "OVER BUDGET"
+            over = over or extra > budget
+            print(f"{name:<12} {extra:>+8.1f} ms  (budget {budget:g} ms)  {verdict}")
+    return 1 if over else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,34 @@
+// Recursive binary search over a sorted array, like binsearch.asm
+int A[50] = {
+    1, 4, 4, 5, 7, 8, 11, 14, 15, 18,
+    18, 20, 20, 22, 25, 27, 27, 36, 38,
+    40, 40, 41, 41, 42, 47, 47, 49, 56,
+    57, 58, 59, 60, 67, 70, 74, 75, 77,
+    77, 77, 78, 81, 82, 83, 85, 88, 88,
+    90, 95, 99, 100
+};
+
+int binsearch(int arr[], int low, int high, int value) {
+    if (high < low)
+        return -1;
+    int mid = (low + high) >> 1;
+    if (arr[mid] == value)
+        return mid;
+    if (arr[mid] < value)
+        return binsearch(arr, mid + 1, high, value);
+    return binsearch(arr, low, mid - 1, value);
+}
+
+int main() {
+    int found = 0;
+    int i = 0;
+    // look every value up, and one that isn't there
+    while (i < 50) {
+        if (binsearch(A, 0, 49, A[i]) >= 0)
+            found = found + 1;
+        i = i + 1;
+    }
+    if (binsearch(A, 0, 49, 3) < 0)
+        found = found + 1;
+    return found;
+}
@@ -0,0 +1,12 @@
+// Recursive Fibonacci, like recfib.asm
+int fib(int n) {
+    if (n <= 0)
+        return 0;
+    if (n == 1)
+        return 1;
+    return fib(n - 2) + fib(n - 1);
+}
+
+int main() {
+    return fib(15);
+}
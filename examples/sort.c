@@ -0,0 +1,65 @@
+// Insertion sort, then a sieve of Eratosthenes
+int data[64];
+int composite[200];
+int primes;
+
+void fill(int a[], int n, int seed) {
+    int i = 0;
+    while (i < n) {
+        seed = seed * 1103515245 + 12345;
+        a[i] = (seed >> 16) & 0x7FFF;
+        i = i + 1;
+    }
+}
+
+void sort(int a[], int n) {
+    int i = 1;
+    while (i < n) {
+        int value = a[i];
+        int j = i - 1;
+        while (j >= 0 && a[j] > value) {
+            a[j + 1] = a[j];
+            j = j - 1;
+        }
+        a[j + 1] = value;
+        i = i + 1;
+    }
+}
+
+int sorted(int a[], int n) {
+    int i = 1;
+    while (i < n) {
+        if (a[i - 1] > a[i])
+            return 0;
+        i = i + 1;
+    }
+    return 1;
+}
+
+void sieve(int n) {
+    int i = 2;
+    while (i * i < n) {
+        if (!composite[i]) {
+            int j = i * i;
+            while (j < n) {
+                composite[j] = 1;
+                j = j + i;
+            }
+        }
+        i = i + 1;
+    }
+    primes = 0;
+    i = 2;
+    while (i < n) {
+        if (!composite[i])
+            primes = primes + 1;
+        i = i + 1;
+    }
+}
+
+int main() {
+    fill(data, 64, 147);
+    sort(data, 64);
+    sieve(200);
+    return sorted(data, 64) * 1000 + primes;
+}
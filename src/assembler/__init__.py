@@ -1,3 +1,41 @@
-from .translator import *
+from importlib import import_module
 
-__all__ = [f"encode_{inst}" for inst in (set(OPCODES.keys()) | set(FUNCTS.keys()))]
+__version__ = "0.1.0"
+
+__all__ = [
+    "encode_add",
+    "encode_addi",
+    "encode_and",
+    "encode_andi",
+    "encode_beq",
+    "encode_bne",
+    "encode_jal",
+    "encode_jmp",
+    "encode_jr",
+    "encode_lui",
+    "encode_lw",
+    "encode_mul",
+    "encode_muli",
+    "encode_nor",
+    "encode_or",
+    "encode_ori",
+    "encode_pop",
+    "encode_push",
+    "encode_sll",
+    "encode_slt",
+    "encode_slti",
+    "encode_srl",
+    "encode_sub",
+    "encode_sw",
+]
+
+
+def __getattr__(name: str):
+    # the translator is only loaded once one of its names is used, so that
+    # importing a submodule, like the command line entry points do, doesn't
+    # pay for it
+    if not name.startswith("_"):
+        translator = import_module(".translator", __name__)
+        if hasattr(translator, name):
+            return getattr(translator, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
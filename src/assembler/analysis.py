@@ -0,0 +1,399 @@
+import json
+from dataclasses import dataclass, fields
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+from .assembler import PROGRAM_START_ADDR, Layout
+from .grammar import LABEL, REGISTERS
+from .sim import RETURN_REGISTER
+from .translator import (
+    ENCODINGS,
+    MACROS,
+    Operand,
+    pack_jr,
+    pack_jump,
+    pack_lui,
+    pack_none,
+    pack_rri,
+    pack_rrr,
+    pack_shift,
+)
+
+# instruction class : mnemonics, everything else is "alu"
+CLASSES = {
+    "memory": {"lw", "sw", "push", "pop"},
+    "multiply": {"mul", "muli"},
+    "branch": {"beq", "bne", "jmp", "jal", "jr"},
+}
+READ_ONLY = {"sw", "beq", "bne"}  # I-types that don't write rt
+# a block ends after these, and the word after them doesn't run right after
+ENDS_BLOCK = {"beq", "bne", "jmp", "jr"}
+NOT_FOLLOWED = {"jmp", "jal", "jr"}
+MAX_HAZARDS = 20  # hazards listed by the report, past the count
+
+
+@dataclass
+class CostModel:
+    """
+    Cycles every class of instruction is assumed to take, the stall a
+    read-after-write hazard between adjacent instructions adds, and how
+    many times a loop is assumed to run. The defaults are only relative
+    guesses, to be calibrated against the CPU
+    """
+
+    alu: int = 1
+    memory: int = 3
+    multiply: int = 4
+    branch: int = 2
+    hazard: int = 1
+    loop: int = 10
+
+    @classmethod
+    def parse(cls, overrides: Iterable[str]) -> "CostModel":
+        """
+        Returns the default costs with every NAME=CYCLES in overrides applied
+        """
+        costs = cls()
+        names = {field.name for field in fields(cls)}
+        for override in overrides:
+            name, _, value = override.partition("=")
+            if name not in names or not value.isdigit():
+                raise Exception(
+                    f"Expected NAME=CYCLES with NAME one of {', '.join(sorted(names))}, "
+                    f"got {override}"
+                )
+            setattr(costs, name, int(value))
+        return costs
+
+    def cycles(self, name: str) -> int:
+        for cls, names in CLASSES.items():
+            if name in names:
+                return getattr(self, cls)
+        return self.alu
+
+
+def registers(
+    name: str, args: List[Operand]
+) -> Tuple[Tuple[int, ...], Tuple[int, ...]]:
+    """
+    Returns the registers an instruction writes and the ones it reads
+    """
+    pack = ENCODINGS[name][0]
+    if pack is pack_rrr:
+        return (args[0],), (args[1], args[2])
+    if pack is pack_shift:
+        return (args[0],), (args[1],)
+    if pack is pack_jr:
+        return (), (args[0],)
+    if pack is pack_rri:
+        if name in READ_ONLY:
+            return (), (args[0], args[1])
+        return (args[0],), (args[1],)
+    if pack is pack_lui:
+        return (args[0],), ()
+    if pack is pack_jump:
+        return ((RETURN_REGISTER,) if name == "jal" else ()), ()
+    assert pack is pack_none
+    return ((0,), ()) if name == "pop" else ((), (0,))
+
+
+def words(name: str, args: List[Operand]) -> List[Tuple[str, List[Operand]]]:
+    """
+    Returns the machine instructions a resolved statement is made of
+    """
+    if name in MACROS:
+        return [(inst, list(margs)) for inst, margs in MACROS[name](*args)]
+    return [(name, args)]
+
+
+def plural(count: int, noun: str) -> str:
+    return f"{count} {noun}" if count == 1 else f"{count} {noun}s"
+
+
+class Hazard(NamedTuple):
+    address: int  # of the instruction that reads the register
+    register: int
+    writer: str
+    reader: str
+
+
+@dataclass
+class Block:
+    start: int  # statements [start, end)
+    end: int
+    address: int
+    label: str  # nearest label, and how many words past it the block is
+    words: int
+    cycles: int  # once through, including hazard stalls
+    hazards: int
+    depth: int = 0  # loops it's in
+    line: int = 0  # source line of its first instruction, 0 when unknown
+
+    def weighted(self, loop: int) -> int:
+        return self.cycles * loop**self.depth
+
+
+class FunctionCost(NamedTuple):
+    name: str
+    address: int
+    blocks: int
+    cycles: int  # of every block once
+    weighted: int  # with every block weighted by the loops it's in
+
+
+class Analysis:
+    """
+    Static cost estimate of a resolved program. The statements are split
+    into basic blocks at every label in the labels map and after every
+    branch and jump, which gives the control-flow graph. A function is
+    main or the target of a jal, together with the blocks it reaches
+    without calling. Loops are found from the back edges of a depth-first
+    walk, and a block's cycles count loop times more for every loop it's
+    in, so hot spots are the blocks with the most weighted cycles
+    """
+
+    def __init__(self, costs: Optional[CostModel] = None):
+        self.costs = costs or CostModel()
+        self.blocks: List[Block] = []
+        self.successors: List[List[int]] = []
+        self.functions: List[FunctionCost] = []
+        self.hazards: List[Hazard] = []
+
+    def run(self, result: Layout):
+        program = result.program
+        costs = self.costs
+        statements = [result.statement(i) for i in range(len(result))]
+        names_at: Dict[int, str] = {}
+        for symbol, at in result.labels.items():
+            names_at.setdefault(at, program.symbols.names[symbol])
+
+        starts = {0, *result.labels.values()}
+        for i, (name, _) in enumerate(statements):
+            if name.split(".")[0] in ENDS_BLOCK:
+                starts.add(i + 1)
+        starts = sorted(start for start in starts if start < len(result))
+        block_of = [0] * len(result)
+        label, label_address = "(start)", PROGRAM_START_ADDR
+        previous: Optional[Tuple[str, List[Operand]]] = None
+        self.blocks = []
+        self.hazards = []
+        for block, (start, end) in enumerate(zip(starts, starts[1:] + [len(result)])):
+            address = PROGRAM_START_ADDR + result.addresses[start]
+            if start in names_at:
+                label, label_address = names_at[start], address
+            offset = address - label_address
+            cycles = hazards = 0
+            for i in range(start, end):
+                block_of[i] = block
+                for k, word in enumerate(words(*statements[i])):
+                    cycles += costs.cycles(word[0])
+                    if previous is not None and previous[0] not in NOT_FOLLOWED:
+                        written = registers(*previous)[0]
+                        for register in sorted(set(registers(*word)[1])):
+                            if register in written:
+                                hazards += 1
+                                self.hazards.append(
+                                    Hazard(
+                                        PROGRAM_START_ADDR + result.addresses[i] + k,
+                                        register,
+                                        previous[0],
+                                        word[0],
+                                    )
+                                )
+                    previous = word
+            self.blocks.append(
+                Block(
+                    start,
+                    end,
+                    address,
+                    f"{label}+{offset}" if offset else label,
+                    result.addresses[end] - result.addresses[start],
+                    cycles + hazards * costs.hazard,
+                    hazards,
+                    line=program.lines[start - 1] if start else 0,
+                )
+            )
+
+        # control-flow graph, and the functions calls go to
+        self.successors = []
+        entries = {}
+        main = program.symbols.ids.get("main")
+        if main in result.labels:
+            entries[block_of[result.labels[main]]] = "main"
+        for block in self.blocks:
+            last = block.end - 1
+            name = statements[last][0].split(".")[0]
+            following = [block_of[block.end]] if block.end < len(result) else []
+            for i in range(block.start, block.end):
+                target = self.target(result, i) if statements[i][0] == "jal" else None
+                if target is not None:
+                    entries.setdefault(block_of[target], names_at[target])
+            # jumps to literal addresses go nowhere the graph knows of
+            target = (
+                self.target(result, last) if name in {"jmp", "beq", "bne"} else None
+            )
+            targets = [] if target is None else [block_of[target]]
+            if name == "jmp":
+                self.successors.append(targets)
+            elif name in {"beq", "bne"}:
+                self.successors.append([*targets, *following])
+            elif name == "jr":
+                self.successors.append([])
+            else:
+                self.successors.append(following)
+
+        for header, body in self.loops([0, *entries]).items():
+            for block in body:
+                self.blocks[block].depth += 1
+        self.functions = []
+        for entry, name in sorted(entries.items()):
+            body = self.reachable(entry, set(entries) - {entry})
+            self.functions.append(
+                FunctionCost(
+                    name,
+                    self.blocks[entry].address,
+                    len(body),
+                    sum(self.blocks[b].cycles for b in body),
+                    sum(self.blocks[b].weighted(costs.loop) for b in body),
+                )
+            )
+
+    @staticmethod
+    def target(result: Layout, i: int) -> Optional[int]:
+        """
+        Returns the statement the label of jump or branch statement i points
+        to, or None when it's given as a literal instead
+        """
+        program = result.program
+        if i == 0:
+            return result.labels[program.symbols.ids["main"]]
+        # the label is always the last operand
+        last = program.arg_start[i] - 1
+        if program.arg_kinds[last] != LABEL:
+            return None
+        return result.labels[program.args[last]]
+
+    def reachable(self, entry: int, stop: Set[int]) -> Set[int]:
+        found = {entry}
+        pending = [entry]
+        while pending:
+            for successor in self.successors[pending.pop()]:
+                if successor not in found and successor not in stop:
+                    found.add(successor)
+                    pending.append(successor)
+        return found
+
+    def loops(self, roots: List[int]) -> Dict[int, Set[int]]:
+        """
+        Returns the blocks in the natural loop of every loop header
+        """
+        predecessors: List[List[int]] = [[] for _ in self.blocks]
+        for block, successors in enumerate(self.successors):
+            for successor in successors:
+                predecessors[successor].append(block)
+        back_edges = []
+        # iterative depth-first walk, so that long chains of blocks don't
+        # run out of stack
+        state = [0] * len(self.blocks)  # 0 unseen, 1 on the path, 2 done
+        for root in roots:
+            if state[root]:
+                continue
+            state[root] = 1
+            stack = [(root, iter(self.successors[root]))]
+            while stack:
+                block, successors = stack[-1]
+                for successor in successors:
+                    if state[successor] == 1:
+                        back_edges.append((block, successor))
+                    elif state[successor] == 0:
+                        state[successor] = 1
+                        stack.append((successor, iter(self.successors[successor])))
+                        break
+                else:
+                    state[block] = 2
+                    stack.pop()
+        loops: Dict[int, Set[int]] = {}
+        for tail, header in back_edges:
+            body = loops.setdefault(header, {header})
+            pending = [tail]
+            while pending:
+                block = pending.pop()
+                if block not in body:
+                    body.add(block)
+                    pending.extend(predecessors[block])
+        return loops
+
+    def hot_spots(self, count: int) -> List[Block]:
+        """
+        Returns the count blocks with the most loop weighted cycles
+        """
+        loop = self.costs.loop
+        ranked = sorted(self.blocks, key=lambda block: -block.weighted(loop))
+        return ranked[:count]
+
+    def report(self, hot_spots: int = 10) -> List[str]:
+        loop = self.costs.loop
+        lines = [
+            f"analysis: {plural(sum(block.words for block in self.blocks), 'word')} "
+            f"in {plural(len(self.blocks), 'block')}, "
+            f"{plural(len(self.functions), 'function')}, "
+            f"{plural(len(self.hazards), 'read-after-write hazard')}",
+            f"{'function':<24} {'address':>8} {'blocks':>6} {'cycles':>8} "
+            f"{'weighted':>10}",
+        ]
+        for function in sorted(self.functions, key=lambda f: -f.weighted):
+            lines.append(
+                f"{function.name:<24} {function.address:>8x} {function.blocks:>6} "
+                f"{function.cycles:>8} {function.weighted:>10}"
+            )
+        lines.append(
+            f"{'hot spot':<24} {'address':>8} {'loops':>6} {'cycles':>8} "
+            f"{'weighted':>10}  line"
+        )
+        for block in self.hot_spots(hot_spots):
+            lines.append(
+                f"{block.label:<24} {block.address:>8x} {block.depth:>6} "
+                f"{block.cycles:>8} {block.weighted(loop):>10}  "
+                f"{block.line or '?'}"
+            )
+        for hazard in self.hazards[:MAX_HAZARDS]:
+            lines.append(
+                f"hazard at {hazard.address:x}: {hazard.reader} reads "
+                f"{REGISTERS[hazard.register]} right after {hazard.writer} writes it"
+            )
+        if len(self.hazards) > MAX_HAZARDS:
+            lines.append(f"... and {len(self.hazards) - MAX_HAZARDS} more hazards")
+        return lines
+
+    def to_json(self) -> dict:
+        loop = self.costs.loop
+        return {
+            "costs": {
+                field.name: getattr(self.costs, field.name)
+                for field in fields(CostModel)
+            },
+            "functions": [function._asdict() for function in self.functions],
+            "blocks": [
+                {
+                    "address": block.address,
+                    "label": block.label,
+                    "words": block.words,
+                    "cycles": block.cycles,
+                    "hazards": block.hazards,
+                    "loops": block.depth,
+                    "weighted": block.weighted(loop),
+                    "line": block.line,
+                }
+                for block in self.blocks
+            ],
+            "hazards": [hazard._asdict() for hazard in self.hazards],
+        }
+
+    def write_json(self, path: str):
+        with open(path, "w") as f:
+            json.dump(self.to_json(), f, indent=2)
+            f.write("\n")
+
+
+def analyze(result: Layout, costs: Optional[CostModel] = None) -> Analysis:
+    analysis = Analysis(costs)
+    analysis.run(result)
+    return analysis
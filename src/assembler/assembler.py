@@ -1,105 +1,689 @@
-from typing import List, Union
-from .translator import encode, imm_to_binary
-from .grammar import Label, Instruction, Data, Token, DataSegment, TextSegment
+from array import array
+from dataclasses import dataclass
+from itertools import accumulate, chain
+from typing import (
+    TYPE_CHECKING,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
+from . import peephole
+from .translator import (
+    IMM_MASK,
+    ARITIES,
+    ENCODINGS,
+    IMM_WIDTH,
+    JMP_ADDR_MASK,
+    MACROS,
+    PACKERS,
+    WORD_MASK,
+    Operand,
+    encode,
+    encode_many,
+    encode_words,
+    imm_to_int,
+    pack_columns,
+    size_of,
+    to_hex,
+)
+from .grammar import (
+    LABEL,
+    LITERAL,
+    MNEMONIC_IDS,
+    MNEMONICS,
+    REGISTER,
+    REGISTERS,
+    Label,
+    Instruction,
+    Data,
+    Token,
+    DataSegment,
+    Program,
+    TextSegment,
+    as_program,
+    data_block,
+)
 
+if TYPE_CHECKING:
+    from .analysis import Analysis
 
 PROGRAM_START_ADDR = 0x1000
 DATA_START_ADDR = 0x01008000
 
 
-def assemble(segments: List[Union[DataSegment, TextSegment]]) -> str:
-    labels = {}  # label : instruction_idx
-    cur_labels = []
+@dataclass
+class Image:
+    text: array  # words starting at PROGRAM_START_ADDR
+    data: array  # words starting at DATA_START_ADDR
 
-    filtered_statements = [Instruction("jmp", [Token("label", "main")])]
-    filtered_datas: List[Data] = []
-    data_to_offset = {}
-    data_offset = 0
 
-    # first pass is locate all labels and calculate addresses of
-    # data
-    for segment in segments:
-        if type(segment) is TextSegment:
-            for statement in segment.items:
-                if type(statement) is Label:
-                    cur_labels.append(statement.name)
+MAIN = "main"
+
+
+class Layout:
+    """
+    Where every part of a program ends up. Statement 0 is the jmp to main
+    that every program starts with and statement i + 1 is the program's
+    instruction i. Labels and data names are looked up by symbol id
+    """
+
+    __slots__ = ("program", "labels", "data_to_offset", "addresses", "relaxed")
+
+    def __init__(
+        self,
+        program: Program,
+        labels: Dict[int, int],
+        data_to_offset: Dict[int, int],
+    ):
+        self.program = program
+        self.labels = labels  # symbol : statement_idx
+        self.data_to_offset = data_to_offset  # symbol : word offset
+        # word offset of every statement, followed by the end of the text
+        self.addresses = array("i")
+        # beq/bne that are too far from their label
+        self.relaxed: Set[int] = set()
+
+    def __len__(self):
+        return len(self.program) + 1
+
+    def label_index(self, symbol: int) -> int:
+        try:
+            return self.labels[symbol]
+        except KeyError:
+            raise Exception(
+                f"Unknown label {self.program.symbols.names[symbol]}"
+            ) from None
+
+    def data_offset(self, symbol: int) -> int:
+        try:
+            return self.data_to_offset[symbol]
+        except KeyError:
+            raise Exception(
+                f"Unknown label {self.program.symbols.names[symbol]}"
+            ) from None
+
+    def statement(self, i: int, text: bool = False) -> Tuple[str, List[Operand]]:
+        """
+        Returns the mnemonic and operands of statement i with every label
+        replaced by its address, either as ints or as source text
+        """
+        program = self.program
+        addresses = self.addresses
+        if i == 0:
+            main = program.symbols.ids.get(MAIN)
+            if main is None:
+                raise Exception(f"Unknown label {MAIN}")
+            target = jump_address(addresses[self.label_index(main)])
+            return "jmp", [hex(target) if text else target]
+
+        name = program.name(i - 1)
+        start, end = program.arg_start[i - 1], program.arg_start[i]
+        args: List[Operand] = []
+        for kind, value in zip(program.arg_kinds[start:end], program.args[start:end]):
+            if kind == REGISTER:
+                args.append(REGISTERS[value] if text else value)
+            elif kind == LITERAL:
+                if text:
+                    args.append(program.literals.names[value])
+                else:
+                    args.append(program.literal_values[value])
+            elif name in {"beq", "bne"}:
+                target = addresses[self.label_index(value)]
+                if i in self.relaxed:
+                    name = f"{name}.far"
+                    addr = jump_address(target)
+                    args.append(hex(addr) if text else addr)
                 else:
-                    for label in cur_labels:
-                        # this is what the label points to
-                        if label in labels:
-                            raise Exception(f"Label {label} already exists")
-                        labels[label] = len(filtered_statements)
-                    cur_labels = []
-                    filtered_statements.append(statement)  # only take instructions
-        else:
-            # data segment
-            for data in segment.items:
-                if data.name in data_to_offset:
-                    raise Exception(f"{data.name} already declared!")
-                data_to_offset[data.name] = data_offset
-                filtered_datas.append(data)
-                data_offset += len(data.values)
-
-    # second pass is replace labels w/ absolute addresses
-    # and replace any la with the correct logical address
-    for i, statement in enumerate(filtered_statements):
-        for j in range(len(statement.args)):
-            if statement.args[j].cls == "label":
-                # replace
-                if statement.name in {"beq", "bne"}:
                     # relative
                     # (PC+1)+x = label
                     # x = label - (PC+1)
-                    diff = labels[statement.args[j].contents] - (i + 1)
-                    statement.args[j] = Token("literal", str(diff))
-                elif statement.name in {"jmp", "jal"}:
-                    # absolute
-                    addr = hex(PROGRAM_START_ADDR + labels[statement.args[j].contents])
-                    statement.args[j] = Token(
-                        "literal",
-                        addr,
-                    )
-                elif statement.name == "la":
-                    addr = hex(
-                        DATA_START_ADDR + data_to_offset[statement.args[j].contents]
-                    )
-                    statement.args[j] = Token("literal", addr)
-                else:
-                    raise Exception(
-                        f"Didn't expect a label for instruction {statement.name}"
-                    )
+                    diff = target - (addresses[i] + 1)
+                    args.append(str(diff) if text else diff)
+            elif name in {"jmp", "jal"}:
+                # absolute
+                addr = jump_address(addresses[self.label_index(value)])
+                args.append(hex(addr) if text else addr)
+            else:
+                # la, the only other instruction resolve lets take a label
+                addr = DATA_START_ADDR + self.data_offset(value)
+                args.append(hex(addr) if text else addr)
+        return name, args
+
+    def statements(self) -> Iterator[Tuple[str, List[Operand]]]:
+        return map(self.statement, range(len(self)))
+
+
+def resolve(
+    program: Union[Program, List[Union[DataSegment, TextSegment]]],
+    optimize: bool = False,
+    stats: Optional[Dict[str, int]] = None,
+    analysis: Optional["Analysis"] = None,
+) -> Layout:
+    """
+    Lays out the program, which can also be given as segments. With
+    optimize, the peephole pass runs first and the number of instructions
+    each of its rules removed is added to stats. An analysis is run over
+    the laid out program
+    """
+    program = as_program(program)
+    if optimize:
+        segments, removed = peephole.optimize(program.segments())
+        if stats is not None:
+            stats.update(removed)
+        program = Program.from_segments(segments)
+    names = program.symbols.names
+
+    # first pass is locate all labels and calculate addresses of
+    # data
+    labels = {}  # symbol : statement_idx
+    for symbol, at in zip(program.label_ids, program.label_at):
+        if at == len(program):
+            # labels after the last instruction point nowhere
+            continue
+        if symbol in labels:
+            raise Exception(f"Label {names[symbol]} already exists")
+        labels[symbol] = at + 1
+    data_to_offset = {}
+    if program.data_blocks:
+        offsets = accumulate(
+            (program.data_length(i) for i in range(len(program.data_ids))), initial=0
+        )
+    else:
+        offsets = program.data_start
+    for symbol, offset in zip(program.data_ids, offsets):
+        if symbol in data_to_offset:
+            raise Exception(f"{names[symbol]} already declared!")
+        data_to_offset[symbol] = offset
+
+    # second pass works out the word address of every statement
+    result = Layout(program, labels, data_to_offset)
+    layout(result)
+    if analysis is not None:
+        analysis.run(result)
+    return result
+
+
+def branch_in_range(diff: int) -> bool:
+    return -(1 << (IMM_WIDTH - 1)) <= diff < (1 << (IMM_WIDTH - 1))
+
+
+def jump_address(index: int) -> int:
+    """
+    Returns the absolute address of the text word at index
+    """
+    addr = PROGRAM_START_ADDR + index
+    if addr > JMP_ADDR_MASK:
+        raise Exception(f"Jump target at word {index} is out of range")
+    return addr
+
+
+def layout(result: Layout):
+    """
+    Fills in the address of every statement and the branches that need to
+    become an inverted branch over a jmp. Relaxing a branch moves everything
+    after it, which can push other branches out of range, so this repeats
+    until nothing changes. Branches only ever grow, so that happens after
+    at most one round per branch
+    """
+    program = result.program
+    ops, arg_start, kinds, args = (
+        program.ops,
+        program.arg_start,
+        program.arg_kinds,
+        program.args,
+    )
+    takes_label = {MNEMONIC_IDS[name] for name in REFERENCE_KINDS}
+    is_branch = {MNEMONIC_IDS["beq"], MNEMONIC_IDS["bne"]}
+    is_macro = {MNEMONIC_IDS[name] for name in MACROS}
+
+    sizes = array("i", [1]) * len(result)
+    branches = []  # (statement_idx, target statement_idx)
+    for i, op in enumerate(ops):
+        start, end = arg_start[i], arg_start[i + 1]
+        if LABEL in kinds[start:end]:
+            if op not in takes_label:
+                raise Exception(
+                    f"Didn't expect a label for instruction {MNEMONICS[op]}"
+                )
+            if op in is_branch and kinds[end - 1] == LABEL:
+                branches.append((i + 1, result.label_index(args[end - 1])))
+        if op in is_macro:
+            sizes[i + 1] = size_of(MNEMONICS[op], *program.operands(i))
+
+    relaxed = result.relaxed
+    while True:
+        addresses = array("i", accumulate(sizes, initial=0))
+        grown = False
+        for i, target in branches:
+            if i in relaxed:
+                continue
+            if not branch_in_range(addresses[target] - (addresses[i] + 1)):
+                relaxed.add(i)
+                sizes[i] = size_of(f"{MNEMONICS[ops[i - 1]]}.far")
+                grown = True
+        if not grown:
+            result.addresses = addresses
+            return
+
+
+def assemble_image(
+    program: Union[Program, List[Union[DataSegment, TextSegment]]],
+    optimize: bool = False,
+    stats: Optional[Dict[str, int]] = None,
+    analysis: Optional["Analysis"] = None,
+) -> Image:
+    return layout_image(resolve(program, optimize, stats, analysis))
+
+
+def layout_image(result: Layout, jobs: int = 1) -> Image:
+    """
+    Encodes a resolved program. With more than one job, big programs are
+    encoded in that many processes
+    """
+    program = result.program
+    if jobs > 1:
+        from .parallel import encode_parallel
+
+        text = encode_parallel(result, jobs)
+    else:
+        try:
+            import numpy  # noqa: F401
+        except ImportError:
+            text = array("I", encode_many(result.statements()))
+        else:
+            text = encode_columns(result)
+    if program.data_blocks:
+        data = array("I")
+        for i in range(len(program.data_ids)):
+            for words in program.data_words(i):
+                data.extend(words)
+    else:
+        literal_values = program.literal_values
+        data = array("I", (literal_values[v] & WORD_MASK for v in program.data_values))
+    return Image(text, data)
+
+
+# literals past this can't fit any field, so the checks fail on them all
+# the same without overflowing int64
+LITERAL_LIMIT = 1 << 40
+
+
+def encode_columns(result: Layout) -> array:
+    """
+    Encodes the text of a resolved program with numpy, a column at a time.
+    The jmp to main, macros, relaxed branches and instructions a check
+    fails on are encoded one at a time instead, so errors come out the same
+    as from encode_many
+    """
+    import numpy as np
+
+    program = result.program
+    ops = np.frombuffer(program.ops, dtype=np.uint8)
+    arg_start = np.frombuffer(program.arg_start, dtype=np.int32)
+    kinds = np.frombuffer(program.arg_kinds, dtype=np.uint8)
+    values = np.frombuffer(program.args, dtype=np.int32).astype(np.int64)
+    addresses = np.frombuffer(result.addresses, dtype=np.int32).astype(np.int64)
+    count = np.diff(arg_start)
+
+    literals = np.fromiter(
+        (max(-LITERAL_LIMIT, min(v, LITERAL_LIMIT)) for v in program.literal_values),
+        dtype=np.int64,
+        count=len(program.literal_values),
+    )
+    literal = kinds == LITERAL
+    values[literal] = literals[values[literal]]
+
+    # text labels become branch offsets or jump addresses, data labels are
+    # only taken by la, which is a macro
+    targets = np.full(len(program.symbols.names), -1, dtype=np.int64)
+    for symbol, i in result.labels.items():
+        targets[symbol] = result.addresses[i]
+    label = kinds == LABEL
+    owner = np.repeat(np.arange(len(program)), count)[label]
+    target = targets[values[label]]
+    branch = np.isin(ops[owner], [MNEMONIC_IDS["beq"], MNEMONIC_IDS["bne"]])
+    values[label] = np.where(
+        branch, target - (addresses[owner + 1] + 1), PROGRAM_START_ADDR + target
+    )
+
+    # operands past the ones an instruction has are read as 0
+    padded = np.concatenate([values, np.zeros(3, dtype=np.int64)])
+    first, second, third = (
+        np.where(count > k, padded[arg_start[:-1] + k], 0) for k in range(3)
+    )
+    entries = [ENCODINGS.get(name) for name in MNEMONICS]
+    packer = np.array([-1 if e is None else PACKERS.index(e[0]) for e in entries])
+    arity = np.array(
+        [-1 if e is None else ARITIES[PACKERS.index(e[0])] for e in entries]
+    )
+    opcode = np.array([0 if e is None else e[1] for e in entries], dtype=np.int64)
+    funct = np.array([0 if e is None else e[2] for e in entries], dtype=np.int64)
+    words, packed = pack_columns(
+        packer[ops], opcode[ops], funct[ops], first, second, third
+    )
+    packed &= count == arity[ops]
+    packed[owner[target < 0]] = False
+    packed[
+        np.fromiter(result.relaxed, dtype=np.int64, count=len(result.relaxed)) - 1
+    ] = False
+
+    text = np.empty(addresses[-1], dtype=np.uint32)
+    text[addresses[1:-1]] = words
+    for i in chain([0], (np.flatnonzero(~packed) + 1).tolist()):
+        name, args = result.statement(i)
+        text[addresses[i] : addresses[i + 1]] = encode_words(name, *args)
+    return array("I", text.tobytes())
+
+
+def assemble_lines(
+    program: Union[Program, List[Union[DataSegment, TextSegment]]],
+    optimize: bool = False,
+    stats: Optional[Dict[str, int]] = None,
+    analysis: Optional["Analysis"] = None,
+) -> Iterator[str]:
+    """
+    Yields the lines of the memdump, annotated with the source
+    """
+    result = resolve(program, optimize, stats, analysis)
+    return layout_lines(result, layout_image(result))
+
+
+def layout_lines(result: Layout, image: Optional[Image] = None) -> Iterator[str]:
+    """
+    Yields the annotated memdump of a resolved program. The words of the
+    text are taken from image when it's given, instead of encoded again
+    """
+    program = result.program
+    addresses = result.addresses
+    names = program.symbols.names
 
     # technically assemblers can do everything in 2 passes
     # but we'll do the translation in a third pass
-    results = ["// ------ Program Part ------", "@00001000"]
-    sorted_labels = sorted([(idx, label) for label, idx in labels.items()])
+    yield "// ------ Program Part ------"
+    yield "@00001000"
+    sorted_labels = sorted(
+        [(idx, names[label]) for label, idx in result.labels.items()]
+    )
     label_idx = 0
-    for i, statement in enumerate(filtered_statements):
-        args = list(map(lambda t: t.contents, statement.args))
-        tmp = [encode(statement.name, *args), "    //"]
+    for i in range(len(result)):
+        name, args = result.statement(i, text=True)
+        if image is None:
+            words = encode(name, *args)
+        else:
+            words = "\n".join(map(to_hex, image.text[addresses[i] : addresses[i + 1]]))
+        tmp = [words, "    //"]
         while label_idx < len(sorted_labels) and sorted_labels[label_idx][0] <= i:
             tmp.append(f" {sorted_labels[label_idx][1]}:")
             label_idx += 1
-        tmp.append(f" {statement.name}")
+        tmp.append(f" {name}")
         if len(args) > 0:
             tmp.append(" " + ", ".join(args))
         tmp.append(";")
-        results.append("".join(tmp))
-
-    if len(filtered_datas) > 0:
-        results.append("")  # newline for breathing space
-        results.append("// ------ Data Part ------")
-        results.append("@01008000")  # data start
-        for data in filtered_datas:
-            for i, val in enumerate(data.values):
-                # modelsim expects everything in hex already
-                # so we remove the leading "0x" and pad to 8 digits just in case
-                binary = imm_to_binary(val.contents, 32)
-                results.append(hex(int(binary, 2))[2:].rjust(8, "0"))
-                if i == 0:
-                    results[-1] += (
-                        f"    // {data.name}: {', '.join(map(lambda a: a.contents, data.values))}".rstrip()
-                        + ";"
-                    )
-
-    return "\n".join(results)
+        yield "".join(tmp)
+
+    if len(program.data_ids) > 0:
+        yield ""  # newline for breathing space
+        yield "// ------ Data Part ------"
+        yield "@01008000"  # data start
+        for d, symbol in enumerate(program.data_ids):
+            comment = f"    // {names[symbol]}: {program.data_text(d)}".rstrip() + ";"
+            for words in program.data_words(d):
+                for word in words:
+                    # modelsim expects everything in hex already
+                    # so we remove the leading "0x" and pad to 8 digits just in case
+                    yield f"{word:08x}{comment}"
+                    comment = ""
+
+
+def assemble(
+    program: Union[Program, List[Union[DataSegment, TextSegment]]],
+    optimize: bool = False,
+    stats: Optional[Dict[str, int]] = None,
+    analysis: Optional["Analysis"] = None,
+) -> str:
+    return "\n".join(assemble_lines(program, optimize, stats, analysis))
+
+
+# ==============================
+# Streaming assembly
+# ==============================
+BRANCH = "branch"  # beq/bne, 16 bit offset relative to the next instruction
+JUMP = "jump"  # jmp/jal, 26 bit absolute program address
+ADDRESS = "address"  # la, 32 bit data address split over lui/ori
+
+REFERENCE_KINDS = {
+    "beq": BRANCH,
+    "bne": BRANCH,
+    "jmp": JUMP,
+    "jal": JUMP,
+    "la": ADDRESS,
+}
+
+
+class Fixup(NamedTuple):
+    index: int  # word index into the text segment
+    kind: str
+    label: str
+
+
+def branch_offset(target: int, index: int) -> int:
+    # (PC+1)+x = label
+    # x = label - (PC+1)
+    diff = target - (index + 1)
+    if not branch_in_range(diff):
+        raise Exception(f"Branch at word {index} is out of range of its label")
+    return diff & IMM_MASK
+
+
+@dataclass
+class Fragment:
+    """
+    Relocatable output of assembling part of a program. Every label
+    reference is left as a fixup, so the words don't depend on where the
+    fragment ends up
+    """
+
+    text: array
+    data: array
+    labels: Dict[str, int]  # label : word offset
+    data_to_offset: Dict[str, int]
+    fixups: List[Fixup]
+    # labels after the last instruction, which point into the next fragment
+    trailing_labels: List[str]
+
+
+class StreamAssembler:
+    """
+    Encodes statements as they arrive. References to labels that are already
+    placed are resolved right away, forward references are kept as fixups
+    and patched by finish(), so only the words themselves grow with the
+    program. A relocatable assembler keeps every reference as a fixup and
+    is turned into a Fragment instead
+    """
+
+    def __init__(self, relocatable: bool = False):
+        self.text = array("I")
+        self.data = array("I")
+        self.labels: Dict[str, int] = {}  # label : word index
+        self.data_to_offset: Dict[str, int] = {}
+        # names more than one module defines, which only that module's own
+        # references can use
+        self.shared_labels: Set[str] = set()
+        self.shared_data: Set[str] = set()
+        self.fixups: List[Fixup] = []
+        self.cur_labels: List[str] = []
+        self.relocatable = relocatable
+        if not relocatable:
+            self.emit(Instruction("jmp", [Token("label", "main")]))
+
+    def feed(self, statement: Union[Label, Instruction, Data]):
+        if type(statement) is Label:
+            self.cur_labels.append(statement.name)
+        elif type(statement) is Instruction:
+            self.emit(statement)
+        else:
+            if statement.name in self.data_to_offset:
+                raise Exception(f"{statement.name} already declared!")
+            self.data_to_offset[statement.name] = len(self.data)
+            values = statement.values
+            if values and values[0].cls == "directive":
+                for words in data_block(values).chunks():
+                    self.data.extend(words)
+                return
+            self.data.extend(imm_to_int(val.contents) & WORD_MASK for val in values)
+
+    def emit(self, statement: Instruction):
+        index = len(self.text)
+        self.place_labels(index)
+
+        args = []
+        for arg in statement.args:
+            if arg.cls != "label":
+                args.append(arg.contents)
+                continue
+            kind = REFERENCE_KINDS.get(statement.name)
+            if kind is None:
+                raise Exception(
+                    f"Didn't expect a label for instruction {statement.name}"
+                )
+            value = None
+            if not self.relocatable:
+                value = self.lookup(kind, arg.contents, index)
+            if value is None:
+                # leave the field zeroed until the label shows up
+                self.fixups.append(Fixup(index, kind, arg.contents))
+                value = 0
+            args.append(value)
+        self.text.extend(encode_words(statement.name, *args))
+
+    def place_labels(self, index: int, module: bool = False):
+        for label in self.cur_labels:
+            if label in self.labels:
+                if not module:
+                    raise Exception(f"Label {label} already exists")
+                self.shared_labels.add(label)
+                continue
+            self.labels[label] = index
+        self.cur_labels = []
+
+    def include(self, fragment: Fragment, module: bool = False):
+        """
+        Appends an already assembled fragment. A module's references to its
+        own labels are patched right away, so modules can each have their
+        own loop: and only names used from another module need to be unique
+        """
+        base = len(self.text)
+        data_base = len(self.data)
+        if len(fragment.text) > 0:
+            self.place_labels(base, module)
+        for label, offset in fragment.labels.items():
+            self.cur_labels.append(label)
+            self.place_labels(base + offset, module)
+        for name, offset in fragment.data_to_offset.items():
+            if name in self.data_to_offset:
+                if not module:
+                    raise Exception(f"{name} already declared!")
+                self.shared_data.add(name)
+                continue
+            self.data_to_offset[name] = data_base + offset
+        self.text.extend(fragment.text)
+        self.data.extend(fragment.data)
+        for index, kind, label in fragment.fixups:
+            index += base
+            if module and kind == ADDRESS and label in fragment.data_to_offset:
+                target = data_base + fragment.data_to_offset[label]
+            elif module and kind != ADDRESS and label in fragment.labels:
+                target = base + fragment.labels[label]
+            else:
+                self.fixups.append(Fixup(index, kind, label))
+                continue
+            self.patch(index, kind, reference(kind, target, index))
+        self.cur_labels.extend(fragment.trailing_labels)
+
+    def fragment(self) -> Fragment:
+        return Fragment(
+            self.text,
+            self.data,
+            self.labels,
+            self.data_to_offset,
+            self.fixups,
+            self.cur_labels,
+        )
+
+    def lookup(self, kind: str, label: str, index: int):
+        if kind == ADDRESS:
+            targets, shared = self.data_to_offset, self.shared_data
+        else:
+            targets, shared = self.labels, self.shared_labels
+        if label in shared:
+            raise Exception(f"Label {label} is defined by more than one module")
+        if label not in targets:
+            return None
+        return reference(kind, targets[label], index)
+
+    def patch(self, index: int, kind: str, value: int):
+        text = self.text
+        if kind == ADDRESS:
+            text[index] |= value >> IMM_WIDTH
+            text[index + 1] |= value & IMM_MASK
+        elif kind == JUMP:
+            text[index] |= value & JMP_ADDR_MASK
+        else:
+            text[index] |= value
+
+    def finish(self) -> Image:
+        for index, kind, label in self.fixups:
+            value = self.lookup(kind, label, index)
+            if value is None:
+                raise Exception(f"Unknown label {label}")
+            self.patch(index, kind, value)
+        self.fixups = []
+        return Image(self.text, self.data)
+
+
+def reference(kind: str, target: int, index: int) -> int:
+    """
+    Returns the field value for a reference of the given kind from the word
+    at index to the text index or data offset target
+    """
+    if kind == ADDRESS:
+        return DATA_START_ADDR + target
+    if kind == BRANCH:
+        return branch_offset(target, index)
+    return jump_address(target)
+
+
+def assemble_stream(statements: Iterable[Union[Label, Instruction, Data]]) -> Image:
+    """
+    One-pass assembly of a statement stream, such as grammar.iter_parse's
+    """
+    assembler = StreamAssembler()
+    for statement in statements:
+        assembler.feed(statement)
+    return assembler.finish()
+
+
+def assemble_fragment(
+    statements: Iterable[Union[Label, Instruction, Data]],
+) -> Fragment:
+    assembler = StreamAssembler(relocatable=True)
+    for statement in statements:
+        assembler.feed(statement)
+    return assembler.fragment()
+
+
+def link(fragments: Iterable[Fragment], modules: bool = False) -> Image:
+    """
+    Lays fragments out one after the other and patches their fixups. With
+    modules, every fragment keeps its own labels, see StreamAssembler.include
+    """
+    assembler = StreamAssembler()
+    for fragment in fragments:
+        assembler.include(fragment, modules)
+    return assembler.finish()
@@ -0,0 +1,80 @@
+import mmap
+import os
+import sys
+from array import array
+from typing import Iterator, List, Union
+from .translator import WORD_MASK
+
+# bulk data is handed around in arrays of at most this many words, so that
+# nothing ever needs a Python object per word
+CHUNK_WORDS = 1 << 16
+WORD_BYTES = 4
+
+
+class Fill:
+    """
+    `.fill count, value` and `.space count`: count copies of one word
+    """
+
+    __slots__ = ("count", "value", "tokens")
+
+    def __init__(self, count: int, value: int, tokens: List):
+        if count < 0:
+            raise Exception(f"Can't repeat a word {count} times")
+        self.count = count
+        self.value = value & WORD_MASK
+        self.tokens = tokens  # the directive and its arguments
+
+    def __len__(self):
+        return self.count
+
+    def chunks(self) -> Iterator[array]:
+        full, rest = divmod(self.count, CHUNK_WORDS)
+        if full:
+            chunk = array("I", [self.value]) * CHUNK_WORDS
+            for _ in range(full):
+                yield chunk
+        if rest:
+            yield array("I", [self.value]) * rest
+
+
+class IncludedFile:
+    """
+    `.incbin "file"`: the bytes of a file as big-endian words, like the bin
+    output format writes them. The last word is padded with zero bytes. The
+    file is memory mapped and read a chunk at a time
+    """
+
+    __slots__ = ("path", "bytes", "tokens")
+
+    def __init__(self, path: str, tokens: List):
+        try:
+            self.bytes = os.stat(path).st_size
+        except OSError as e:
+            raise Exception(f"Can't include {path}: {e.strerror}") from None
+        self.path = path
+        self.tokens = tokens
+
+    def __len__(self):
+        return -(-self.bytes // WORD_BYTES)
+
+    def chunks(self) -> Iterator[array]:
+        if self.bytes == 0:
+            return
+        with open(self.path, "rb") as f, mmap.mmap(
+            f.fileno(), 0, access=mmap.ACCESS_READ
+        ) as contents:
+            if len(contents) != self.bytes:
+                raise Exception(f"{self.path} changed while it was being assembled")
+            step = CHUNK_WORDS * WORD_BYTES
+            for start in range(0, self.bytes, step):
+                piece = contents[start : start + step]
+                if len(piece) % WORD_BYTES:
+                    piece += bytes(WORD_BYTES - len(piece) % WORD_BYTES)
+                words = array("I", piece)
+                if sys.byteorder == "little":
+                    words.byteswap()
+                yield words
+
+
+Block = Union[Fill, IncludedFile]
@@ -0,0 +1,176 @@
+import hashlib
+import os
+import re
+from collections import OrderedDict
+from typing import Dict, List, Optional
+from .assembler import Fragment, Image, assemble_fragment, link
+from .grammar import iter_parse, lex, preprocess, relative_to
+from .objfile import dump, load
+from .peephole import optimize_statements
+
+# bump whenever the encoding or the Fragment layout changes
+CACHE_VERSION = b"dvassembler-cache-2"
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+MEMORY_ENTRIES = 256
+
+# strings and comments are matched so that directives in them, like the
+# .data of .incbin "table.data", are skipped. Without capturing groups the
+# regex runs several times faster
+SEGMENT_START = re.compile(r'"[^"\n]*"|\#.*|\.(?:macro|rept|text|data)')
+SKIPPED = {'"', "#"}
+EXPANDING = {".macro", ".rept"}
+INCBIN = re.compile(r'(\#.*)|\.incbin\s+"([^"\n]*)"')
+
+
+def default_cache_dir() -> str:
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    return os.path.join(base, "dvassembler")
+
+
+def split_segments(contents: str) -> List[str]:
+    """
+    Splits the source in front of every .text and .data directive, without
+    lexing anything else. Text before the first directive is kept as its
+    own chunk so that the parser still rejects it. Macros can be used in
+    any segment after their definition and repeats can span segments, so a
+    source with either is kept whole
+    """
+    starts = []
+    for match in SEGMENT_START.finditer(contents):
+        directive = match.group()
+        if directive in EXPANDING:
+            return [contents]
+        if directive[0] not in SKIPPED:
+            starts.append(match.start())
+    if not starts or starts[0] != 0:
+        starts.insert(0, 0)
+    starts.append(len(contents))
+    return [contents[a:b] for a, b in zip(starts, starts[1:])]
+
+
+class AssemblyCache:
+    """
+    On-disk cache of assembled segments keyed by a hash of their source.
+    Entries are evicted least recently used first once the directory grows
+    past max_bytes, and recently used ones are also kept in memory. With
+    optimize, segments go through the peephole pass and the instructions
+    it removes from every segment that isn't cached are added to stats
+    """
+
+    def __init__(
+        self,
+        directory: Optional[str] = None,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        optimize: bool = False,
+        stats: Optional[Dict[str, int]] = None,
+    ):
+        self.directory = directory or default_cache_dir()
+        self.max_bytes = max_bytes
+        self.optimize = optimize
+        self.stats = stats
+        self.memory: "OrderedDict[str, Fragment]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.directory, exist_ok=True)
+
+    def key(self, source: str, directory: Optional[str] = None) -> str:
+        salt = CACHE_VERSION + (b"-O" if self.optimize else b"")
+        digest = hashlib.sha256(salt + source.encode())
+        # a segment that includes files is only unchanged if they are too
+        for match in INCBIN.finditer(source):
+            if match.group(2) is None:
+                continue
+            path = os.path.join(directory or "", match.group(2))
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue  # assembling it reports the missing file
+            digest.update(f"\0{path}\0{stat.st_size}\0{stat.st_mtime_ns}".encode())
+        return digest.hexdigest()
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.frag")
+
+    def remember(self, key: str, fragment: Fragment):
+        self.memory[key] = fragment
+        self.memory.move_to_end(key)
+        if len(self.memory) > MEMORY_ENTRIES:
+            self.memory.popitem(last=False)
+
+    def get(self, key: str) -> Optional[Fragment]:
+        fragment = self.memory.get(key)
+        if fragment is not None:
+            self.memory.move_to_end(key)
+            return fragment
+        path = self.path(key)
+        try:
+            with open(path, "rb") as f:
+                fragment = load(f)
+            # the mtime doubles as the last access time for eviction
+            os.utime(path)
+        except Exception:
+            # missing or corrupt entries are just misses
+            return None
+        self.remember(key, fragment)
+        return fragment
+
+    def put(self, key: str, fragment: Fragment):
+        self.remember(key, fragment)
+        path = self.path(key)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            dump(fragment, f)
+        os.replace(tmp, path)
+        self.evict()
+
+    def evict(self):
+        entries = []
+        total = 0
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith(".frag"):
+                continue
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total += stat.st_size
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+    def fragment(self, source: str, directory: Optional[str] = None) -> Fragment:
+        key = self.key(source, directory)
+        fragment = self.get(key)
+        if fragment is not None:
+            self.hits += 1
+            return fragment
+        self.misses += 1
+        tokens = lex(source)
+        if directory is not None:
+            tokens = relative_to(tokens, directory)
+        statements = iter_parse(preprocess(tokens))
+        if self.optimize:
+            statements, removed = optimize_statements(statements)
+            if self.stats is not None:
+                self.stats.update(removed)
+        fragment = assemble_fragment(statements)
+        self.put(key, fragment)
+        return fragment
+
+
+def assemble_cached(
+    contents: str, cache: AssemblyCache, directory: Optional[str] = None
+) -> Image:
+    """
+    Assembles the source segment by segment, reusing the encoded words of
+    every segment whose source and included files are unchanged. Label
+    references are always patched again while linking, which only costs one
+    step per reference
+    """
+    return link(cache.fragment(chunk, directory) for chunk in split_segments(contents))
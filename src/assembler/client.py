@@ -0,0 +1,127 @@
+import http.client
+import json
+import os
+import socket
+import sys
+import tempfile
+from argparse import ArgumentParser
+from typing import Dict, Optional
+
+# kept free of the assembler's own modules so that it starts quickly
+DEFAULT_PORT = 8147
+
+
+def default_socket_path() -> str:
+    return os.path.join(tempfile.gettempdir(), f"dvassembler-{os.getuid()}.sock")
+
+
+class Client:
+    """
+    Connection to a running dvassembler serve, kept open between requests.
+    Talks to the unix socket unless a port is given
+    """
+
+    def __init__(
+        self,
+        socket_path: Optional[str] = None,
+        host: str = "127.0.0.1",
+        port: Optional[int] = None,
+    ):
+        self.socket_path = socket_path or default_socket_path()
+        self.host = host
+        self.port = port
+        self.connection = None
+
+    def request(self, request: Dict) -> Dict:
+        body = json.dumps(request).encode()
+        if self.port is not None:
+            if self.connection is None:
+                self.connection = http.client.HTTPConnection(self.host, self.port)
+            self.connection.request(
+                "POST", "/assemble", body, {"Content-Type": "application/json"}
+            )
+            return json.loads(self.connection.getresponse().read())
+        if self.connection is None:
+            self.connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.connection.connect(self.socket_path)
+            self.reader = self.connection.makefile("rb")
+        self.connection.sendall(body + b"\n")
+        line = self.reader.readline()
+        if not line:
+            raise Exception("Server closed the connection")
+        return json.loads(line)
+
+    def assemble(
+        self,
+        source: str,
+        format: str = "memh",
+        optimize: bool = False,
+        comments: bool = True,
+        stats: Optional[Dict[str, int]] = None,
+    ) -> str:
+        """
+        Returns the output dvassembler would write for source. The
+        instructions removed by the peephole pass are added to stats
+        """
+        response = self.request(
+            {
+                "source": source,
+                "format": format,
+                "optimize": optimize,
+                "comments": comments,
+            }
+        )
+        if not response["ok"]:
+            raise Exception(response["error"])
+        if stats is not None:
+            stats.update(response["removed"])
+        return response["output"]
+
+    def close(self):
+        if self.connection is not None:
+            if self.port is None:
+                self.reader.close()
+            self.connection.close()
+            self.connection = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+
+def main():
+    parser = ArgumentParser("CS147 Assembler client")
+    parser.add_argument("INPUT_FILE", type=str)
+    parser.add_argument(
+        "-o", "--output", type=str, help="output path (default: standard out)"
+    )
+    parser.add_argument(
+        "--format", choices=["memh", "ihex"], default="memh", help="output format"
+    )
+    parser.add_argument("-O", "--optimize", action="store_true")
+    parser.add_argument("--no-comments", action="store_true")
+    listen = parser.add_mutually_exclusive_group()
+    listen.add_argument("--socket", type=str, metavar="PATH")
+    listen.add_argument("--port", type=int, nargs="?", const=DEFAULT_PORT)
+    args = parser.parse_args()
+
+    with open(args.INPUT_FILE) as f:
+        source = f.read()
+    try:
+        with Client(args.socket, port=args.port) as client:
+            output = client.assemble(
+                source, args.format, args.optimize, not args.no_comments
+            )
+    except (ConnectionError, FileNotFoundError) as e:
+        print(f"error: can't reach dvassembler serve: {e}", file=sys.stderr)
+        sys.exit(2)
+    except Exception as e:
+        print(f"error: {e}", file=sys.stderr)
+        sys.exit(1)
+    if args.output is None:
+        sys.stdout.write(output)
+    else:
+        with open(args.output, "w") as f:
+            f.write(output)
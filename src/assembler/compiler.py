@@ -0,0 +1,1033 @@
+import re
+import sys
+from argparse import ArgumentParser
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple, Union
+from .grammar import KEYWORDS, Data, Instruction, Label, Program, Token, quote, where
+from .regalloc import (
+    ARGUMENT_REGISTERS,
+    CALL,
+    ENTRY,
+    IMM_MAX,
+    IMM_MIN,
+    LABEL,
+    MOVE,
+    RETURN,
+    ZERO,
+    Function,
+    Op,
+    VReg,
+    allocate,
+    lower,
+    operand_token,
+)
+
+# ==============================
+# Lexing
+# ==============================
+SCANNER = re.compile(
+    r"""
+    (?P<whitespace>[\t\r\n ]+)
+    |(?P<comment>//[^\n]*|/\*(?:[^*]|\*(?!/))*\*/)
+    |(?P<number>0[xX][0-9a-fA-F]+|[0-9]+)
+    |(?P<name>[a-zA-Z_][a-zA-Z_0-9]*)
+    |(?P<operator><<|>>|<=|>=|==|!=|&&|\|\||[-+*/%&|^~!<>=(){}\[\];,])
+    |(?P<error>.)
+    """,
+    re.VERBOSE,
+)
+RESERVED = {"int", "void", "if", "else", "while", "return", "break", "continue"}
+WORD_MASK = (1 << 32) - 1
+
+
+def lex(contents: str) -> Iterator[Token]:
+    """
+    Yields the tokens of C source, followed by an "end" token
+    """
+    line = 1
+    line_start = 0
+    for match in SCANNER.finditer(contents):
+        cls = match.lastgroup
+        text = match.group()
+        position = match.start()
+        if cls in {"whitespace", "comment"}:
+            newlines = text.count("\n")
+            if newlines:
+                line += newlines
+                line_start = position + text.rindex("\n") + 1
+            continue
+        if cls == "name" and text in RESERVED:
+            cls = "keyword"
+        elif cls == "error":
+            end = contents.find("\n", position)
+            rest = contents[position:] if end == -1 else contents[position:end]
+            raise Exception(
+                f"Unexpected token starting at {quote(rest)} "
+                f"(line {line}, column {position - line_start + 1})"
+            )
+        yield Token(cls, text, line, position - line_start + 1)
+    yield Token("end", "end of file", line, len(contents) - line_start + 1)
+
+
+# ==============================
+# Syntax tree
+# ==============================
+class Num(NamedTuple):
+    value: int  # signed 32 bit
+    token: Token
+
+
+class Name(NamedTuple):
+    name: str
+    token: Token
+
+
+class Index(NamedTuple):
+    name: str
+    index: "Expression"
+    token: Token
+
+
+class CallExpr(NamedTuple):
+    name: str
+    args: List["Expression"]
+    token: Token
+
+
+class Unary(NamedTuple):
+    op: str
+    operand: "Expression"
+    token: Token
+
+
+class Binary(NamedTuple):
+    op: str
+    left: "Expression"
+    right: "Expression"
+    token: Token
+
+
+Expression = Union[Num, Name, Index, CallExpr, Unary, Binary]
+
+
+class Declare(NamedTuple):
+    name: str
+    value: Optional[Expression]
+    token: Token
+
+
+class Assign(NamedTuple):
+    target: Union[Name, Index]
+    value: Expression
+    token: Token
+
+
+class If(NamedTuple):
+    condition: Expression
+    then: "Statement"
+    otherwise: Optional["Statement"]
+    token: Token
+
+
+class While(NamedTuple):
+    condition: Expression
+    body: "Statement"
+    token: Token
+
+
+class Return(NamedTuple):
+    value: Optional[Expression]
+    token: Token
+
+
+class Jump(NamedTuple):
+    kind: str  # break or continue
+    token: Token
+
+
+class Block(NamedTuple):
+    statements: List["Statement"]
+    token: Token
+
+
+class Evaluate(NamedTuple):
+    value: Expression
+    token: Token
+
+
+Statement = Union[Declare, Assign, If, While, Return, Jump, Block, Evaluate]
+
+
+class Global(NamedTuple):
+    name: str
+    size: Optional[int]  # words of an array, None for an int
+    values: List[int]
+    token: Token
+
+
+class Param(NamedTuple):
+    name: str
+    array: bool
+    token: Token
+
+
+class FunctionDef(NamedTuple):
+    name: str
+    returns: bool  # int rather than void
+    params: List[Param]
+    body: Block
+    token: Token
+
+
+# ==============================
+# Parsing
+# ==============================
+# binary operator : precedence, higher binds tighter
+PRECEDENCE = {
+    "||": 1,
+    "&&": 2,
+    "|": 3,
+    "^": 4,
+    "&": 5,
+    **dict.fromkeys(["==", "!="], 6),
+    **dict.fromkeys(["<", "<=", ">", ">="], 7),
+    **dict.fromkeys(["<<", ">>"], 8),
+    **dict.fromkeys(["+", "-"], 9),
+    **dict.fromkeys(["*", "/", "%"], 10),
+}
+UNSUPPORTED = {"/": "division", "%": "remainder"}
+
+
+def signed32(value: int) -> int:
+    value &= WORD_MASK
+    return value - (1 << 32) if value >> 31 else value
+
+
+def fold(op: str, a: int, b: int) -> Optional[int]:
+    """
+    Returns what a op b is at compile time, or None when it's left to run
+    """
+    if op in {"<<", ">>"} and not 0 <= b < 32:
+        return None
+    result = {
+        "+": lambda: a + b,
+        "-": lambda: a - b,
+        "*": lambda: a * b,
+        "&": lambda: a & b,
+        "|": lambda: a | b,
+        "^": lambda: a ^ b,
+        "<<": lambda: a << b,
+        ">>": lambda: (a & WORD_MASK) >> b,
+        "<": lambda: a < b,
+        "<=": lambda: a <= b,
+        ">": lambda: a > b,
+        ">=": lambda: a >= b,
+        "==": lambda: a == b,
+        "!=": lambda: a != b,
+        "&&": lambda: bool(a and b),
+        "||": lambda: bool(a or b),
+    }[op]()
+    return signed32(int(result))
+
+
+class Parser:
+    """
+    Recursive descent parser for the C subset: int globals and arrays, and
+    int and void functions of ints and arrays, made of int locals, if,
+    while, return, break, continue and assignments. Constant expressions
+    are folded as they're parsed
+    """
+
+    def __init__(self, source: str):
+        self.tokens = lex(source)
+        self.tok = next(self.tokens)
+
+    def advance(self) -> Token:
+        tok = self.tok
+        self.tok = next(self.tokens)
+        return tok
+
+    def at(self, contents: str) -> bool:
+        return self.tok.contents == contents and self.tok.cls in {"operator", "keyword"}
+
+    def accept(self, contents: str) -> Optional[Token]:
+        return self.advance() if self.at(contents) else None
+
+    def expect(self, contents: str) -> Token:
+        if not self.at(contents):
+            self.fail(f"Expected {contents}")
+        return self.advance()
+
+    def name(self) -> Token:
+        if self.tok.cls != "name":
+            self.fail("Expected a name")
+        return self.advance()
+
+    def fail(self, message: str):
+        raise Exception(f"{message}, got {quote(self.tok.contents)}{where(self.tok)}")
+
+    def program(self) -> Tuple[List[Global], List[FunctionDef]]:
+        globals_: List[Global] = []
+        functions: List[FunctionDef] = []
+        while self.tok.cls != "end":
+            returns = self.accept("void") is None
+            if returns:
+                self.expect("int")
+            name = self.name()
+            if self.at("("):
+                functions.append(self.function(name, returns))
+            elif not returns:
+                self.fail("Expected (")
+            else:
+                globals_.append(self.global_(name))
+        return globals_, functions
+
+    def global_(self, name: Token) -> Global:
+        size = None
+        if self.accept("["):
+            size = self.number()
+            if size <= 0:
+                raise Exception(f"Array {name.contents} needs a size{where(name)}")
+            self.expect("]")
+        values = []
+        if self.accept("="):
+            if size is None:
+                values.append(self.number())
+            else:
+                self.expect("{")
+                values.append(self.number())
+                while self.accept(","):
+                    values.append(self.number())
+                self.expect("}")
+                if len(values) > size:
+                    raise Exception(
+                        f"Too many values for {name.contents}[{size}]{where(name)}"
+                    )
+        self.expect(";")
+        return Global(name.contents, size, values, name)
+
+    def number(self) -> int:
+        tok = self.tok
+        value = self.expression()
+        if type(value) is not Num:
+            raise Exception(f"Expected a constant{where(tok)}")
+        return value.value
+
+    def function(self, name: Token, returns: bool) -> FunctionDef:
+        self.expect("(")
+        params = []
+        if self.accept("void") is None and not self.at(")"):
+            params.append(self.param())
+            while self.accept(","):
+                params.append(self.param())
+        self.expect(")")
+        return FunctionDef(name.contents, returns, params, self.block(), name)
+
+    def param(self) -> Param:
+        self.expect("int")
+        name = self.name()
+        array = self.accept("[") is not None
+        if array:
+            self.expect("]")
+        return Param(name.contents, array, name)
+
+    def block(self) -> Block:
+        tok = self.expect("{")
+        statements = []
+        while not self.accept("}"):
+            if self.at("int"):
+                statements.extend(self.declaration())
+            else:
+                statements.append(self.statement())
+        return Block(statements, tok)
+
+    def declaration(self) -> List[Declare]:
+        self.expect("int")
+        declared = []
+        while True:
+            name = self.name()
+            if self.at("["):
+                raise Exception(f"Arrays have to be global{where(name)}")
+            value = self.expression() if self.accept("=") else None
+            declared.append(Declare(name.contents, value, name))
+            if not self.accept(","):
+                break
+        self.expect(";")
+        return declared
+
+    def statement(self) -> Statement:
+        tok = self.tok
+        if self.at("{"):
+            return self.block()
+        if self.accept("if"):
+            self.expect("(")
+            condition = self.expression()
+            self.expect(")")
+            then = self.statement()
+            otherwise = self.statement() if self.accept("else") else None
+            return If(condition, then, otherwise, tok)
+        if self.accept("while"):
+            self.expect("(")
+            condition = self.expression()
+            self.expect(")")
+            return While(condition, self.statement(), tok)
+        if self.accept("return"):
+            value = None if self.at(";") else self.expression()
+            self.expect(";")
+            return Return(value, tok)
+        if self.accept("break") or self.accept("continue"):
+            self.expect(";")
+            return Jump(tok.contents, tok)
+        if self.accept(";"):
+            return Block([], tok)
+        value = self.expression()
+        if self.accept("="):
+            if type(value) not in {Name, Index}:
+                raise Exception(f"Can't assign to this{where(tok)}")
+            statement = Assign(value, self.expression(), tok)
+        else:
+            statement = Evaluate(value, tok)
+        self.expect(";")
+        return statement
+
+    def expression(self, precedence: int = 1) -> Expression:
+        left = self.unary()
+        while True:
+            tok = self.tok
+            op = tok.contents
+            if tok.cls != "operator" or PRECEDENCE.get(op, 0) < precedence:
+                return left
+            if op in UNSUPPORTED:
+                raise Exception(
+                    f"There's no {UNSUPPORTED[op]}, the CPU can't divide{where(tok)}"
+                )
+            self.advance()
+            right = self.expression(PRECEDENCE[op] + 1)
+            if type(left) is Num and type(right) is Num:
+                folded = fold(op, left.value, right.value)
+                if folded is not None:
+                    left = Num(folded, tok)
+                    continue
+            left = Binary(op, left, right, tok)
+
+    def unary(self) -> Expression:
+        tok = self.tok
+        if tok.cls == "operator" and tok.contents in {"-", "!", "~"}:
+            self.advance()
+            operand = self.unary()
+            if type(operand) is Num:
+                value = operand.value
+                folded = {"-": -value, "!": int(not value), "~": ~value}[tok.contents]
+                return Num(signed32(folded), tok)
+            return Unary(tok.contents, operand, tok)
+        return self.primary()
+
+    def primary(self) -> Expression:
+        tok = self.tok
+        if tok.cls == "number":
+            self.advance()
+            value = int(tok.contents, 0)
+            if value > WORD_MASK:
+                raise Exception(f"{tok.contents} doesn't fit in 32 bits{where(tok)}")
+            return Num(signed32(value), tok)
+        if self.accept("("):
+            value = self.expression()
+            self.expect(")")
+            return value
+        name = self.name()
+        if self.accept("("):
+            args = []
+            if not self.accept(")"):
+                args.append(self.expression())
+                while self.accept(","):
+                    args.append(self.expression())
+                self.expect(")")
+            return CallExpr(name.contents, args, name)
+        if self.accept("["):
+            index = self.expression()
+            self.expect("]")
+            return Index(name.contents, index, name)
+        return Name(name.contents, name)
+
+
+def parse(source: str) -> Tuple[List[Global], List[FunctionDef]]:
+    return Parser(source).program()
+
+
+# ==============================
+# Code generation
+# ==============================
+MAIN = "main"
+# operator : instruction, and the one that takes an immediate
+ARITHMETIC = {
+    "+": ("add", "addi"),
+    "-": ("sub", None),
+    "*": ("mul", "muli"),
+    "&": ("and", "andi"),
+    "|": ("or", "ori"),
+    "^": (None, None),
+    "<<": (None, "sll"),
+    ">>": (None, "srl"),
+}
+COMMUTATIVE = {"+", "*", "&", "|", "^"}
+UNSIGNED_IMMEDIATES = {"andi", "ori"}
+# comparison : (the one it's the reverse of, whether it's negated). a <= b
+# is !(b < a), and so on, so everything's done with slt and slti
+COMPARISONS = {
+    "<": (False, False),
+    ">": (True, False),
+    "<=": (True, True),
+    ">=": (False, True),
+}
+
+
+class Local(NamedTuple):
+    register: VReg
+    array: bool  # holds an array's address
+
+
+class Generator:
+    """
+    Lowers one function to ops on virtual registers. Locals live in a
+    virtual register each, and every value is computed into a new one,
+    except that assignments compute straight into their local. Conditions
+    become branches, and only end up as 0 or 1 when they're used as values
+    """
+
+    def __init__(
+        self,
+        function: FunctionDef,
+        globals_: Dict[str, Global],
+        functions: Dict[str, FunctionDef],
+    ):
+        self.function = function
+        self.globals = globals_
+        self.functions = functions
+        self.ops: List[Op] = []
+        self.registers: List[VReg] = []
+        self.scopes: List[Dict[str, Local]] = [{}]
+        self.loops: List[Tuple[str, str]] = []  # (continue label, break label)
+        self.labels = 0
+        self.tok = function.token
+        self.zero = VReg(-1, "zero", None, ZERO)
+        self.return_address: Optional[VReg] = None
+
+    def new(self, name: str = "") -> VReg:
+        register = VReg(len(self.registers), name, None, None)
+        self.registers.append(register)
+        return register
+
+    def new_label(self) -> str:
+        self.labels += 1
+        return f"__{self.function.name}_{self.labels}"
+
+    def emit(self, name: str, *args):
+        self.ops.append(Op(name, list(args), self.tok.line, self.tok.column))
+
+    def label(self, name: str):
+        self.emit(LABEL, name)
+
+    def fail(self, message: str, tok: Token):
+        raise Exception(f"{message}{where(tok)}")
+
+    def generate(self) -> Function:
+        function = self.function
+        params = []
+        for param in function.params:
+            register = self.new(param.name)
+            self.declare(param.name, Local(register, param.array), param.token)
+            params.append(register)
+        exit = None
+        if function.name == MAIN:
+            exit = f"__{MAIN}_exit"
+            self.emit(ENTRY, None)
+            self.emit("lui", self.zero, 0)
+        else:
+            self.return_address = self.new("return address")
+            self.emit(ENTRY, self.return_address, *params)
+        self.block(function.body)
+        self.emit(RETURN, None, self.return_address)
+        return Function(function.name, reachable(self.ops), self.registers, exit)
+
+    # ==============================
+    # Names
+    # ==============================
+    def declare(self, name: str, local: Local, tok: Token):
+        if name in self.scopes[-1]:
+            self.fail(f"{name} is already declared", tok)
+        self.scopes[-1][name] = local
+
+    def lookup(self, name: str, tok: Token) -> Union[Local, Global]:
+        for scope in reversed(self.scopes):
+            if name in scope:
+                return scope[name]
+        if name in self.globals:
+            return self.globals[name]
+        self.fail(f"Unknown name {name}", tok)
+
+    def is_array(self, entry: Union[Local, Global]) -> bool:
+        return entry.array if type(entry) is Local else entry.size is not None
+
+    # ==============================
+    # Statements
+    # ==============================
+    def block(self, block: Block):
+        self.scopes.append({})
+        for statement in block.statements:
+            self.statement(statement)
+        self.scopes.pop()
+
+    def statement(self, statement: Statement):
+        self.tok = statement.token
+        kind = type(statement)
+        if kind is Block:
+            self.block(statement)
+        elif kind is Declare:
+            register = self.new(statement.name)
+            if statement.value is not None:
+                self.value(statement.value, register)
+            self.declare(statement.name, Local(register, False), statement.token)
+        elif kind is Assign:
+            self.assign(statement)
+        elif kind is If:
+            otherwise = self.new_label()
+            self.branch(statement.condition, otherwise, False)
+            self.statement(statement.then)
+            if statement.otherwise is None:
+                self.label(otherwise)
+            else:
+                end = self.new_label()
+                self.emit("jmp", end)
+                self.label(otherwise)
+                self.statement(statement.otherwise)
+                self.label(end)
+        elif kind is While:
+            # the condition is tested at the bottom, so each iteration
+            # takes one branch
+            body, condition, end = self.new_label(), self.new_label(), self.new_label()
+            self.emit("jmp", condition)
+            self.label(body)
+            self.loops.append((condition, end))
+            self.statement(statement.body)
+            self.loops.pop()
+            self.label(condition)
+            self.tok = statement.token
+            self.branch(statement.condition, body, True)
+            self.label(end)
+        elif kind is Return:
+            self.ret(statement)
+        elif kind is Jump:
+            if not self.loops:
+                self.fail(f"{statement.kind} outside of a loop", statement.token)
+            proceed, end = self.loops[-1]
+            self.emit("jmp", end if statement.kind == "break" else proceed)
+        elif type(statement.value) is CallExpr:
+            self.call(statement.value, None, void=True)
+        else:
+            self.value(statement.value)
+
+    def assign(self, statement: Assign):
+        target = statement.target
+        entry = self.lookup(target.name, target.token)
+        if type(target) is Index:
+            value = self.value(statement.value)
+            base, offset = self.element(target)
+            self.emit("sw", value, base, offset)
+        elif self.is_array(entry):
+            self.fail(f"Can't assign to array {target.name}", target.token)
+        elif type(entry) is Local:
+            self.value(statement.value, entry.register)
+        else:
+            value = self.value(statement.value)
+            address = self.new(f"&{target.name}")
+            self.emit("la", address, target.name)
+            self.emit("sw", value, address, 0)
+
+    def ret(self, statement: Return):
+        function = self.function
+        value = None
+        if statement.value is not None:
+            if not function.returns:
+                self.fail(f"{function.name} doesn't return a value", statement.token)
+            value = self.value(statement.value)
+        elif function.returns and function.name != MAIN:
+            self.fail(f"{function.name} has to return a value", statement.token)
+        self.emit(RETURN, value, self.return_address)
+
+    # ==============================
+    # Expressions
+    # ==============================
+    def value(self, expr: Expression, target: Optional[VReg] = None) -> VReg:
+        """
+        Returns the register expr's value is in, which is target if given
+        """
+        kind = type(expr)
+        if kind is Num:
+            if expr.value == 0 and target is None:
+                return self.zero
+            target = target or self.new()
+            self.emit("li", target, expr.value)
+            return target
+        if kind is Name:
+            entry = self.lookup(expr.name, expr.token)
+            if self.is_array(entry):
+                self.fail(f"{expr.name} is an array", expr.token)
+            if type(entry) is Local:
+                if target is None or target is entry.register:
+                    return entry.register
+                self.emit(MOVE, target, entry.register)
+                return target
+            address = self.new(f"&{expr.name}")
+            self.emit("la", address, expr.name)
+            target = target or self.new(expr.name)
+            self.emit("lw", target, address, 0)
+            return target
+        if kind is Index:
+            base, offset = self.element(expr)
+            target = target or self.new()
+            self.emit("lw", target, base, offset)
+            return target
+        if kind is CallExpr:
+            return self.call(expr, target)
+        if kind is Unary and expr.op in {"-", "~"}:
+            operand = self.value(expr.operand)
+            target = target or self.new()
+            if expr.op == "-":
+                self.emit("sub", target, self.zero, operand)
+            else:
+                self.emit("nor", target, operand, operand)
+            return target
+        if kind is Binary and expr.op in ARITHMETIC:
+            return self.arithmetic(expr, target)
+        if kind is Binary and expr.op in {"<", ">"}:
+            left, right = expr.left, expr.right
+            if expr.op == ">":
+                left, right = right, left
+            return self.compare(left, right, target)
+        # anything else that's true or false is worked out with branches
+        # into a register of its own, since the condition might read target
+        result = self.new()
+        done = self.new_label()
+        self.emit("li", result, 1)
+        self.branch(expr, done, True)
+        self.emit("li", result, 0)
+        self.label(done)
+        if target is None:
+            return result
+        self.emit(MOVE, target, result)
+        return target
+
+    def arithmetic(self, expr: Binary, target: Optional[VReg]) -> VReg:
+        op = expr.op
+        left, right = expr.left, expr.right
+        if type(left) is Num and op in COMMUTATIVE:
+            left, right = right, left
+        if op == "^":
+            # there's no xor: a ^ b = (a | b) & ~(a & b)
+            a, b = self.value(left), self.value(right)
+            either, both = self.new(), self.new()
+            self.emit("or", either, a, b)
+            self.emit("and", both, a, b)
+            self.emit("nor", both, both, both)
+            target = target or self.new()
+            self.emit("and", target, either, both)
+            return target
+        register, immediate = ARITHMETIC[op]
+        if type(right) is Num:
+            value = right.value
+            if op == "-":
+                immediate, value = "addi", -value
+            elif op == "*" and value > 0 and value & (value - 1) == 0:
+                immediate, value = "sll", value.bit_length() - 1
+            if op in {"<<", ">>"}:
+                fits = 0 <= value < 32
+            elif immediate in UNSIGNED_IMMEDIATES:
+                fits = 0 <= value <= 0xFFFF
+            else:
+                fits = IMM_MIN <= value <= IMM_MAX
+            if fits:
+                operand = self.value(left)
+                target = target or self.new()
+                self.emit(immediate, target, operand, value)
+                return target
+        if register is None:
+            self.fail("Shift amounts have to be constants from 0 to 31", expr.token)
+        a, b = self.value(left), self.value(right)
+        target = target or self.new()
+        self.emit(register, target, a, b)
+        return target
+
+    def compare(
+        self, left: Expression, right: Expression, target: Optional[VReg] = None
+    ) -> VReg:
+        """
+        Sets a register to left < right
+        """
+        operand = self.value(left)
+        if type(right) is Num and IMM_MIN <= right.value <= IMM_MAX:
+            target = target or self.new()
+            self.emit("slti", target, operand, right.value)
+            return target
+        other = self.value(right)
+        target = target or self.new()
+        self.emit("slt", target, operand, other)
+        return target
+
+    def element(self, expr: Index) -> Tuple[VReg, int]:
+        """
+        Returns the base register and offset of an array element
+        """
+        entry = self.lookup(expr.name, expr.token)
+        if not self.is_array(entry):
+            self.fail(f"{expr.name} isn't an array", expr.token)
+        index = expr.index
+        constant = type(index) is Num and IMM_MIN <= index.value <= IMM_MAX
+        if type(entry) is Local:
+            base = entry.register
+        else:
+            base = self.new(f"&{expr.name}")
+            self.emit("la", base, expr.name)
+        if constant:
+            return base, index.value
+        offset = self.value(index)
+        address = self.new()
+        self.emit("add", address, base, offset)
+        return address, 0
+
+    def call(
+        self, expr: CallExpr, target: Optional[VReg], void: bool = False
+    ) -> Optional[VReg]:
+        function = self.functions.get(expr.name)
+        if function is None:
+            self.fail(f"Unknown function {expr.name}", expr.token)
+        if expr.name == MAIN:
+            self.fail(f"{MAIN} can't be called", expr.token)
+        if len(expr.args) != len(function.params):
+            self.fail(
+                f"{expr.name} takes {len(function.params)} arguments, "
+                f"got {len(expr.args)}",
+                expr.token,
+            )
+        if not (function.returns or void):
+            self.fail(f"{expr.name} doesn't return a value", expr.token)
+        arguments = []
+        for arg, param in zip(expr.args, function.params):
+            if not param.array:
+                arguments.append(self.value(arg))
+                continue
+            entry = self.lookup(arg.name, arg.token) if type(arg) is Name else None
+            if entry is None or not self.is_array(entry):
+                self.fail(f"{expr.name} takes an array for {param.name}", arg.token)
+            if type(entry) is Local:
+                arguments.append(entry.register)
+            else:
+                address = self.new(f"&{arg.name}")
+                self.emit("la", address, arg.name)
+                arguments.append(address)
+        result = None
+        if function.returns:
+            result = target or self.new(f"{expr.name}()")
+        self.tok = expr.token
+        self.emit(CALL, expr.name, result, *arguments)
+        return result
+
+    def branch(self, expr: Expression, target: str, when: bool):
+        """
+        Jumps to target if expr is when, and otherwise falls through
+        """
+        kind = type(expr)
+        if kind is Num:
+            if bool(expr.value) == when:
+                self.emit("jmp", target)
+            return
+        if kind is Unary and expr.op == "!":
+            self.branch(expr.operand, target, not when)
+            return
+        if kind is not Binary or expr.op not in {"&&", "||", "==", "!=", *COMPARISONS}:
+            self.emit("bne" if when else "beq", self.value(expr), self.zero, target)
+            return
+        op = expr.op
+        if op in {"&&", "||"}:
+            # short circuit: a && b is only true if a is, a || b is only
+            # false if a is
+            if (op == "&&") == when:
+                skip = self.new_label()
+                self.branch(expr.left, skip, not when)
+                self.branch(expr.right, target, when)
+                self.label(skip)
+            else:
+                self.branch(expr.left, target, when)
+                self.branch(expr.right, target, when)
+            return
+        if op in {"==", "!="}:
+            left, right = expr.left, expr.right
+            if type(left) is Num:
+                left, right = right, left
+            a, b = self.value(left), self.value(right)
+            self.emit("beq" if (op == "==") == when else "bne", a, b, target)
+            return
+        reverse, negated = COMPARISONS[op]
+        left, right = expr.left, expr.right
+        if reverse:
+            left, right = right, left
+        if type(left) is Num and type(right) is not Num and left.value < IMM_MAX:
+            # k < a is !(a < k + 1), which takes an slti
+            left, right = right, Num(left.value + 1, left.token)
+            negated = not negated
+        less = self.compare(left, right)
+        self.emit("bne" if when != negated else "beq", less, self.zero, target)
+
+
+def reachable(ops: List[Op]) -> List[Op]:
+    """
+    Drops ops after a jump or return that no label leads to, and jmps to
+    the very next op
+    """
+    kept: List[Op] = []
+    dead = False
+    for op in ops:
+        if op.name == LABEL:
+            dead = False
+        if dead:
+            continue
+        if op.name == LABEL and kept and kept[-1].name == "jmp":
+            if kept[-1].args[0] == op.args[0]:
+                kept.pop()
+        kept.append(op)
+        dead = op.name in {"jmp", RETURN}
+    return kept
+
+
+# ==============================
+# Whole programs
+# ==============================
+def check_name(name: str, tok: Token):
+    # globals and functions become labels
+    if name in KEYWORDS:
+        raise Exception(f"{name} is reserved by the assembler{where(tok)}")
+    if name.startswith("__"):
+        raise Exception(f"Names starting with __ are reserved{where(tok)}")
+
+
+def global_data(definition: Global) -> Data:
+    if definition.size is None:
+        values = definition.values or [0]
+    elif not definition.values:
+        return Data(
+            definition.name,
+            [Token("directive", ".space"), operand_token(definition.size)],
+            definition.token.line,
+            definition.token.column,
+        )
+    else:
+        values = definition.values + [0] * (definition.size - len(definition.values))
+    return Data(
+        definition.name,
+        [operand_token(value) for value in values],
+        definition.token.line,
+        definition.token.column,
+    )
+
+
+def compile_c(
+    source: str, naive: bool = False
+) -> List[Union[Data, Label, Instruction]]:
+    """
+    Compiles C source to the data and text of a program, with main last.
+    With naive, every value is kept in memory instead of a register
+    """
+    globals_, functions = parse(source)
+    names: Dict[str, Union[Global, FunctionDef]] = {}
+    for definition in [*globals_, *functions]:
+        check_name(definition.name, definition.token)
+        if definition.name in names:
+            raise Exception(
+                f"{definition.name} is already defined{where(definition.token)}"
+            )
+        names[definition.name] = definition
+    by_name = {function.name: function for function in functions}
+    main = by_name.get(MAIN)
+    if main is None:
+        raise Exception("There's no main function")
+    if main.params:
+        raise Exception(f"{MAIN} can't take parameters{where(main.token)}")
+    for function in functions:
+        if len(function.params) > len(ARGUMENT_REGISTERS):
+            raise Exception(
+                f"{function.name} takes more than {len(ARGUMENT_REGISTERS)} "
+                f"parameters{where(function.token)}"
+            )
+
+    data: List[Data] = [global_data(definition) for definition in globals_]
+    text: List[Union[Label, Instruction]] = []
+    # execution starts at main and ends by running off the end of the text
+    for function in [f for f in functions if f is not main] + [main]:
+        generated = Generator(function, {g.name: g for g in globals_}, by_name)
+        lowered = generated.generate()
+        instructions, spills = lower(lowered, allocate(lowered, naive))
+        text.append(Label(function.name))
+        text.extend(instructions)
+        data.extend(spills)
+    return [*data, *text]
+
+
+def compile_program(source: str, naive: bool = False) -> Program:
+    return Program.from_statements(compile_c(source, naive))
+
+
+def format_statements(
+    statements: Iterable[Union[Data, Label, Instruction]],
+) -> Iterator[str]:
+    """
+    Yields statements as assembly source
+    """
+    segment = None
+    for statement in statements:
+        wanted = ".data" if type(statement) is Data else ".text"
+        if wanted != segment:
+            if segment is not None:
+                yield ""
+            yield wanted
+            segment = wanted
+        if type(statement) is Data:
+            values = statement.values
+            if values and values[0].cls == "directive":
+                text = f"{values[0].contents} " + ", ".join(
+                    value.contents for value in values[1:]
+                )
+            else:
+                text = ", ".join(value.contents for value in values)
+            yield f"{statement.name}: {text};"
+        elif type(statement) is Label:
+            yield f"{statement.name}:"
+        else:
+            args = ", ".join(arg.contents for arg in statement.args)
+            yield f"    {statement.name} {args};" if args else f"    {statement.name};"
+
+
+def main():
+    parser = ArgumentParser("CS147 C Compiler")
+    parser.add_argument("INPUT_FILE", type=str, help="C source")
+    parser.add_argument(
+        "-o", "--output", type=str, help="output path (default: standard out)"
+    )
+    parser.add_argument(
+        "--naive",
+        action="store_true",
+        help="keep every value in memory instead of allocating registers",
+    )
+    args = parser.parse_args()
+
+    with open(args.INPUT_FILE) as f:
+        statements = compile_c(f.read(), args.naive)
+    out = sys.stdout if args.output is None else open(args.output, "w")
+    try:
+        for line in format_statements(statements):
+            out.write(line)
+            out.write("\n")
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
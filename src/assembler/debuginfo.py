@@ -0,0 +1,267 @@
+import mmap
+import struct
+import sys
+from array import array
+from bisect import bisect_right
+from itertools import accumulate
+from typing import BinaryIO, Dict, Iterable, List, NamedTuple, Optional
+from .assembler import DATA_START_ADDR, PROGRAM_START_ADDR, Layout
+
+# Debug info files map every address of an image back to the source:
+#   header    MAGIC, version, then the counts in HEADER
+#   addresses u32 first address of every entry, sorted
+#   lines     u32 source line of the entry, 0 when it has none
+#   columns   u32 source column
+#   files     u32 string id of the source file
+#   labels    u32 string id of the enclosing label, NO_STRING when there's none
+#   offsets   u32 start of every string in the string bytes, then their end
+#   strings   utf-8 bytes
+# An entry covers the words from its address up to the next entry's, and
+# the ends of the text and the data get an entry without a line. Numbers
+# are little-endian, so that on most machines the arrays are used straight
+# from the memory mapped file
+MAGIC = b"DVDBG\0"
+VERSION = 1
+HEADER = struct.Struct("<6sH2I")
+COLUMNS = 5  # u32 arrays with one number per entry
+NO_STRING = 0xFFFFFFFF
+NATIVE = sys.byteorder == "little"
+
+
+class Location(NamedTuple):
+    file: str
+    line: int
+    column: int
+    label: Optional[str]  # the label the address is under
+
+
+class Entries:
+    """
+    The columns of a debug info file as they are built
+    """
+
+    def __init__(self):
+        self.addresses = array("I")
+        self.lines = array("I")
+        self.columns = array("I")
+        self.files = array("I")
+        self.labels = array("I")
+        self.strings: Dict[str, int] = {}
+
+    def intern(self, name: Optional[str]) -> int:
+        if name is None:
+            return NO_STRING
+        return self.strings.setdefault(name, len(self.strings))
+
+    def add(
+        self, address: int, file: int, line: int, column: int, label: Optional[str]
+    ):
+        self.addresses.append(address)
+        self.lines.append(line)
+        self.columns.append(column)
+        self.files.append(file)
+        self.labels.append(self.intern(label))
+
+    def dump(self, f: BinaryIO):
+        encoded = [name.encode() for name in self.strings]
+        offsets = array("I", accumulate(map(len, encoded), initial=0))
+        f.write(HEADER.pack(MAGIC, VERSION, len(self.addresses), len(encoded)))
+        for numbers in [
+            self.addresses,
+            self.lines,
+            self.columns,
+            self.files,
+            self.labels,
+            offsets,
+        ]:
+            if not NATIVE:
+                numbers = array("I", numbers)
+                numbers.byteswap()
+            numbers.tofile(f)
+        f.write(b"".join(encoded))
+
+
+def debug_entries(result: Layout, source: str) -> Entries:
+    """
+    Builds the entries of a resolved program: one for every instruction,
+    and one for every data item that takes up words and every other source
+    line its values go on to
+    """
+    program = result.program
+    names = program.symbols.names
+    addresses = result.addresses
+    entries = Entries()
+    file = entries.intern(source)
+
+    # statement : label defined there, the last one when there are several
+    starts = {at: names[symbol] for symbol, at in sorted(result.labels.items())}
+    label = None
+    # the jmp main that every program starts with has no source
+    entries.add(PROGRAM_START_ADDR, file, 0, 0, None)
+    lines, columns = program.lines, program.columns
+    for i in range(1, len(result)):
+        label = starts.get(i, label)
+        entries.add(
+            PROGRAM_START_ADDR + addresses[i],
+            file,
+            lines[i - 1],
+            columns[i - 1],
+            label,
+        )
+    entries.add(PROGRAM_START_ADDR + addresses[-1], file, 0, 0, None)
+
+    offset = 0
+    for i, symbol in enumerate(program.data_ids):
+        length = program.data_length(i)
+        if length:
+            entries.add(
+                DATA_START_ADDR + offset,
+                file,
+                program.data_lines[i],
+                program.data_columns[i],
+                names[symbol],
+            )
+        for at, line, column in program.value_positions(i):
+            entries.add(
+                DATA_START_ADDR + offset + at, file, line, column, names[symbol]
+            )
+        offset += length
+    if len(program.data_ids):
+        entries.add(DATA_START_ADDR + offset, file, 0, 0, None)
+    return entries
+
+
+def write_debug_info(result: Layout, source: str, path: str):
+    with open(path, "wb") as f:
+        debug_entries(result, source).dump(f)
+
+
+class DebugInfo:
+    """
+    A debug info file, memory mapped. Looking up an address is a binary
+    search of the sorted addresses, and the location of every entry is only
+    built once
+    """
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, count, strings = HEADER.unpack_from(self.map)
+        if magic != MAGIC:
+            raise Exception(f"{path} isn't a debug info file")
+        if version != VERSION:
+            raise Exception(
+                f"{path} is debug info version {version}, expected {VERSION}"
+            )
+        self.count = count
+        columns = []
+        start = HEADER.size
+        for length in [count] * COLUMNS + [strings + 1]:
+            view = memoryview(self.map)[start : start + 4 * length]
+            columns.append(view.cast("I") if NATIVE else byteswapped(view))
+            start += 4 * length
+        (
+            self.addresses,
+            self.lines,
+            self.columns,
+            self.files,
+            self.labels,
+            self.offsets,
+        ) = columns
+        self.strings_start = start
+        self.names: Dict[int, str] = {}
+        self.locations: Dict[int, Optional[Location]] = {}
+
+    def close(self):
+        for view in [
+            self.addresses,
+            self.lines,
+            self.columns,
+            self.files,
+            self.labels,
+            self.offsets,
+        ]:
+            if isinstance(view, memoryview):
+                view.release()
+        self.map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return self.count
+
+    def string(self, i: int) -> Optional[str]:
+        if i == NO_STRING:
+            return None
+        name = self.names.get(i)
+        if name is None:
+            start = self.strings_start + self.offsets[i]
+            end = self.strings_start + self.offsets[i + 1]
+            name = self.names[i] = self.map[start:end].decode()
+        return name
+
+    def entry(self, address: int) -> int:
+        """
+        Returns the index of the entry address is in, or -1 when it's
+        before the program
+        """
+        return bisect_right(self.addresses, address) - 1
+
+    def location(self, i: int) -> Optional[Location]:
+        """
+        Returns the source location of entry i, or None when it has none
+        """
+        if i < 0:
+            return None
+        try:
+            return self.locations[i]
+        except KeyError:
+            pass
+        location = None
+        if self.lines[i]:
+            location = Location(
+                self.string(self.files[i]),
+                self.lines[i],
+                self.columns[i],
+                self.string(self.labels[i]),
+            )
+        self.locations[i] = location
+        return location
+
+    def lookup(self, address: int) -> Optional[Location]:
+        """
+        Returns where the word at address came from, or None when it isn't
+        from the source
+        """
+        return self.location(self.entry(address))
+
+    def entries(self, addresses: Iterable[int]):
+        """
+        Returns the entry index of every address at once, in a numpy array
+        when numpy is installed and a list otherwise
+        """
+        try:
+            import numpy as np
+        except ImportError:
+            return [self.entry(address) for address in addresses]
+        table = np.frombuffer(self.map, "<u4", self.count, HEADER.size)
+        wanted = np.fromiter(addresses, np.int64)
+        return np.searchsorted(table, wanted, side="right") - 1
+
+    def symbolize(self, addresses: Iterable[int]) -> List[Optional[Location]]:
+        """
+        Looks up many addresses, like every PC of a trace
+        """
+        location = self.location
+        return [location(int(i)) for i in self.entries(addresses)]
+
+
+def byteswapped(view: memoryview) -> array:
+    numbers = array("I")
+    numbers.frombytes(view)
+    numbers.byteswap()
+    return numbers
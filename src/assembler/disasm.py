@@ -0,0 +1,393 @@
+import re
+import sys
+from array import array
+from argparse import ArgumentParser
+from itertools import repeat
+from typing import Callable, Dict, Iterator, List, Optional, Set, Tuple
+from .assembler import DATA_START_ADDR, PROGRAM_START_ADDR, Image
+from .blocks import WORD_BYTES
+from .translator import (
+    ENCODINGS,
+    FUNCT_WIDTH,
+    IMM_MASK,
+    IMM_WIDTH,
+    JMP_ADDR_MASK,
+    OPCODE_SHIFT,
+    OPCODE_WIDTH,
+    RD_SHIFT,
+    REG_MASK,
+    RS_SHIFT,
+    RT_SHIFT,
+    SHAMT_MASK,
+    SHAMT_SHIFT,
+    pack_jr,
+    pack_jump,
+    pack_lui,
+    pack_none,
+    pack_rri,
+    pack_rrr,
+    pack_shift,
+)
+
+FUNCT_MASK = (1 << FUNCT_WIDTH) - 1
+SIGN_BIT = 1 << (IMM_WIDTH - 1)
+DATA_PER_LINE = 8
+HEX = "0x{:X}"
+COMMENT = re.compile(r"//[^\n]*")
+MAX_DIFFERENCES = 20  # differing words listed by compare
+
+# bits each packer never sets, which have to be clear for the assembler to
+# produce the same word again
+UNUSED_BITS = {
+    pack_rrr: SHAMT_MASK << SHAMT_SHIFT,
+    pack_shift: REG_MASK << RT_SHIFT,
+    pack_jr: (REG_MASK << RT_SHIFT)
+    | (REG_MASK << RD_SHIFT)
+    | (SHAMT_MASK << SHAMT_SHIFT),
+    pack_rri: 0,
+    pack_lui: 0,
+    pack_jump: 0,
+    pack_none: JMP_ADDR_MASK,
+}
+# immediates written as unsigned hex rather than signed decimal
+HEX_IMMEDIATES = {"andi", "ori", "lui"}
+BRANCHES = {"beq", "bne"}
+JUMPS = {"jmp", "jal"}
+
+Entry = Tuple[str, Callable[..., int]]  # mnemonic and packer
+
+
+def decode_tables() -> Tuple[List[Optional[Entry]], List[Optional[Entry]]]:
+    """
+    Inverts the encoding table into one entry per opcode, and one per funct
+    for opcode 0
+    """
+    opcodes: List[Optional[Entry]] = [None] * (1 << OPCODE_WIDTH)
+    functs: List[Optional[Entry]] = [None] * (1 << FUNCT_WIDTH)
+    for name, (pack, opcode, funct) in ENCODINGS.items():
+        if opcode == 0:
+            functs[funct] = (name, pack)
+        else:
+            opcodes[opcode] = (name, pack)
+    return opcodes, functs
+
+
+OPCODE_TABLE, FUNCT_TABLE = decode_tables()
+
+
+def decode(word: int) -> Optional[Tuple[str, Tuple[int, ...]]]:
+    """
+    Returns the mnemonic of word and its operand fields in assembly order,
+    or None when the assembler can't have produced it. Immediates are left
+    as their raw 16 bits
+    """
+    opcode = word >> OPCODE_SHIFT
+    entry = OPCODE_TABLE[opcode] if opcode else FUNCT_TABLE[word & FUNCT_MASK]
+    if entry is None:
+        return None
+    name, pack = entry
+    if word & UNUSED_BITS[pack]:
+        return None
+    rs = (word >> RS_SHIFT) & REG_MASK
+    rt = (word >> RT_SHIFT) & REG_MASK
+    if pack is pack_rrr:
+        return name, (word >> RD_SHIFT & REG_MASK, rs, rt)
+    if pack is pack_rri:
+        return name, (rt, rs, word & IMM_MASK)
+    if pack is pack_shift:
+        return name, (word >> RD_SHIFT & REG_MASK, rs, word >> SHAMT_SHIFT & SHAMT_MASK)
+    if pack is pack_jump:
+        return name, (word & JMP_ADDR_MASK,)
+    if pack is pack_lui:
+        return (name, (rt, word & IMM_MASK)) if rs == rt else None
+    if pack is pack_jr:
+        return name, (rs,)
+    return name, ()
+
+
+def signed(imm: int) -> int:
+    return imm - (SIGN_BIT << 1) if imm & SIGN_BIT else imm
+
+
+def read_memh(contents: str) -> Image:
+    """
+    Reads a memdump into an image. Gaps inside a segment are read as zero.
+    Each run of words after an @address is converted in one go
+    """
+    segments = {PROGRAM_START_ADDR: array("I"), DATA_START_ADDR: array("I")}
+    if "//" in contents:
+        contents = COMMENT.sub("", contents)
+    first, *runs = contents.split("@")
+    if first.strip():
+        raise Exception("Expected an @address before the first word")
+    for run in runs:
+        address, *values = run.split()
+        addr = int(address, 16)
+        # the data segment starts past the largest program
+        base = DATA_START_ADDR if addr >= DATA_START_ADDR else PROGRAM_START_ADDR
+        if addr < base:
+            raise Exception(f"Address {addr:08x} is below the program")
+        words = segments[base]
+        offset = addr - base
+        if offset > len(words):
+            words.extend(array("I", bytes(WORD_BYTES * (offset - len(words)))))
+        try:
+            run_words = array("I", map(int, values, repeat(16, len(values))))
+        except ValueError as e:
+            raise Exception(f"Bad word after @{address}: {e}") from None
+        words[offset : offset + len(run_words)] = run_words
+    return Image(segments[PROGRAM_START_ADDR], segments[DATA_START_ADDR])
+
+
+class Disassembler:
+    """
+    Rebuilds a source for an image. A first pass finds every branch and
+    jump target in the program, and every lui/ori pair that loads the
+    address of a data word, and names them. Then the source is generated a
+    line at a time. The jmp main the assembler puts first is left out, so
+    that assembling the result gives back the same image
+    """
+
+    def __init__(self, image: Image):
+        self.image = image
+        self.labels: Dict[int, str] = {}  # text index : name
+        self.data_labels: Dict[int, str] = {0: data_name(0)}  # data offset : name
+        self.la: Set[int] = set()  # text index of every lui that starts an la
+        self.start = 0  # first text index to disassemble
+        self.unknown = 0
+        # the text of every instruction that doesn't depend on where it is
+        self.formatted: Dict[int, str] = {}
+        self.find_targets()
+
+    def find_targets(self):
+        text = self.image.text
+        size = len(text)
+        data_size = len(self.image.data)
+        pairs = []
+        previous = None
+        for i, word in enumerate(text):
+            decoded = decode(word)
+            if decoded is None:
+                previous = None
+                continue
+            name, fields = decoded
+            if name in BRANCHES:
+                target = i + 1 + signed(fields[2])
+                if 0 <= target < size:
+                    self.labels.setdefault(target, text_name(target))
+            elif name in JUMPS:
+                target = fields[0] - PROGRAM_START_ADDR
+                if 0 <= target < size:
+                    self.labels.setdefault(target, text_name(target))
+            elif name == "ori" and previous is not None and previous[0] == "lui":
+                reg = previous[1][0]
+                offset = (previous[1][1] << IMM_WIDTH | fields[2]) - DATA_START_ADDR
+                if fields[0] == fields[1] == reg and 0 <= offset <= data_size:
+                    pairs.append((i - 1, offset))
+            previous = decoded
+
+        first = decode(text[0]) if size else None
+        if first is not None and first[0] == "jmp":
+            target = first[1][0] - PROGRAM_START_ADDR
+            if 0 < target < size:
+                self.labels[target] = "main"
+                self.start = 1
+        for i, offset in pairs:
+            # an la can't be split by a label
+            if i + 1 not in self.labels:
+                self.la.add(i)
+                self.data_labels.setdefault(offset, data_name(offset))
+
+    def operands(self, i: int, name: str, fields: Tuple[int, ...]) -> List[str]:
+        if name in BRANCHES:
+            target = i + 1 + signed(fields[2])
+            last = self.labels.get(target, str(signed(fields[2])))
+            return [f"r{fields[0]}", f"r{fields[1]}", last]
+        if name in JUMPS:
+            label = self.labels.get(fields[0] - PROGRAM_START_ADDR)
+            return [label or f"0x{fields[0]:X}"]
+        pack = ENCODINGS[name][0]
+        if pack is pack_lui:
+            return [f"r{fields[0]}", f"0x{fields[1]:X}"]
+        if pack is pack_shift:
+            return [f"r{fields[0]}", f"r{fields[1]}", str(fields[2])]
+        if pack is pack_rri:
+            imm = fields[2]
+            text = f"0x{imm:X}" if name in HEX_IMMEDIATES else str(signed(imm))
+            return [f"r{fields[0]}", f"r{fields[1]}", text]
+        return [f"r{field}" for field in fields]
+
+    def instruction(self, i: int, word: int) -> str:
+        decoded = decode(word)
+        if decoded is None:
+            self.unknown += 1
+            return f"    # unknown word 0x{word:08X}"
+        name, fields = decoded
+        operands = self.operands(i, name, fields)
+        line = f"    {name} {', '.join(operands)};" if operands else f"    {name};"
+        if name not in BRANCHES and name not in JUMPS:
+            self.formatted[word] = line
+        return line
+
+    def lines(self, comments: bool = True) -> Iterator[str]:
+        """
+        Yields the lines of the source. With comments, every instruction is
+        followed by its address and word
+        """
+        text, data = self.image.text, self.image.data
+        if len(data) > 0 or len(self.data_labels) > 1:
+            yield ".data"
+            yield from self.data_lines()
+            yield ""
+        yield ".text"
+        i = self.start
+        while i < len(text):
+            label = self.labels.get(i)
+            if label is not None:
+                yield f"{label}:"
+            word = text[i]
+            size = 1
+            if i in self.la:
+                decoded = decode(word)
+                offset = (
+                    decoded[1][1] << IMM_WIDTH | decode(text[i + 1])[1][2]
+                ) - DATA_START_ADDR
+                line = f"    la r{decoded[1][0]}, {self.data_labels[offset]};"
+                size = 2
+            else:
+                line = self.formatted.get(word) or self.instruction(i, word)
+            if comments:
+                line = f"{line:<32}# {PROGRAM_START_ADDR + i:08x}: {word:08X}"
+                if size == 2:
+                    line = f"{line} {text[i + 1]:08X}"
+            yield line
+            i += size
+
+    def data_lines(self) -> Iterator[str]:
+        data = self.image.data
+        starts = sorted(self.data_labels)
+        for start, end in zip(starts, starts[1:] + [max(len(data), starts[-1])]):
+            name = self.data_labels[start]
+            if end == start:
+                # an la to the end of the data
+                yield f"{name}: .space 0;"
+                continue
+            for chunk in range(start, end, DATA_PER_LINE):
+                values = ", ".join(
+                    map(HEX.format, data[chunk : min(chunk + DATA_PER_LINE, end)])
+                )
+                head = f"{name}: " if chunk == start else " " * (len(name) + 2)
+                tail = ";" if chunk + DATA_PER_LINE >= end else ","
+                yield f"{head}{values}{tail}"
+
+
+def text_name(index: int) -> str:
+    return f"L_{PROGRAM_START_ADDR + index:x}"
+
+
+def data_name(offset: int) -> str:
+    return f"D_{DATA_START_ADDR + offset:x}"
+
+
+def disassemble(image: Image, comments: bool = True) -> Iterator[str]:
+    return Disassembler(image).lines(comments)
+
+
+def compare(expected: Image, actual: Image) -> List[str]:
+    """
+    Describes every word that differs between the images, up to
+    MAX_DIFFERENCES of them
+    """
+    differences = []
+    count = 0
+    for base, want, got in [
+        (PROGRAM_START_ADDR, expected.text, actual.text),
+        (DATA_START_ADDR, expected.data, actual.data),
+    ]:
+        if len(want) != len(got):
+            differences.append(
+                f"segment at {base:08x} has {len(got)} words, expected {len(want)}"
+            )
+        for offset, (a, b) in enumerate(zip(want, got)):
+            if a != b:
+                count += 1
+                if count <= MAX_DIFFERENCES:
+                    differences.append(
+                        f"{base + offset:08x}: {b:08X}, expected {a:08X}"
+                    )
+    if count > MAX_DIFFERENCES:
+        differences.append(f"... and {count - MAX_DIFFERENCES} more words")
+    return differences
+
+
+def round_trip(image: Image) -> List[str]:
+    """
+    Assembles the disassembly of image again, and describes every word that
+    comes out different
+    """
+    from .assembler import assemble_image
+    from .grammar import process
+
+    source = "\n".join(disassemble(image, comments=False))
+    return compare(image, assemble_image(process(source)))
+
+
+def main():
+    parser = ArgumentParser("CS147 Disassembler")
+    parser.add_argument("INPUT_FILE", type=str, help="memdump to disassemble")
+    parser.add_argument(
+        "-o", "--output", type=str, help="output path (default: standard out)"
+    )
+    parser.add_argument(
+        "--no-comments",
+        action="store_true",
+        help="don't annotate instructions with their address and word",
+    )
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        help="assemble the disassembly again and check it gives the same memdump",
+    )
+    parser.add_argument(
+        "--compare",
+        type=str,
+        metavar="SOURCE",
+        help="check the memdump is what SOURCE assembles to",
+    )
+    args = parser.parse_args()
+
+    with open(args.INPUT_FILE) as f:
+        image = read_memh(f.read())
+    disassembler = Disassembler(image)
+    out = sys.stdout if args.output is None else open(args.output, "w")
+    try:
+        for line in disassembler.lines(not args.no_comments):
+            out.write(line)
+            out.write("\n")
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    if disassembler.unknown:
+        print(f"{disassembler.unknown} words aren't instructions", file=sys.stderr)
+
+    failed = False
+    checks = []
+    if args.check:
+        checks.append(("round trip", lambda: round_trip(image)))
+    if args.compare is not None:
+        from .assembler import assemble_image
+        from .grammar import process
+
+        def against_source():
+            with open(args.compare) as f:
+                return compare(assemble_image(process(f.read())), image)
+
+        checks.append((args.compare, against_source))
+    for name, check in checks:
+        differences = check()
+        failed = failed or bool(differences)
+        print(f"{name}: {'differs' if differences else 'ok'}", file=sys.stderr)
+        for difference in differences:
+            print(f"    {difference}", file=sys.stderr)
+    if failed:
+        sys.exit(1)
@@ -1,13 +1,530 @@
-from assembler.assembler import assemble
-from assembler.grammar import process
-from argparse import ArgumentParser
+import glob
+import os
+import sys
+import time
+from collections import Counter
+from typing import TYPE_CHECKING, Dict, List, Optional, Set, Tuple
+from assembler import __version__
+from argparse import ArgumentParser, Namespace
+
+# everything else is imported where it's used, so that starting up only
+# loads what the requested mode needs and --version and --help load nothing
+if TYPE_CHECKING:
+    from assembler.analysis import Analysis
+    from assembler.cache import AssemblyCache
+    from assembler.profiling import Profiler
+
+WATCH_INTERVAL = 0.1  # seconds between checks of the input file
+EXTENSIONS = {"memh": ".dat", "bin": ".bin", "ihex": ".hex"}
+# option : whether it was given
+OPTIONS = {
+    "-o": lambda args: args.output is not None,
+    "-c": lambda args: args.compile,
+    "--stream": lambda args: args.stream,
+    "--cache": lambda args: args.cache,
+    "--watch": lambda args: args.watch,
+    "--profile": lambda args: args.profile,
+    "--gc-sections": lambda args: args.gc_sections,
+    "--jobs": lambda args: args.jobs > 1,
+    "--debug-info": lambda args: args.debug_info is not None,
+    "--analyze": lambda args: args.analyze,
+}
+# options that need exactly one input file
+SINGLE_INPUT = ["-o", "--watch", "--profile", "--debug-info", "--jobs", "--analyze"]
+# options that need the program parsed and resolved in this process, and
+# the options that assemble it some other way. --profile is both, since it
+# times each stage of the ordinary path
+RESOLVED_ONLY = ["--gc-sections", "--jobs", "--debug-info", "--analyze", "--profile"]
+OTHER_PATHS = ["-c", "--stream", "--cache", "--watch", "--profile"]
+
+
+def listed(names: List[str], conjunction: str) -> str:
+    return ", ".join(names[:-1]) + f" {conjunction} {names[-1]}"
+
+
+def given_options(args: Namespace) -> Set[str]:
+    return {name for name, is_given in OPTIONS.items() if is_given(args)}
+
+
+def option_conflict(given: Set[str]) -> Optional[str]:
+    """
+    Returns why the options given can't be used together, if they can't
+    """
+    for name in RESOLVED_ONLY:
+        others = [other for other in OTHER_PATHS if other != name]
+        if name in given and given.intersection(others):
+            return f"{name} can't be combined with {listed(others, 'or')}"
+    return None
+
+
+def usable_cpus() -> int:
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def new_cache(args: Namespace, stats: Optional[Dict[str, int]] = None):
+    from assembler.cache import AssemblyCache
+
+    return AssemblyCache(
+        args.cache_dir, args.cache_size * 1024 * 1024, args.optimize, stats
+    )
+
+
+def report_saved(saved: Dict[str, int]):
+    print(
+        f"gc-sections removed {saved['text'] + saved['data']} words: "
+        f"{saved['text']} of text, {saved['data']} of data",
+        file=sys.stderr,
+    )
+
+
+def report(stats: Dict[str, int]):
+    details = ", ".join(f"{rule} {count}" for rule, count in sorted(stats.items()))
+    total = sum(stats.values())
+    print(
+        f"peephole removed {total} instructions" + (f": {details}" if details else ""),
+        file=sys.stderr,
+    )
+
+
+def build(
+    args: Namespace,
+    input_file: str,
+    output: Optional[str],
+    cache: Optional["AssemblyCache"] = None,
+    stats: Optional[Dict[str, int]] = None,
+    profiler: Optional["Profiler"] = None,
+    saved: Optional[Dict[str, int]] = None,
+    analysis: Optional["Analysis"] = None,
+):
+    """
+    Assembles input_file and writes it to output in the requested format.
+    The instructions removed by the peephole pass are added to stats, the
+    words --gc-sections dropped from each segment to saved, with a
+    profiler every stage is timed separately and an analysis is run over
+    the resolved program
+    """
+    from assembler.output import write_image, write_lines
+
+    # files the source includes are relative to it
+    directory = os.path.dirname(input_file)
+    if profiler is not None:
+        from assembler.assembler import layout_lines
+        from assembler.profiling import profile_assembly
+
+        with profiler.stage("read") as counts:
+            with open(input_file) as f:
+                contents = f.read()
+            counts["lines"] = contents.count("\n")
+        result, image = profile_assembly(
+            contents, profiler, args.optimize, stats, directory
+        )
+        with profiler.stage("output"):
+            if args.format == "memh" and not args.no_comments:
+                write_lines(layout_lines(result), output)
+            else:
+                write_image(image, args.format, output)
+        return
+
+    if args.compile:
+        from assembler.assembler import assemble_fragment
+        from assembler.grammar import iter_parse, lex_lines, preprocess, relative_to
+        from assembler.objfile import write_object
+        from assembler.peephole import optimize_statements
+
+        with open(input_file) as f:
+            tokens = preprocess(relative_to(lex_lines(f), directory))
+            statements = iter_parse(tokens)
+            if args.optimize:
+                statements, removed = optimize_statements(statements)
+                if stats is not None:
+                    stats.update(removed)
+            fragment = assemble_fragment(statements)
+        write_object(fragment, output or os.path.splitext(input_file)[0] + ".o")
+        return
+
+    if args.stream:
+        from assembler.assembler import assemble_stream
+        from assembler.grammar import iter_parse, lex_lines, preprocess, relative_to
+
+        with open(input_file) as f:
+            tokens = preprocess(relative_to(lex_lines(f), directory))
+            image = assemble_stream(iter_parse(tokens))
+    elif cache is not None:
+        from assembler.cache import assemble_cached
+
+        with open(input_file) as f:
+            image = assemble_cached(f.read(), cache, directory)
+    else:
+        from assembler.assembler import layout_image, layout_lines, resolve
+        from assembler.grammar import process
+
+        with open(input_file) as f:
+            contents = f.read()
+        if args.jobs > 1:
+            from assembler.parallel import process_parallel
+
+            program = process_parallel(contents, directory, args.jobs)
+        else:
+            program = process(contents, directory)
+        if args.gc_sections:
+            from assembler.sections import gc_sections
+
+            program, dropped = gc_sections(program)
+            if saved is not None:
+                saved.update(dropped)
+        result = resolve(program, args.optimize, stats, analysis)
+        if args.debug_info is not None:
+            from assembler.debuginfo import write_debug_info
+
+            write_debug_info(result, input_file, args.debug_info)
+        if args.format == "memh" and not args.no_comments:
+            # encoded up front only when that can be spread over processes
+            image = layout_image(result, args.jobs) if args.jobs > 1 else None
+            write_lines(layout_lines(result, image), output)
+            return
+        image = layout_image(result, args.jobs)
+    write_image(image, args.format, output)
+
+
+def batch_build(
+    args: Namespace, input_file: str, output: str
+) -> Tuple[str, Optional[str], float, Dict[str, int]]:
+    """
+    Runs build in a batch worker, returning the input, the error if it
+    failed, the seconds it took and the words --gc-sections dropped
+    """
+    start = time.perf_counter()
+    cache = new_cache(args) if args.cache else None
+    saved = Counter()
+    try:
+        build(args, input_file, output, cache, saved=saved)
+    except Exception as e:
+        # don't leave a partial or stale output behind
+        if os.path.exists(output):
+            os.remove(output)
+        error = f"{type(e).__name__}: {e}"
+        return input_file, error, time.perf_counter() - start, Counter()
+    return input_file, None, time.perf_counter() - start, saved
+
+
+def expand_inputs(patterns: List[str]) -> List[str]:
+    """
+    Expands directories into the .asm files inside them and globs into the
+    files they match, raising when one of them has none
+    """
+    inputs = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            matches = sorted(glob.glob(os.path.join(pattern, "*.asm")))
+            if not matches:
+                raise Exception(f"No .asm files in {pattern}")
+        elif glob.has_magic(pattern):
+            matches = sorted(glob.glob(pattern, recursive=True))
+            if not matches:
+                raise Exception(f"No files match {pattern}")
+        else:
+            matches = [pattern]
+        inputs.extend(matches)
+    return inputs
+
+
+def batch_outputs(args: Namespace, inputs: List[str]) -> List[str]:
+    """
+    Returns the output path of every input. Under --out-dir, each input
+    keeps its directory relative to the directory all the inputs share, so
+    a/main.asm and b/main.asm don't both become main.dat
+    """
+    extension = ".o" if args.compile else EXTENSIONS[args.format]
+    directories = [os.path.dirname(os.path.abspath(path)) for path in inputs]
+    if args.out_dir is not None:
+        root = os.path.commonpath(directories)
+        directories = [
+            os.path.join(args.out_dir, os.path.relpath(directory, root))
+            for directory in directories
+        ]
+    outputs = []
+    written = {}
+    for input_file, directory in zip(inputs, directories):
+        name = os.path.splitext(os.path.basename(input_file))[0] + extension
+        output = os.path.normpath(os.path.join(directory, name))
+        key = os.path.normcase(os.path.abspath(output))
+        if key in written:
+            raise Exception(
+                f"{written[key]} and {input_file} would both be written to {output}"
+            )
+        written[key] = input_file
+        outputs.append(output)
+    return outputs
+
+
+def batch(args: Namespace, inputs: List[str], outputs: List[str]) -> bool:
+    """
+    Assembles every input in a process pool, each into its output file, and
+    prints a summary to standard error. Returns whether all succeeded
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    for directory in set(map(os.path.dirname, outputs)):
+        os.makedirs(directory, exist_ok=True)
+    start = time.perf_counter()
+    failures = 0
+    saved = Counter()
+    with ProcessPoolExecutor(args.workers) as pool:
+        futures = [
+            pool.submit(batch_build, args, input_file, output)
+            for input_file, output in zip(inputs, outputs)
+        ]
+        for future in futures:
+            input_file, error, elapsed, dropped = future.result()
+            saved.update(dropped)
+            if error is None:
+                print(f"ok    {elapsed * 1000:8.1f} ms  {input_file}", file=sys.stderr)
+            else:
+                failures += 1
+                print(
+                    f"FAIL  {elapsed * 1000:8.1f} ms  {input_file}: {error}",
+                    file=sys.stderr,
+                )
+    elapsed = time.perf_counter() - start
+    print(
+        f"{len(inputs) - failures} succeeded, {failures} failed in {elapsed:.2f} s",
+        file=sys.stderr,
+    )
+    if args.gc_sections:
+        report_saved(saved)
+    return failures == 0
+
+
+def watch(args: Namespace, input_file: str, cache: "AssemblyCache"):
+    """
+    Rebuilds whenever input_file changes, until interrupted
+    """
+    last = None
+    try:
+        while True:
+            try:
+                mtime = os.stat(input_file).st_mtime_ns
+            except OSError:
+                mtime = None
+            if mtime is not None and mtime != last:
+                last = mtime
+                start = time.perf_counter()
+                try:
+                    build(args, input_file, args.output, cache)
+                except Exception as e:
+                    print(f"error: {e}", file=sys.stderr)
+                else:
+                    elapsed = (time.perf_counter() - start) * 1000
+                    print(f"rebuilt in {elapsed:.1f} ms", file=sys.stderr)
+            time.sleep(WATCH_INTERVAL)
+    except KeyboardInterrupt:
+        pass
 
 
 def main():
+    if sys.argv[1:2] == ["serve"]:
+        from assembler.server import main as serve
+
+        return serve(sys.argv[2:])
     parser = ArgumentParser("CS147 Assembler")
-    parser.add_argument("INPUT_FILE", type=str)
+    parser.add_argument(
+        "--version", action="version", version=f"dvassembler {__version__}"
+    )
+    parser.add_argument(
+        "INPUT_FILES",
+        type=str,
+        nargs="+",
+        help="files, directories of .asm files or glob patterns",
+    )
+    parser.add_argument(
+        "-o", "--output", type=str, help="output path (default: standard out)"
+    )
+    parser.add_argument(
+        "--out-dir",
+        type=str,
+        metavar="DIR",
+        help="where to write each output when assembling several files "
+        "(default: next to each input)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="processes to assemble several files with (default: one per CPU)",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        metavar="N",
+        help="parse and encode a big program in N processes",
+    )
+    parser.add_argument(
+        "-c",
+        "--compile",
+        action="store_true",
+        help="emit a relocatable object file for dvlink (default: INPUT_FILE.o)",
+    )
+    parser.add_argument(
+        "--format",
+        choices=["memh", "bin", "ihex"],
+        default="memh",
+        help="output format",
+    )
+    parser.add_argument(
+        "-O",
+        "--optimize",
+        action="store_true",
+        help="run the peephole optimizer and report what it removed",
+    )
+    parser.add_argument(
+        "--gc-sections",
+        action="store_true",
+        help="leave out the code main can't reach and the data it never uses",
+    )
+    parser.add_argument(
+        "--no-comments",
+        action="store_true",
+        help="don't annotate memh output with the source",
+    )
+    parser.add_argument(
+        "--debug-info",
+        type=str,
+        metavar="PATH",
+        help="also write a map from every address to its source line to PATH",
+    )
+    parser.add_argument(
+        "--analyze",
+        action="store_true",
+        help="estimate the cycles every block and function takes, find hot spots "
+        "and read-after-write hazards, and report them on standard error",
+    )
+    parser.add_argument(
+        "--cost",
+        type=str,
+        action="append",
+        default=[],
+        metavar="NAME=CYCLES",
+        help="cycles of alu, memory, multiply or branch instructions, of a hazard "
+        "stall, or loop iterations to assume for --analyze (implies --analyze)",
+    )
+    parser.add_argument(
+        "--hot-spots",
+        type=int,
+        default=10,
+        metavar="N",
+        help="blocks --analyze lists as hot spots",
+    )
+    parser.add_argument(
+        "--analyze-json",
+        type=str,
+        metavar="PATH",
+        help="also write the --analyze estimates to PATH as JSON (implies --analyze)",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="assemble in one pass while reading the input (implies --no-comments)",
+    )
+    parser.add_argument(
+        "--cache",
+        action="store_true",
+        help="reuse unchanged segments from an on-disk cache (implies --no-comments)",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        type=str,
+        metavar="DIR",
+        help="cache location (default: ~/.cache/dvassembler)",
+    )
+    parser.add_argument(
+        "--cache-size",
+        type=int,
+        default=64,
+        metavar="MB",
+        help="evict least recently used cache entries past this size",
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="rebuild whenever the input changes (implies --cache)",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="time every stage of assembly and report it on standard error",
+    )
+    parser.add_argument(
+        "--profile-json",
+        type=str,
+        metavar="PATH",
+        help="also write the --profile numbers to PATH as JSON (implies --profile)",
+    )
     args = parser.parse_args()
-    contents = open(args.INPUT_FILE).read()
-    statements = process(contents)
-    output = assemble(statements)
-    print(output)
+    args.profile = args.profile or args.profile_json is not None
+    args.analyze = args.analyze or bool(args.cost) or args.analyze_json is not None
+    try:
+        inputs = expand_inputs(args.INPUT_FILES)
+    except Exception as e:
+        parser.error(str(e))
+    given = given_options(args)
+    if args.optimize and args.stream:
+        parser.error("-O can't be combined with --stream")
+    error = option_conflict(given)
+    if error is not None:
+        parser.error(error)
+    if len(inputs) != 1 or inputs != args.INPUT_FILES:
+        if given.intersection(SINGLE_INPUT):
+            parser.error(
+                f"{listed(SINGLE_INPUT, 'and')} take a single input file; use "
+                "--workers to assemble many at once"
+            )
+        try:
+            outputs = batch_outputs(args, inputs)
+        except Exception as e:
+            parser.error(str(e))
+        sys.exit(0 if batch(args, inputs, outputs) else 1)
+    if args.format == "bin" and args.output is None and not args.compile:
+        parser.error("--format bin requires -o")
+
+    # more workers than CPUs only adds the cost of switching between them
+    args.jobs = min(args.jobs, usable_cpus())
+    stats = Counter()
+    cache = None
+    if args.cache or args.watch:
+        cache = new_cache(args, stats)
+    profiler = None
+    if args.profile:
+        from assembler.profiling import Profiler
+
+        profiler = Profiler()
+    analysis = None
+    if args.analyze:
+        from assembler.analysis import Analysis, CostModel
+
+        try:
+            analysis = Analysis(CostModel.parse(args.cost))
+        except Exception as e:
+            parser.error(str(e))
+    if args.watch:
+        watch(args, inputs[0], cache)
+    else:
+        saved = Counter()
+        build(args, inputs[0], args.output, cache, stats, profiler, saved, analysis)
+        if args.gc_sections:
+            report_saved(saved)
+        if args.optimize:
+            report(stats)
+    if analysis is not None:
+        for line in analysis.report(args.hot_spots):
+            print(line, file=sys.stderr)
+        if args.analyze_json is not None:
+            analysis.write_json(args.analyze_json)
+    if profiler is not None:
+        for line in profiler.report():
+            print(line, file=sys.stderr)
+        if args.profile_json is not None:
+            profiler.write_json(args.profile_json)
@@ -0,0 +1,24 @@
+from assembler.assembler import link
+from assembler.objfile import read_object
+from assembler.output import write_image
+from argparse import ArgumentParser
+
+
+def main():
+    parser = ArgumentParser("CS147 Linker")
+    parser.add_argument("OBJECT_FILES", type=str, nargs="+")
+    parser.add_argument(
+        "-o", "--output", type=str, help="output path (default: standard out)"
+    )
+    parser.add_argument(
+        "--format",
+        choices=["memh", "bin", "ihex"],
+        default="memh",
+        help="output format",
+    )
+    args = parser.parse_args()
+    if args.format == "bin" and args.output is None:
+        parser.error("--format bin requires -o")
+
+    image = link((read_object(path) for path in args.OBJECT_FILES), modules=True)
+    write_image(image, args.format, args.output)
@@ -1,26 +1,78 @@
+import os
 import re
-from .translator import INSTRUCTIONS
+from array import array
+from bisect import bisect_left
+from .blocks import Block, Fill, IncludedFile
+from .translator import (
+    ENCODINGS,
+    INSTRUCTIONS,
+    MACROS,
+    PSEUDO_INSTRUCTIONS,
+    REGISTER_IDS,
+    WORD_MASK,
+    imm_to_int,
+)
 from dataclasses import dataclass
-from typing import List, Optional, Tuple, Union
+from typing import (
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
 
 REGISTERS = [f"r{i}" for i in range(0, 32)]
 
 
-@dataclass
+@dataclass(init=False, eq=False)
 class Token:
+    __slots__ = ("cls", "contents", "line", "column")
     cls: str
     contents: str
+    line: int  # 1-based position in the source, 0 when unknown
+    column: int
+
+    def __init__(self, cls: str, contents: str, line: int = 0, column: int = 0):
+        self.cls = cls
+        self.contents = contents
+        self.line = line
+        self.column = column
+
+    def __eq__(self, other):
+        # where a token came from isn't part of its value
+        if type(other) is not Token:
+            return NotImplemented
+        return self.cls == other.cls and self.contents == other.contents
 
 
 @dataclass
 class Label:
+    __slots__ = ("name",)
     name: str
 
 
-@dataclass
+@dataclass(init=False, eq=False)
 class Instruction:
+    __slots__ = ("name", "args", "line", "column")
     name: str
     args: List[Token]
+    line: int  # where the mnemonic is, 0 when unknown
+    column: int
+
+    def __init__(self, name: str, args: List[Token], line: int = 0, column: int = 0):
+        self.name = name
+        self.args = args
+        self.line = line
+        self.column = column
+
+    def __eq__(self, other):
+        if type(other) is not Instruction:
+            return NotImplemented
+        return self.name == other.name and self.args == other.args
 
 
 @dataclass
@@ -28,10 +80,24 @@ class TextSegment:
     items: List[Union[Label, Instruction]]
 
 
-@dataclass
+@dataclass(init=False, eq=False)
 class Data:
+    __slots__ = ("name", "values", "line", "column")
     name: str
     values: List[Token]
+    line: int  # where the name is, 0 when unknown
+    column: int
+
+    def __init__(self, name: str, values: List[Token], line: int = 0, column: int = 0):
+        self.name = name
+        self.values = values
+        self.line = line
+        self.column = column
+
+    def __eq__(self, other):
+        if type(other) is not Data:
+            return NotImplemented
+        return self.name == other.name and self.values == other.values
 
 
 @dataclass
@@ -39,178 +105,1000 @@ class DataSegment:
     items: List[Data]
 
 
-def any_of(*items: str):
-    items = sorted(list(items), key=len, reverse=True)
-    items = "|".join(map(lambda a: f"({a})", items))
-    return re.compile(f"({items})")
-
-
-def lex(contents: str) -> List[Token]:
-    possibilities = [
-        (
-            "whitespace",
-            re.compile(r"[\t\r\n ]*"),
-        ),
-        (
-            "register",
-            any_of(*REGISTERS),
-        ),
-        (
-            "instruction",
-            any_of(*INSTRUCTIONS, "la"),  # la is recognized by assembler
-        ),
-        (
-            "label",
-            re.compile(r"[a-zA-Z_][a-zA-Z_0-9]*"),
-        ),
-        (
-            "literal",
-            re.compile(r"((0x[0-9A-F]+)|(0b[01]+)|(-?[0-9]+))"),
-        ),
-        (
-            "colon",
-            re.compile(r":"),
-        ),
-        (
-            "comma",
-            re.compile(r","),
-        ),
-        (
-            "semicolon",
-            re.compile(r";"),
-        ),
-        (
-            "comment",
-            re.compile(r"#.*"),
-        ),
-        ("data", re.compile(r"\.data")),
-        ("text", re.compile(r"\.text")),
-    ]
-
-    position = 0
-    tokens = []
-
-    while position < len(contents):
-        longest_chunk = 0
-        possib_name = ""
-        for possib, expr in possibilities:
-            match = expr.match(contents, position)
-            if match and len(match.group()) > longest_chunk:
-                longest_chunk = len(match.group())
-                possib_name = possib
-        if longest_chunk == 0:
-            raise Exception(f"Unexpected token starting at {contents[position:]}")
-        tokens.append(Token(possib_name, contents[position : position + longest_chunk]))
-        position = position + longest_chunk
-    return tokens
-
-
-def preprocess(tokens: List[Token]):
-    exclude = {"whitespace", "comment"}
-    return list(filter(lambda tok: tok.cls not in exclude, tokens))
-
-
-def parse(tokens: List[Token]) -> List[Union[DataSegment, TextSegment]]:
-    def parse_label(idx: int) -> Tuple[Optional[Label], int]:
-        # label:
+# ==============================
+# Compact program representation
+# ==============================
+# every mnemonic the assembler can encode, including macros, gets a small id
+MNEMONICS = sorted(ENCODINGS) + sorted(MACROS)
+MNEMONIC_IDS = {name: i for i, name in enumerate(MNEMONICS)}
+
+# operand kinds
+REGISTER = 0
+LITERAL = 1
+LABEL = 2
+OPERAND_KINDS = ["register", "literal", "label"]
+OPERAND_KIND_IDS = {cls: i for i, cls in enumerate(OPERAND_KINDS)}
+
+
+class Strings:
+    """
+    Interns strings into small ids
+    """
+
+    __slots__ = ("names", "ids")
+
+    def __init__(self):
+        self.names: List[str] = []
+        self.ids: Dict[str, int] = {}
+
+    def intern(self, name: str) -> int:
+        i = self.ids.get(name)
+        if i is None:
+            i = self.ids[name] = len(self.names)
+            self.names.append(name)
+        return i
+
+
+class Program:
+    """
+    Columnar form of a parsed program. Instructions are a mnemonic id each,
+    with their operands stored as (kind, value) pairs in flat arrays: the
+    register number, an index into the literal table or an index into the
+    symbol table. Labels and data are kept as symbol ids next to the index
+    of the instruction or value they point to. Literals keep their source
+    spelling so that the annotated output can quote it, and instructions
+    and data items the line and column they start at
+    """
+
+    __slots__ = (
+        "ops",
+        "arg_start",
+        "arg_kinds",
+        "args",
+        "label_ids",
+        "label_at",
+        "data_ids",
+        "data_start",
+        "data_values",
+        "data_blocks",
+        "lines",
+        "columns",
+        "data_lines",
+        "data_columns",
+        "value_at",
+        "value_lines",
+        "value_columns",
+        "symbols",
+        "literals",
+        "literal_values",
+    )
+
+    def __init__(self):
+        self.ops = array("B")  # mnemonic id per instruction
+        # operands of instruction i are args[arg_start[i] : arg_start[i + 1]]
+        self.arg_start = array("i", [0])
+        self.arg_kinds = array("B")
+        self.args = array("i")
+        self.label_ids = array("i")  # symbol id of every text label
+        self.label_at = array("i")  # index of the instruction it points to
+        self.data_ids = array("i")  # symbol id of every data item
+        # values of data item i are data_values[data_start[i] : data_start[i + 1]]
+        self.data_start = array("i", [0])
+        self.data_values = array("i")  # literal ids
+        # data item : the block of words a directive stands for, in place
+        # of values
+        self.data_blocks: Dict[int, Block] = {}
+        # where each instruction and data item is in the source, 0 when
+        # unknown
+        self.lines = array("i")
+        self.columns = array("i")
+        self.data_lines = array("i")
+        self.data_columns = array("i")
+        # data values that go on onto another source line than the one
+        # before them: the index into data_values, and where they are
+        self.value_at = array("i")
+        self.value_lines = array("i")
+        self.value_columns = array("i")
+        self.symbols = Strings()
+        self.literals = Strings()
+        self.literal_values: List[int] = []
+
+    def __len__(self):
+        return len(self.ops)
+
+    def label(self, name: str):
+        self.label_ids.append(self.symbols.intern(name))
+        self.label_at.append(len(self.ops))
+
+    def instruction(
+        self, name: str, args: Iterable[Token] = (), line: int = 0, column: int = 0
+    ):
+        self.ops.append(MNEMONIC_IDS[name])
+        self.lines.append(line)
+        self.columns.append(column)
+        self.arg_start.append(self.arg_start[-1])
+        for arg in args:
+            self.operand(arg.cls, arg.contents)
+
+    def operand(self, cls: str, contents: str):
+        """
+        Adds an operand to the last instruction
+        """
+        if cls == "register":
+            value = REGISTER_IDS[contents]
+        elif cls == "literal":
+            value = self.literal(contents)
+        else:
+            value = self.symbols.intern(contents)
+        self.arg_kinds.append(OPERAND_KIND_IDS[cls])
+        self.args.append(value)
+        self.arg_start[-1] += 1
+
+    def data(
+        self, name: str, values: Sequence[Token] = (), line: int = 0, column: int = 0
+    ):
+        self.data_ids.append(self.symbols.intern(name))
+        self.data_lines.append(line)
+        self.data_columns.append(column)
+        self.data_start.append(self.data_start[-1])
+        if values and values[0].cls == "directive":
+            self.data_blocks[len(self.data_ids) - 1] = data_block(values)
+            return
+        for val in values:
+            if val.line and val.line != line:
+                line = val.line
+                self.value_at.append(len(self.data_values))
+                self.value_lines.append(line)
+                self.value_columns.append(val.column)
+            self.value(val.contents)
+
+    def value(self, contents: str):
+        """
+        Adds a value to the last data item
+        """
+        self.data_values.append(self.literal(contents))
+        self.data_start[-1] += 1
+
+    def literal(self, contents: str) -> int:
+        i = self.literals.intern(contents)
+        if i == len(self.literal_values):
+            self.literal_values.append(imm_to_int(contents))
+        return i
+
+    def data_length(self, i: int) -> int:
+        """
+        Returns the number of words data item i takes
+        """
+        block = self.data_blocks.get(i)
+        if block is not None:
+            return len(block)
+        return self.data_start[i + 1] - self.data_start[i]
+
+    def extend(self, other: "Program"):
+        """
+        Appends other, as if its source came after this one's. The ids end
+        up the same as if the two sources had been parsed as one
+        """
+        symbols = array("i", map(self.symbols.intern, other.symbols.names))
+        literals = array("i")
+        for contents, value in zip(other.literals.names, other.literal_values):
+            i = self.literals.intern(contents)
+            if i == len(self.literal_values):
+                self.literal_values.append(value)
+            literals.append(i)
+        base = len(self.ops)
+        arg_base = len(self.args)
+        data_base = len(self.data_ids)
+        value_base = len(self.data_values)
+
+        self.ops.extend(other.ops)
+        self.arg_start.extend(start + arg_base for start in other.arg_start[1:])
+        self.arg_kinds.extend(other.arg_kinds)
+        self.args.extend(
+            (
+                value
+                if kind == REGISTER
+                else literals[value] if kind == LITERAL else symbols[value]
+            )
+            for kind, value in zip(other.arg_kinds, other.args)
+        )
+        self.label_ids.extend(symbols[symbol] for symbol in other.label_ids)
+        self.label_at.extend(at + base for at in other.label_at)
+        self.data_ids.extend(symbols[symbol] for symbol in other.data_ids)
+        self.data_start.extend(start + value_base for start in other.data_start[1:])
+        self.data_values.extend(literals[value] for value in other.data_values)
+        for i, block in other.data_blocks.items():
+            self.data_blocks[data_base + i] = block
+        self.lines.extend(other.lines)
+        self.columns.extend(other.columns)
+        self.data_lines.extend(other.data_lines)
+        self.data_columns.extend(other.data_columns)
+        self.value_at.extend(at + value_base for at in other.value_at)
+        self.value_lines.extend(other.value_lines)
+        self.value_columns.extend(other.value_columns)
+
+    def value_positions(self, i: int) -> Iterator[Tuple[int, int, int]]:
+        """
+        Yields the offset into data item i, line and column of every value
+        of it that starts another source line
+        """
+        start, end = self.data_start[i], self.data_start[i + 1]
+        j = bisect_left(self.value_at, start)
+        while j < len(self.value_at) and self.value_at[j] < end:
+            yield self.value_at[j] - start, self.value_lines[j], self.value_columns[j]
+            j += 1
+
+    def data_words(self, i: int) -> Iterator[array]:
+        """
+        Yields the words of data item i, in one or more arrays
+        """
+        block = self.data_blocks.get(i)
+        if block is not None:
+            yield from block.chunks()
+            return
+        values = self.literal_values
+        yield array(
+            "I",
+            (
+                values[v] & WORD_MASK
+                for v in self.data_values[self.data_start[i] : self.data_start[i + 1]]
+            ),
+        )
+
+    def data_text(self, i: int) -> str:
+        """
+        Returns the values of data item i as written in the source
+        """
+        block = self.data_blocks.get(i)
+        if block is not None:
+            directive, *args = block.tokens
+            return f"{directive.contents} " + ", ".join(arg.contents for arg in args)
+        literals = self.literals.names
+        return ", ".join(
+            literals[v]
+            for v in self.data_values[self.data_start[i] : self.data_start[i + 1]]
+        )
+
+    def name(self, i: int) -> str:
+        return MNEMONICS[self.ops[i]]
+
+    def operands(self, i: int) -> List[Union[int, str]]:
+        """
+        Returns the register numbers, literal values and label names
+        instruction i takes
+        """
+        result = []
+        start, end = self.arg_start[i], self.arg_start[i + 1]
+        for kind, value in zip(self.arg_kinds[start:end], self.args[start:end]):
+            if kind == REGISTER:
+                result.append(value)
+            elif kind == LITERAL:
+                result.append(self.literal_values[value])
+            else:
+                result.append(self.symbols.names[value])
+        return result
+
+    def operand_text(self, kind: int, value: int) -> str:
+        if kind == REGISTER:
+            return REGISTERS[value]
+        if kind == LITERAL:
+            return self.literals.names[value]
+        return self.symbols.names[value]
+
+    def statements(self) -> Iterator[Union[Label, Instruction, Data]]:
+        """
+        Yields the program as Data, followed by the text as Label and
+        Instruction records
+        """
+        symbols = self.symbols.names
+        literals = self.literals.names
+        for i, symbol in enumerate(self.data_ids):
+            block = self.data_blocks.get(i)
+            line, column = self.data_lines[i], self.data_columns[i]
+            if block is not None:
+                yield Data(symbols[symbol], block.tokens, line, column)
+                continue
+            start, end = self.data_start[i], self.data_start[i + 1]
+            values = [
+                Token("literal", literals[v]) for v in self.data_values[start:end]
+            ]
+            for offset, value_line, value_column in self.value_positions(i):
+                values[offset].line = value_line
+                values[offset].column = value_column
+            yield Data(symbols[symbol], values, line, column)
+        label = 0
+        for i in range(len(self.ops)):
+            while label < len(self.label_ids) and self.label_at[label] <= i:
+                yield Label(symbols[self.label_ids[label]])
+                label += 1
+            start, end = self.arg_start[i], self.arg_start[i + 1]
+            yield Instruction(
+                self.name(i),
+                [
+                    Token(OPERAND_KINDS[kind], self.operand_text(kind, value))
+                    for kind, value in zip(
+                        self.arg_kinds[start:end], self.args[start:end]
+                    )
+                ],
+                self.lines[i],
+                self.columns[i],
+            )
+        # labels after the last instruction don't point anywhere, but are
+        # still defined
+        for symbol in self.label_ids[label:]:
+            yield Label(symbols[symbol])
+
+    def segments(self) -> List[Union[DataSegment, TextSegment]]:
+        datas = []
+        items = []
+        for statement in self.statements():
+            (datas if type(statement) is Data else items).append(statement)
+        return (
+            [DataSegment(datas), TextSegment(items)] if datas else [TextSegment(items)]
+        )
+
+    @classmethod
+    def from_statements(
+        cls, statements: Iterable[Union[Label, Instruction, Data]]
+    ) -> "Program":
+        program = cls()
+        for statement in statements:
+            if type(statement) is Label:
+                program.label(statement.name)
+            elif type(statement) is Instruction:
+                program.instruction(
+                    statement.name, statement.args, statement.line, statement.column
+                )
+            else:
+                program.data(
+                    statement.name, statement.values, statement.line, statement.column
+                )
+        return program
+
+    @classmethod
+    def from_segments(
+        cls, segments: Iterable[Union[DataSegment, TextSegment]]
+    ) -> "Program":
+        return cls.from_statements(
+            item for segment in segments for item in segment.items
+        )
+
+
+def as_program(
+    program: Union[Program, Iterable[Union[DataSegment, TextSegment]]],
+) -> Program:
+    if isinstance(program, Program):
+        return program
+    return Program.from_segments(program)
+
+
+# every token class is folded into a single scanner. registers and
+# instructions are lexed as plain words and then classified with a set
+# lookup, which gives the same result as trying them as separate
+# longest-match patterns (a word is always at least as long as any
+# register or instruction it starts with)
+SCANNER = re.compile(
+    r"""
+    (?P<whitespace>[\t\r ]+)
+    |(?P<newline>\n[\t\r\n ]*)
+    |(?P<comment>\#.*)
+    |(?P<word>[a-zA-Z_][a-zA-Z_0-9]*)
+    |(?P<literal>0x[0-9A-F]+|0b[01]+|-?[0-9]+)
+    |(?P<colon>:)
+    |(?P<comma>,)
+    |(?P<semicolon>;)
+    |(?P<data>\.data)
+    |(?P<text>\.text)
+    |(?P<directive>\.[a-z]+)
+    |(?P<string>"[^"\n]*")
+    |(?P<parameter>\\[a-zA-Z_][a-zA-Z_0-9]*)
+    |(?P<error>.)
+    """,
+    re.VERBOSE,
+)
+KEYWORDS = {
+    **{reg: "register" for reg in REGISTERS},
+    **{inst: "instruction" for inst in INSTRUCTIONS},
+    # expanded by the assembler
+    **{inst: "instruction" for inst in PSEUDO_INSTRUCTIONS},
+}
+SKIPPED = {"whitespace", "newline", "comment"}
+
+
+MAX_QUOTE = 40  # longest piece of source quoted in an error message
+
+
+def quote(text: str) -> str:
+    return text if len(text) <= MAX_QUOTE else text[:MAX_QUOTE] + "..."
+
+
+def lex(contents: str, line: int = 1) -> Iterator[Token]:
+    """
+    Lazily yields the tokens in contents, dropping whitespace and comments.
+    Every token records its line and column, counting lines from line
+    """
+    keywords = KEYWORDS
+    line_start = 0
+    for match in SCANNER.finditer(contents):
+        cls = match.lastgroup
+        if cls in SKIPPED:
+            if cls == "newline":
+                text = match.group()
+                line += text.count("\n")
+                line_start = match.start() + text.rindex("\n") + 1
+            continue
+        text = match.group()
+        position = match.start()
+        if cls == "word":
+            cls = keywords.get(text, "label")
+        elif cls == "error":
+            end = contents.find("\n", position)
+            rest = contents[position:] if end == -1 else contents[position:end]
+            raise Exception(
+                f"Unexpected token starting at {quote(rest)} "
+                f"(line {line}, column {position - line_start + 1})"
+            )
+        yield Token(cls, text, line, position - line_start + 1)
+
+
+def lex_lines(lines: Iterable[str]) -> Iterator[Token]:
+    """
+    Lexes line by line, so a file can be streamed without reading it whole
+    """
+    for number, line in enumerate(lines, 1):
+        yield from lex(line, number)
+
+
+def preprocess(tokens: Iterable[Token]) -> Iterator[Token]:
+    """
+    Drops whitespace and comments, and expands macros and repeats
+    """
+    return Expander().expand(tok for tok in tokens if tok.cls not in SKIPPED)
+
+
+MAX_EXPANSION_DEPTH = 64  # macros and repeats inside each other
+OPENING = {".macro": ".endm", ".rept": ".endr"}
+CLOSING = {".endm": ".macro", ".endr": ".rept"}
+# where the next token starts a statement
+STATEMENT_END = {"semicolon", "colon", "text", "data"}
+
+
+def where(tok: Token) -> str:
+    return f" (line {tok.line}, column {tok.column})" if tok.line else ""
+
+
+class Body:
+    """
+    Tokens of a macro or repeat, stored once however often it's expanded.
+    Labels defined inside it are local to every expansion
+    """
+
+    __slots__ = ("name", "params", "tokens", "locals", "words", "nested")
+
+    def __init__(self, name: str, params: List[str], tokens: List[Token]):
+        self.name = name
+        self.params = params
+        self.tokens = tokens
+        self.locals = {
+            tok.contents
+            for tok, following in zip(tokens, tokens[1:])
+            if tok.cls == "label" and following.cls == "colon"
+        }
+        # what could make an expansion need expanding again
+        self.words = {tok.contents for tok in tokens if tok.cls == "label"}
+        self.nested = any(tok.cls == "directive" for tok in tokens)
+
+
+class TokenStream:
+    """
+    Token iterator that tokens can be pushed back onto
+    """
+
+    __slots__ = ("tokens", "ahead")
+
+    def __init__(self, tokens: Iterable[Token]):
+        self.tokens = iter(tokens)
+        self.ahead: List[Token] = []
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> Token:
+        if self.ahead:
+            return self.ahead.pop()
+        return next(self.tokens)
+
+    def next(self) -> Optional[Token]:
+        if self.ahead:
+            return self.ahead.pop()
+        return next(self.tokens, None)
+
+    def push(self, tok: Token):
+        self.ahead.append(tok)
+
+
+class Expander:
+    """
+    Expands `.macro name param, ...` ... `.endm` definitions and their uses,
+    and `.rept count` ... `.endr` blocks, in a token stream. A directive
+    and its arguments take the rest of their line, and parameters are used
+    in a body as `\\param`. Expansion is lazy: a body is kept as one list of
+    tokens and copied a token at a time as the parser asks for more. Labels
+    defined in a body get a new name in every expansion, __label_N, so
+    names starting with two underscores shouldn't be used in source
+    """
+
+    def __init__(self):
+        self.macros: Dict[str, Body] = {}
+        self.expansions = 0
+
+    def expand(self, tokens: Iterable[Token], depth: int = 0) -> Iterator[Token]:
+        stream = TokenStream(tokens)
+        macros = self.macros
+        start = True
+        for tok in stream:
+            cls = tok.cls
+            if cls == "directive" and (
+                tok.contents in OPENING or tok.contents in CLOSING
+            ):
+                yield from self.directive(tok, stream, depth)
+                start = True
+            elif cls == "label" and start and tok.contents in macros:
+                following = stream.next()
+                if following is not None:
+                    stream.push(following)
+                if following is not None and following.cls == "colon":
+                    # a label that happens to share the macro's name
+                    yield tok
+                else:
+                    yield from self.call(tok, stream, depth)
+                    start = True
+            else:
+                yield tok
+                start = cls in STATEMENT_END
+
+    def directive(
+        self, directive: Token, stream: TokenStream, depth: int
+    ) -> Iterator[Token]:
+        name = directive.contents
+        if name in CLOSING:
+            raise Exception(f"{name} without {CLOSING[name]}{where(directive)}")
+        args = self.arguments(directive, stream)
+        body = self.body(directive, stream)
+        if name == ".macro":
+            params = args[1::2]
+            if args and args[0].cls == "instruction":
+                raise Exception(
+                    f"Macro {args[0].contents} would hide an instruction"
+                    f"{where(directive)}"
+                )
+            if (
+                not args
+                or args[0].cls != "label"
+                or any(param.cls != "label" for param in params)
+                or any(arg.cls != "comma" for arg in args[2::2])
+                or (len(args) > 1 and len(args) % 2 == 1)
+            ):
+                raise Exception(f"Expected .macro name param, ...{where(directive)}")
+            macro = args[0].contents
+            self.macros[macro] = Body(macro, [param.contents for param in params], body)
+            return iter(())
         if (
-            tokens[idx].cls != "label"
-            or idx + 1 >= len(tokens)
-            or tokens[idx + 1].cls != "colon"
+            len(args) != 1
+            or args[0].cls != "literal"
+            or imm_to_int(args[0].contents) < 0
         ):
-            return None, idx
-        return Label(tokens[idx].contents), idx + 2
-
-    def parse_instruction(idx: int) -> Tuple[Optional[Instruction], int]:
-        # keyword [(literal|register|label) {, (literal|register|label)}];
-        if tokens[idx].cls != "instruction":
-            return None, idx
-        name = tokens[idx].contents
+            raise Exception(f"Expected .rept count{where(directive)}")
+        return self.repeat(Body(name, [], body), imm_to_int(args[0].contents), depth)
+
+    def arguments(self, directive: Token, stream: TokenStream) -> List[Token]:
+        """
+        Returns the arguments of a directive: the rest of its line, without
+        the semicolon it can end with
+        """
+        args = []
+        while True:
+            tok = stream.next()
+            if tok is None:
+                break
+            if tok.line != directive.line:
+                stream.push(tok)
+                break
+            if tok.cls == "semicolon":
+                break
+            args.append(tok)
+        return args
+
+    def body(self, directive: Token, stream: TokenStream) -> List[Token]:
+        """
+        Collects the tokens up to the directive that closes this one, keeping
+        nested definitions and repeats whole
+        """
+        body = []
+        closing = [OPENING[directive.contents]]
+        for tok in stream:
+            if tok.cls == "directive":
+                if tok.contents in OPENING:
+                    closing.append(OPENING[tok.contents])
+                elif tok.contents in CLOSING:
+                    if tok.contents != closing[-1]:
+                        raise Exception(
+                            f"Expected {closing[-1]}, got {tok.contents}{where(tok)}"
+                        )
+                    closing.pop()
+                    if not closing:
+                        self.arguments(tok, stream)
+                        return body
+            body.append(tok)
+        raise Exception(f"{directive.contents} without {closing[0]}{where(directive)}")
+
+    def call(self, name: Token, stream: TokenStream, depth: int) -> Iterator[Token]:
+        macro = self.macros[name.contents]
         args = []
-        # take any arguments
-        pos = idx + 1
-        posibs = {"literal", "register", "label"}
-        if pos < len(tokens) and tokens[pos].cls in posibs:
-            args.append(tokens[pos])
-            pos += 1
-
-            while pos < len(tokens) and tokens[pos].cls != "semicolon":
-                if tokens[pos].cls != "comma":
-                    return None, pos
-                pos += 1
-                if tokens[pos].cls not in {"literal", "register", "label"}:
-                    return None, pos
-                args.append(tokens[pos])
-                pos += 1
-        if pos >= len(tokens) or tokens[pos].cls != "semicolon":
-            return None, pos
-        return Instruction(name=name, args=args), pos + 1
-
-    def parse_data(idx: int) -> Tuple[Optional[Data], int]:
-        # label: d1 {, d2};
+        for tok in stream:
+            if tok.cls == "semicolon":
+                break
+            args.append(tok)
+        values = args[0::2]
+        if any(arg.cls != "comma" for arg in args[1::2]) or any(
+            value.cls not in ARGUMENTS for value in values
+        ):
+            raise Exception(f"Expected {name.contents} arg, ...{where(name)}")
+        if len(values) != len(macro.params):
+            raise Exception(
+                f"{name.contents} takes {len(macro.params)} arguments, "
+                f"got {len(values)}{where(name)}"
+            )
+        return self.instance(macro, dict(zip(macro.params, values)), depth)
+
+    def repeat(self, body: Body, count: int, depth: int) -> Iterator[Token]:
+        for _ in range(count):
+            yield from self.instance(body, {}, depth)
+
+    def instance(
+        self, body: Body, values: Dict[str, Token], depth: int
+    ) -> Iterator[Token]:
+        """
+        Expands one copy of body with its parameters replaced by values
+        """
+        if depth >= MAX_EXPANSION_DEPTH:
+            raise Exception(f"Expansion of {body.name} is nested too deeply")
+        self.expansions += 1
+        names = {name: f"__{name}_{self.expansions}" for name in body.locals}
+        tokens = substitute(body, values, names)
         if (
-            tokens[idx].cls != "label"
-            or idx + 1 >= len(tokens)
-            or tokens[idx + 1].cls != "colon"
+            not body.nested
+            and body.words.isdisjoint(self.macros)
+            and not any(value.contents in self.macros for value in values.values())
         ):
-            return None, idx
-        name = tokens[idx].contents
-        idx += 2
-        if tokens[idx].cls != "literal":
-            return None, idx
-        items = []
-        items.append(tokens[idx])
-        idx += 1
-        while idx < len(tokens) and tokens[idx].cls != "semicolon":
-            # take comma
-            if tokens[idx].cls != "comma":
-                return None, idx
-            idx += 1
-            # take data
-            if tokens[idx].cls != "literal":
-                return None, idx
-            items.append(tokens[idx])
-            idx += 1
-        if idx >= len(tokens):
-            return None, idx
-        # otherwise, cur token is semicolon
-        return Data(name, items), idx + 1
-
-    def any_of(fns, idx: int):
-        latest = idx
-        for f in fns:
-            result, newIdx = f(idx)
-            if result:
-                return result, newIdx
-            latest = max(newIdx, latest)
-        return None, latest
-
-    def take_items(fns, idx: int):
-        items = []
-        while idx < len(tokens):
-            v, idx = any_of(fns, idx)
-            if v is None:
-                break
-            items.append(v)
-        return items, idx
+            return tokens
+        return self.expand(tokens, depth + 1)
+
+
+def substitute(
+    body: Body, values: Dict[str, Token], names: Dict[str, str]
+) -> Iterator[Token]:
+    """
+    Yields the tokens of body with its parameters replaced by values and
+    its local labels renamed
+    """
+    for tok in body.tokens:
+        if tok.cls == "parameter":
+            value = values.get(tok.contents[1:])
+            if value is None:
+                raise Exception(
+                    f"{body.name} has no parameter {tok.contents}{where(tok)}"
+                )
+            tok = Token(value.cls, value.contents, tok.line, tok.column)
+        elif tok.cls == "label" and tok.contents in names:
+            tok = Token("label", names[tok.contents], tok.line, tok.column)
+        yield tok
+
+
+def relative_to(tokens: Iterable[Token], directory: str) -> Iterator[Token]:
+    """
+    Makes the relative paths in string tokens relative to directory, the
+    one the source was read from, instead of the working directory
+    """
+    for tok in tokens:
+        if tok.cls == "string" and not os.path.isabs(tok.contents[1:-1]):
+            path = os.path.join(directory, tok.contents[1:-1])
+            tok = Token("string", f'"{path}"', tok.line, tok.column)
+        yield tok
+
+
+def without_includes(tokens: Iterable[Token]) -> Iterator[Token]:
+    """
+    Passes tokens through, raising at any `.incbin`, for sources that
+    mustn't read files
+    """
+    for tok in tokens:
+        if tok.cls == "directive" and tok.contents == ".incbin":
+            raise Exception(f"Including files isn't allowed here{where(tok)}")
+        yield tok
+
+
+# data directive : how it's written
+DATA_DIRECTIVES = {
+    ".incbin": '.incbin "file"',
+    ".fill": ".fill count, value",
+    ".space": ".space count",
+}
+
+
+def data_block(values: Sequence[Token]) -> Block:
+    """
+    Returns the block of words a data directive and its arguments stand for
+    """
+    directive, *args = values
+    kinds = [arg.cls for arg in args]
+    name = directive.contents
+    if name == ".incbin" and kinds == ["string"]:
+        return IncludedFile(args[0].contents[1:-1], list(values))
+    if name == ".fill" and kinds == ["literal", "literal"]:
+        return Fill(
+            imm_to_int(args[0].contents), imm_to_int(args[1].contents), list(values)
+        )
+    if name == ".space" and kinds == ["literal"]:
+        return Fill(imm_to_int(args[0].contents), 0, list(values))
+    if name not in DATA_DIRECTIVES:
+        raise Exception(f"Unknown data directive {name}{where(directive)}")
+    raise Exception(f"Expected {DATA_DIRECTIVES[name]}{where(directive)}")
+
+
+ARGUMENTS = ["literal", "register", "label"]
+DIRECTIVE_ARGUMENTS = ["literal", "string"]
+MAX_ERRORS = 20  # syntax errors reported before giving up on the rest
+
+# parser states
+START = "start"  # before the first segment
+TEXT = "text"
+TEXT_LABEL = "text label"  # label
+INSTRUCTION = "instruction"  # mnemonic
+OPERAND = "operand"  # mnemonic (operand ,)* operand
+NEXT_OPERAND = "next operand"  # mnemonic (operand ,)+
+DATA = "data"
+DATA_LABEL = "data label"  # label
+FIRST_VALUE = "first value"  # label :
+VALUE = "value"  # label : (literal ,)* literal
+NEXT_VALUE = "next value"  # label : (literal ,)+
+DIRECTIVE = "directive"  # label : directive
+DIRECTIVE_ARGUMENT = "directive argument"  # label : directive (arg ,)* arg
+NEXT_DIRECTIVE_ARGUMENT = "next directive argument"  # label : directive (arg ,)+
+RECOVER = "recover"  # skipping to the end of a bad statement
+
+
+class ParseError(Exception):
+    """
+    Raised with every syntax error found in a source
+    """
+
+    def __init__(self, errors: List[str], dropped: int = 0):
+        self.errors = errors
+        message = "\n".join(errors)
+        if dropped:
+            message += f"\n... and {dropped} more errors"
+        super().__init__(message)
+
+
+class Parser:
+    """
+    Table-driven parser with a single token of lookahead. Tokens are pushed
+    in one at a time and every complete statement is handed to the label,
+    instruction, data and segment callbacks. A token the table doesn't allow
+    is recorded as an error, and everything up to the end of that statement
+    is skipped before parsing resumes, so one pass finds every error. With
+    fail_fast the first error is raised instead
+    """
+
+    def __init__(
+        self,
+        label: Callable[[str], None],
+        instruction: Callable[[str, List[Token], int, int], None],
+        data: Callable[[str, List[Token], int, int], None],
+        segment: Optional[Callable[[str], None]] = None,
+        fail_fast: bool = False,
+    ):
+        self.on_label = label
+        self.on_instruction = instruction
+        self.on_data = data
+        self.on_segment = segment
+        self.fail_fast = fail_fast
+        self.state = START
+        self.segment = START
+        self.name: Optional[Token] = None  # label or mnemonic of the statement
+        self.args: List[Token] = []  # its operands or values
+        self.errors: List[str] = []
+        self.dropped = 0
+
+    # actions, each run on the token that triggered the transition
+    def enter_segment(self, tok: Token):
+        self.segment = tok.cls
+        if self.on_segment is not None:
+            self.on_segment(tok.cls)
+
+    def begin(self, tok: Token):
+        self.name = tok
+        self.args = []
+
+    def take(self, tok: Token):
+        self.args.append(tok)
+
+    def skip(self, tok: Token):
+        pass
+
+    def end_label(self, tok: Token):
+        self.on_label(self.name.contents)
+
+    def end_instruction(self, tok: Token):
+        name = self.name
+        self.on_instruction(name.contents, self.args, name.line, name.column)
+
+    def end_data(self, tok: Token):
+        name = self.name
+        self.on_data(name.contents, self.args, name.line, name.column)
+
+    def resume(self, tok: Token):
+        # the bad statement is over
+        pass
+
+    def feed(self, tok: Token):
+        transition = TRANSITIONS[self.state].get(tok.cls)
+        if transition is None:
+            if self.state != RECOVER:
+                self.error(tok)
+            return
+        action, state = transition
+        action(self, tok)
+        self.state = self.segment if state is None else state
+
+    def close(self):
+        """
+        Checks the input didn't end in the middle of a statement, and raises
+        every error found
+        """
+        if self.state not in {START, TEXT, DATA, RECOVER}:
+            self.error(None)
+        if self.errors:
+            raise ParseError(self.errors, self.dropped)
+
+    def error(self, tok: Optional[Token]):
+        expected = " or ".join(TRANSITIONS[self.state])
+        if tok is None:
+            message = f"Error parsing, expected {expected}, got end of file"
+        else:
+            where = f" at line {tok.line}, column {tok.column}" if tok.line else ""
+            message = (
+                f"Error parsing{where}, expected {expected}, "
+                f"got {tok.cls} {quote(tok.contents)!r}"
+            )
+        if self.fail_fast:
+            raise ParseError([message])
+        if len(self.errors) < MAX_ERRORS:
+            self.errors.append(message)
+        else:
+            self.dropped += 1
+        self.state = RECOVER
+
+
+SEGMENTS = {
+    "text": (Parser.enter_segment, TEXT),
+    "data": (Parser.enter_segment, DATA),
+}
+# state : token class : (action, next state), where a next state of None
+# returns to the current segment. The order of the classes is the order
+# they are listed in as expected by error messages
+TRANSITIONS: Dict[
+    str, Dict[str, Tuple[Callable[[Parser, Token], None], Optional[str]]]
+] = {
+    START: SEGMENTS,
+    TEXT: {
+        "instruction": (Parser.begin, INSTRUCTION),
+        "label": (Parser.begin, TEXT_LABEL),
+        **SEGMENTS,
+    },
+    TEXT_LABEL: {"colon": (Parser.end_label, TEXT)},
+    INSTRUCTION: {
+        "semicolon": (Parser.end_instruction, TEXT),
+        **{cls: (Parser.take, OPERAND) for cls in ARGUMENTS},
+    },
+    OPERAND: {
+        "semicolon": (Parser.end_instruction, TEXT),
+        "comma": (Parser.skip, NEXT_OPERAND),
+    },
+    NEXT_OPERAND: {cls: (Parser.take, OPERAND) for cls in ARGUMENTS},
+    DATA: {"label": (Parser.begin, DATA_LABEL), **SEGMENTS},
+    DATA_LABEL: {"colon": (Parser.skip, FIRST_VALUE)},
+    FIRST_VALUE: {
+        "literal": (Parser.take, VALUE),
+        "directive": (Parser.take, DIRECTIVE),
+    },
+    VALUE: {
+        "semicolon": (Parser.end_data, DATA),
+        "comma": (Parser.skip, NEXT_VALUE),
+    },
+    NEXT_VALUE: {"literal": (Parser.take, VALUE)},
+    DIRECTIVE: {cls: (Parser.take, DIRECTIVE_ARGUMENT) for cls in DIRECTIVE_ARGUMENTS},
+    DIRECTIVE_ARGUMENT: {
+        "semicolon": (Parser.end_data, DATA),
+        "comma": (Parser.skip, NEXT_DIRECTIVE_ARGUMENT),
+    },
+    NEXT_DIRECTIVE_ARGUMENT: {
+        cls: (Parser.take, DIRECTIVE_ARGUMENT) for cls in DIRECTIVE_ARGUMENTS
+    },
+    RECOVER: {"semicolon": (Parser.resume, None), **SEGMENTS},
+}
+
+
+def parse(tokens: Iterable[Token]) -> List[Union[DataSegment, TextSegment]]:
+    """
+    Parses the tokens into segments, raising a ParseError with every
+    syntax error in them
+    """
+    segments: List[Union[DataSegment, TextSegment]] = []
+
+    def segment(cls: str):
+        segments.append(TextSegment([]) if cls == "text" else DataSegment([]))
+
+    parser = Parser(
+        lambda name: segments[-1].items.append(Label(name)),
+        lambda *instruction: segments[-1].items.append(Instruction(*instruction)),
+        lambda *data: segments[-1].items.append(Data(*data)),
+        segment,
+    )
+    for tok in tokens:
+        parser.feed(tok)
+    parser.close()
+    return segments
+
 
-    def parse_data_segment(idx: int):
-        if idx >= len(tokens) or tokens[idx].cls != "data":
-            return None, idx
-        v, idx = take_items([parse_data], idx + 1)
-        return DataSegment(v), idx
+def iter_parse(tokens: Iterable[Token]) -> Iterator[Union[Label, Instruction, Data]]:
+    """
+    Parses lazily, yielding each label, instruction and data item as soon as
+    it is complete. Labels and instructions only come from text segments and
+    data only from data segments, so the segment boundaries themselves aren't
+    yielded. The first syntax error is raised right away
+    """
+    ready: List[Union[Label, Instruction, Data]] = []
+    parser = Parser(
+        lambda name: ready.append(Label(name)),
+        lambda *instruction: ready.append(Instruction(*instruction)),
+        lambda *data: ready.append(Data(*data)),
+        fail_fast=True,
+    )
+    for tok in tokens:
+        parser.feed(tok)
+        if ready:
+            yield from ready
+            ready.clear()
+    parser.close()
 
-    def parse_text_segment(idx: int):
-        if idx >= len(tokens) or tokens[idx].cls != "text":
-            return None, idx
-        v, idx = take_items([parse_instruction, parse_label], idx + 1)
-        return TextSegment(v), idx
 
-    results, idx = take_items([parse_text_segment, parse_data_segment], 0)
-    if idx < len(tokens):
-        raise Exception(f"Error parsing, near {tokens[idx:]}")
-    return results
+def parse_program(tokens: Iterable[Token]) -> Program:
+    """
+    Parses straight into a Program, raising a ParseError with every syntax
+    error in the tokens
+    """
+    program = Program()
+    parser = Parser(program.label, program.instruction, program.data)
+    for tok in tokens:
+        parser.feed(tok)
+    parser.close()
+    return program
 
 
-def process(contents: str):
-    return parse(preprocess(lex(contents)))
+def process(
+    contents: str, directory: Optional[str] = None, includes: bool = True
+) -> Program:
+    """
+    Parses a source. Files it includes are looked up relative to directory
+    when it's given, and to the working directory otherwise. Without
+    includes, `.incbin` is an error
+    """
+    tokens = lex(contents)
+    if directory is not None:
+        tokens = relative_to(tokens, directory)
+    tokens = preprocess(tokens)
+    if not includes:
+        tokens = without_includes(tokens)
+    return parse_program(tokens)
@@ -0,0 +1,120 @@
+import struct
+import sys
+from array import array
+from typing import BinaryIO, Dict, List
+from .assembler import ADDRESS, BRANCH, JUMP, Fixup, Fragment
+from .output import to_big_endian
+
+# Object files hold one relocatable Fragment:
+#   header    MAGIC, version, then the counts in HEADER
+#   text      big-endian words
+#   data      big-endian words
+#   strings   u16 length + utf-8 bytes, for every symbol name
+#   labels    (string, word offset) for text labels
+#   data      (string, word offset) for data labels
+#   fixups    (word index, kind, string) relocation entries
+#   trailing  string of every label after the last instruction
+MAGIC = b"DVOBJ\0"
+VERSION = 1
+HEADER = struct.Struct(">6sH7I")
+SYMBOL = struct.Struct(">II")
+FIXUP = struct.Struct(">IBI")
+LENGTH = struct.Struct(">H")
+
+FIXUP_KINDS = [BRANCH, JUMP, ADDRESS]
+FIXUP_KIND_IDS = {kind: i for i, kind in enumerate(FIXUP_KINDS)}
+
+
+def bytes_to_words(contents: bytes) -> array:
+    words = array("I")
+    words.frombytes(contents)
+    if sys.byteorder == "little":
+        words.byteswap()
+    return words
+
+
+def dump(fragment: Fragment, f: BinaryIO):
+    strings: Dict[str, int] = {}
+
+    def intern(name: str) -> int:
+        return strings.setdefault(name, len(strings))
+
+    labels = [SYMBOL.pack(intern(k), v) for k, v in fragment.labels.items()]
+    datas = [SYMBOL.pack(intern(k), v) for k, v in fragment.data_to_offset.items()]
+    fixups = [
+        FIXUP.pack(index, FIXUP_KIND_IDS[kind], intern(label))
+        for index, kind, label in fragment.fixups
+    ]
+    trailing = [struct.pack(">I", intern(label)) for label in fragment.trailing_labels]
+
+    f.write(
+        HEADER.pack(
+            MAGIC,
+            VERSION,
+            len(fragment.text),
+            len(fragment.data),
+            len(strings),
+            len(labels),
+            len(datas),
+            len(fixups),
+            len(trailing),
+        )
+    )
+    f.write(to_big_endian(fragment.text))
+    f.write(to_big_endian(fragment.data))
+    for name in strings:
+        encoded = name.encode()
+        f.write(LENGTH.pack(len(encoded)))
+        f.write(encoded)
+    for records in (labels, datas, fixups, trailing):
+        f.write(b"".join(records))
+
+
+def read(f: BinaryIO, size: int) -> bytes:
+    contents = f.read(size)
+    if len(contents) != size:
+        raise Exception("Object file is truncated")
+    return contents
+
+
+def load(f: BinaryIO) -> Fragment:
+    header = f.read(HEADER.size)
+    if len(header) != HEADER.size or not header.startswith(MAGIC):
+        raise Exception("Not a dvassembler object file")
+    _, version, n_text, n_data, n_strings, n_labels, n_datas, n_fixups, n_trailing = (
+        HEADER.unpack(header)
+    )
+    if version != VERSION:
+        raise Exception(f"Unsupported object file version {version}")
+
+    text = bytes_to_words(read(f, n_text * 4))
+    data = bytes_to_words(read(f, n_data * 4))
+    strings: List[str] = []
+    for _ in range(n_strings):
+        (length,) = LENGTH.unpack(read(f, LENGTH.size))
+        strings.append(read(f, length).decode())
+
+    def symbols(count: int) -> Dict[str, int]:
+        contents = read(f, count * SYMBOL.size)
+        return {strings[name]: offset for name, offset in SYMBOL.iter_unpack(contents)}
+
+    labels = symbols(n_labels)
+    data_to_offset = symbols(n_datas)
+    fixups = [
+        Fixup(index, FIXUP_KINDS[kind], strings[name])
+        for index, kind, name in FIXUP.iter_unpack(read(f, n_fixups * FIXUP.size))
+    ]
+    trailing = [
+        strings[i] for (i,) in struct.iter_unpack(">I", read(f, n_trailing * 4))
+    ]
+    return Fragment(text, data, labels, data_to_offset, fixups, trailing)
+
+
+def write_object(fragment: Fragment, path: str):
+    with open(path, "wb") as f:
+        dump(fragment, f)
+
+
+def read_object(path: str) -> Fragment:
+    with open(path, "rb") as f:
+        return load(f)
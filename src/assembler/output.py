@@ -0,0 +1,102 @@
+import mmap
+import sys
+from array import array
+from typing import IO, Iterable, Iterator, Optional
+from .assembler import DATA_START_ADDR, PROGRAM_START_ADDR, Image
+
+WORD_BYTES = 4
+IHEX_RECORD_BYTES = 16
+
+
+def to_big_endian(words: array) -> bytes:
+    words = array("I", words)
+    if sys.byteorder == "little":
+        words.byteswap()
+    return words.tobytes()
+
+
+def memh_lines(image: Image) -> Iterator[str]:
+    """
+    Yields the lines of an unannotated memdump
+    """
+    yield f"@{PROGRAM_START_ADDR:08x}"
+    for word in image.text:
+        yield f"{word:08X}"
+    if len(image.data) > 0:
+        yield f"@{DATA_START_ADDR:08x}"
+        for word in image.data:
+            yield f"{word:08x}"
+
+
+def write_memh(lines: Iterable[str], f: IO[str]):
+    for line in lines:
+        f.write(line)
+        f.write("\n")
+
+
+def write_bin(image: Image, path: str):
+    """
+    Writes the image as a flat big-endian binary where the byte offset of a
+    word is its address * 4, so the data segment lands at DATA_START_ADDR * 4
+    """
+    sections = [(PROGRAM_START_ADDR, image.text)]
+    if len(image.data) > 0:
+        sections.append((DATA_START_ADDR, image.data))
+    size = max(addr + len(words) for addr, words in sections) * WORD_BYTES
+    with open(path, "w+b") as f:
+        # truncating preallocates the (sparse) file in one go
+        f.truncate(size)
+        with mmap.mmap(f.fileno(), size) as mm:
+            for addr, words in sections:
+                start = addr * WORD_BYTES
+                mm[start : start + len(words) * WORD_BYTES] = to_big_endian(words)
+
+
+def ihex_record(kind: int, addr: int, payload: bytes) -> str:
+    record = bytes([len(payload), addr >> 8, addr & 0xFF, kind]) + payload
+    checksum = -sum(record) & 0xFF
+    return f":{record.hex().upper()}{checksum:02X}"
+
+
+def ihex_lines(image: Image) -> Iterator[str]:
+    """
+    Yields Intel HEX records for the image, using byte addresses
+    """
+    upper = None
+    for addr, words in (
+        (PROGRAM_START_ADDR, image.text),
+        (DATA_START_ADDR, image.data),
+    ):
+        contents = to_big_endian(words)
+        start = addr * WORD_BYTES
+        for offset in range(0, len(contents), IHEX_RECORD_BYTES):
+            byte_addr = start + offset
+            if byte_addr >> 16 != upper:
+                # extended linear address record
+                upper = byte_addr >> 16
+                yield ihex_record(4, 0, upper.to_bytes(2, "big"))
+            # both segments start 16-byte aligned, so no record crosses
+            # a 64K boundary
+            chunk = contents[offset : offset + IHEX_RECORD_BYTES]
+            yield ihex_record(0, byte_addr & 0xFFFF, chunk)
+    yield ihex_record(1, 0, b"")
+
+
+def write_lines(lines: Iterable[str], path: Optional[str]):
+    """
+    Writes lines to path, or to standard out when there's no path
+    """
+    if path is None:
+        write_memh(lines, sys.stdout)
+    else:
+        with open(path, "w") as f:
+            write_memh(lines, f)
+
+
+def write_image(image: Image, format: str, path: Optional[str]):
+    if format == "bin":
+        write_bin(image, path)
+    elif format == "ihex":
+        write_lines(ihex_lines(image), path)
+    else:
+        write_lines(memh_lines(image), path)
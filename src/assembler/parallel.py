@@ -0,0 +1,161 @@
+from array import array
+from bisect import bisect_left
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from multiprocessing import shared_memory
+from typing import List, Optional, Tuple
+from .assembler import Layout
+from .blocks import WORD_BYTES
+from .cache import EXPANDING, SEGMENT_START, SKIPPED
+from .grammar import Program, lex, parse_program, preprocess, process, relative_to
+from .translator import encode_many
+
+# chunks handed out per job, so that a slow chunk doesn't hold up the rest
+CHUNKS_PER_JOB = 4
+MIN_CHUNK = 1 << 14  # statements; fewer aren't worth a process
+MIN_SOURCE_CHUNK = 1 << 18  # characters of source
+
+# set in every worker by start_worker
+layout: Optional[Layout] = None
+output: Optional[shared_memory.SharedMemory] = None
+
+
+def statement_boundary(contents: str, offset: int) -> int:
+    """
+    Returns the start of the first line at or after offset that follows a
+    line ending in a complete statement, or the end of contents
+    """
+    while True:
+        newline = contents.find("\n", offset)
+        if newline == -1:
+            return len(contents)
+        previous = contents[contents.rfind("\n", 0, newline) + 1 : newline]
+        # a string could hide a # or a ;
+        if '"' not in previous and previous.split("#", 1)[0].rstrip().endswith(";"):
+            return newline + 1
+        offset = newline + 1
+
+
+def split_source(contents: str, count: int) -> List[Tuple[int, str]]:
+    """
+    Splits a source into about count chunks that parse into the same
+    statements on their own, as the line each chunk starts at and its
+    source. A chunk that starts inside a segment gets the segment's
+    directive on the line before it. Sources with macros or repeats are
+    kept whole, like cache.split_segments does
+    """
+    directives = []
+    names = []
+    for match in SEGMENT_START.finditer(contents):
+        directive = match.group()
+        if directive in EXPANDING:
+            return [(1, contents)]
+        if directive[0] not in SKIPPED:
+            directives.append(match.start())
+            names.append(directive)
+    size = -(-len(contents) // count)
+    result = []
+    start = 0
+    line = 1
+    while start < len(contents):
+        end = statement_boundary(contents, start + size)
+        chunk = contents[start:end]
+        directive = bisect_left(directives, start) - 1
+        if start > 0 and directive >= 0:
+            result.append((line - 1, f"{names[directive]}\n{chunk}"))
+        else:
+            result.append((line, chunk))
+        line += chunk.count("\n")
+        start = end
+    return result
+
+
+def parse_chunk(line: int, contents: str, directory: Optional[str]) -> Program:
+    tokens = lex(contents, line)
+    if directory is not None:
+        tokens = relative_to(tokens, directory)
+    return parse_program(preprocess(tokens))
+
+
+def process_parallel(
+    contents: str, directory: Optional[str] = None, jobs: int = 1
+) -> Program:
+    """
+    Lexes and parses a source in chunks spread over jobs worker processes,
+    and joins them into the same Program as grammar.process gives
+    """
+    count = max(1, min(jobs * CHUNKS_PER_JOB, len(contents) // MIN_SOURCE_CHUNK))
+    pieces = split_source(contents, count) if jobs > 1 and count > 1 else []
+    if len(pieces) <= 1:
+        return process(contents, directory)
+    try:
+        with ProcessPoolExecutor(jobs) as pool:
+            lines, sources = zip(*pieces)
+            programs = list(pool.map(parse_chunk, lines, sources, repeat(directory)))
+    except Exception:
+        # errors are reported as a single pass over the whole source
+        # reports them, which also numbers them the same
+        return process(contents, directory)
+    program = programs[0]
+    for other in programs[1:]:
+        program.extend(other)
+    return program
+
+
+def chunks(result: Layout, jobs: int) -> List[Tuple[int, int]]:
+    """
+    Splits the statements of result into [start, end) ranges for jobs
+    workers, or a single range when they're too few to be worth it
+    """
+    count = max(1, min(jobs * CHUNKS_PER_JOB, len(result) // MIN_CHUNK))
+    bounds = [len(result) * i // count for i in range(count + 1)]
+    return list(zip(bounds, bounds[1:]))
+
+
+def start_worker(result: Layout, name: str):
+    global layout, output
+    layout = result
+    output = shared_memory.SharedMemory(name)
+
+
+def encode_chunk(start: int, end: int):
+    """
+    Encodes statements [start, end) into their words of the shared buffer
+    """
+    encoded = array("I", encode_many(map(layout.statement, range(start, end))))
+    addresses = layout.addresses
+    if len(encoded) != addresses[end] - addresses[start]:
+        raise Exception(
+            f"Statements {start} to {end} took {len(encoded)} words, "
+            f"expected {addresses[end] - addresses[start]}"
+        )
+    # released right away, so the worker can close the buffer when it exits
+    with output.buf.cast("I") as words:
+        words[addresses[start] : addresses[end]] = encoded
+
+
+def encode_parallel(result: Layout, jobs: int) -> array:
+    """
+    Encodes the text of a resolved program in jobs worker processes, which
+    write straight into one shared buffer of words. Gives the same words as
+    encoding it serially, in the same order
+    """
+    ranges = chunks(result, jobs)
+    if jobs <= 1 or len(ranges) == 1:
+        return array("I", encode_many(result.statements()))
+
+    size = result.addresses[-1]
+    buffer = shared_memory.SharedMemory(create=True, size=size * WORD_BYTES)
+    try:
+        with ProcessPoolExecutor(
+            jobs, initializer=start_worker, initargs=(result, buffer.name)
+        ) as pool:
+            futures = [pool.submit(encode_chunk, start, end) for start, end in ranges]
+            for future in futures:
+                future.result()
+        text = array("I")
+        text.frombytes(buffer.buf[: size * WORD_BYTES])
+        return text
+    finally:
+        buffer.close()
+        buffer.unlink()
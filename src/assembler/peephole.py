@@ -0,0 +1,256 @@
+from collections import Counter
+from typing import Callable, Iterable, List, Optional, Set, Tuple, Union
+from .grammar import Data, DataSegment, Instruction, Label, TextSegment, Token
+
+TextItem = Union[Label, Instruction]
+
+# instructions after which execution never falls through
+UNCONDITIONAL = {"jmp", "jr"}
+# instructions whose first argument is the register they write
+WRITES_FIRST = {
+    "add",
+    "sub",
+    "mul",
+    "and",
+    "or",
+    "nor",
+    "slt",
+    "sll",
+    "srl",
+    "addi",
+    "muli",
+    "andi",
+    "ori",
+    "lui",
+    "slti",
+    "lw",
+    "la",
+    "li",
+}
+
+
+def args_of(inst: Instruction) -> List[str]:
+    return [arg.contents for arg in inst.args]
+
+
+def is_swap(window: List[TextItem]) -> Optional[Tuple[str, str]]:
+    """
+    Returns the registers swapped by add a,a,b; sub b,a,b; sub a,a,b
+    """
+    if len(window) != 3 or not all(type(i) is Instruction for i in window):
+        return None
+    if [i.name for i in window] != ["add", "sub", "sub"]:
+        return None
+    first, second, third = map(args_of, window)
+    a, b = first[0], first[2]
+    if a == b or first != [a, a, b]:
+        return None
+    if second != [b, a, b] or third != [a, a, b]:
+        return None
+    return a, b
+
+
+def remove_swap_pairs(items: List[TextItem]) -> Tuple[List[TextItem], int]:
+    # swapping the same two registers twice in a row does nothing
+    result = []
+    removed = 0
+    i = 0
+    while i < len(items):
+        first = is_swap(items[i : i + 3])
+        second = is_swap(items[i + 3 : i + 6]) if first else None
+        if first and second and set(first) == set(second):
+            i += 6
+            removed += 6
+            continue
+        result.append(items[i])
+        i += 1
+    return result, removed
+
+
+def remove_jumps_to_next(items: List[TextItem]) -> Tuple[List[TextItem], int]:
+    result = []
+    removed = 0
+    for i, item in enumerate(items):
+        if type(item) is Instruction and item.name == "jmp" and item.args:
+            target = item.args[0]
+            following = set()
+            for next_item in items[i + 1 :]:
+                if type(next_item) is not Label:
+                    break
+                following.add(next_item.name)
+            if target.cls == "label" and target.contents in following:
+                removed += 1
+                continue
+        result.append(item)
+    return result, removed
+
+
+def remove_unreachable(items: List[TextItem]) -> Tuple[List[TextItem], int]:
+    # nothing can branch to an instruction without a label, so everything
+    # between an unconditional jump and the next label is dead
+    result = []
+    removed = 0
+    dead = False
+    for item in items:
+        if type(item) is Label:
+            dead = False
+        elif dead:
+            removed += 1
+            continue
+        elif item.name in UNCONDITIONAL:
+            dead = True
+        result.append(item)
+    return result, removed
+
+
+def written_registers(inst: Instruction) -> Optional[Set[str]]:
+    """
+    Returns the registers inst writes, or None if it may write any of them
+    """
+    if inst.name == "jal":
+        return None  # the callee can do anything
+    if inst.name == "pop":
+        return {"r0"}
+    if inst.name in WRITES_FIRST and inst.args:
+        return {inst.args[0].contents}
+    return set()
+
+
+def is_zeroing(inst: Instruction) -> bool:
+    args = args_of(inst)
+    return inst.name == "sub" and len(args) == 3 and args[1] == args[2]
+
+
+def fold_zeroing(items: List[TextItem]) -> Tuple[List[TextItem], int]:
+    """
+    Tracks which registers are known to be zero inside each basic block,
+    and uses that to drop sub x,x,x when x is already zero and to fold
+    sub x,x,x; (add|or) x,x,y into (add|or) x,z,y, and
+    sub x,x,x; (addi|ori) x,x,k into (addi|ori) x,z,k when z is zero
+    """
+    result = []
+    removed = 0
+    zeros: Set[str] = set()
+    i = 0
+    while i < len(items):
+        item = items[i]
+        if type(item) is Label:
+            # other code can jump here, so forget everything
+            zeros = set()
+            result.append(item)
+            i += 1
+            continue
+
+        if is_zeroing(item):
+            x = item.args[0].contents
+            if x in zeros:
+                removed += 1
+                i += 1
+                continue
+            following = items[i + 1] if i + 1 < len(items) else None
+            zero = next(iter(sorted(zeros)), None)
+            if (
+                zero is not None
+                and type(following) is Instruction
+                and following.name in {"add", "or", "addi", "ori"}
+                and len(following.args) == 3
+                and args_of(following)[:2] == [x, x]
+                # add x,x,x would read the x that sub zeroed
+                and following.args[2].contents != x
+            ):
+                folded = Instruction(
+                    following.name,
+                    [following.args[0], Token("register", zero), following.args[2]],
+                    following.line,
+                    following.column,
+                )
+                result.append(folded)
+                removed += 1
+                zeros.discard(x)
+                i += 2
+                continue
+
+        written = written_registers(item)
+        if written is None:
+            zeros = set()
+        else:
+            zeros -= written
+            if is_zeroing(item):
+                zeros.add(item.args[0].contents)
+        result.append(item)
+        i += 1
+    return result, removed
+
+
+def is_nop(inst: Instruction) -> bool:
+    args = args_of(inst)
+    if len(args) != 3:
+        return False
+    if inst.name in {"addi", "ori", "sll", "srl"}:
+        return args[0] == args[1] and args[2] in {"0", "0x0", "0b0"}
+    if inst.name in {"and", "or"}:
+        return args[0] == args[1] == args[2]
+    return False
+
+
+def remove_nops(items: List[TextItem]) -> Tuple[List[TextItem], int]:
+    result = [item for item in items if type(item) is Label or not is_nop(item)]
+    return result, len(items) - len(result)
+
+
+RULES: List[Tuple[str, Callable[[List[TextItem]], Tuple[List[TextItem], int]]]] = [
+    ("unreachable", remove_unreachable),
+    ("jmp-next", remove_jumps_to_next),
+    ("swap-pair", remove_swap_pairs),
+    ("zero-fold", fold_zeroing),
+    ("nop", remove_nops),
+]
+
+
+def optimize_items(items: List[TextItem]) -> Tuple[List[TextItem], Counter]:
+    """
+    Runs every rule until none of them applies, returning the new items and
+    how many instructions each rule removed
+    """
+    stats = Counter()
+    changed = True
+    while changed:
+        changed = False
+        for name, rule in RULES:
+            items, removed = rule(items)
+            if removed:
+                stats[name] += removed
+                changed = True
+    return items, stats
+
+
+def optimize(
+    segments: List[Union[DataSegment, TextSegment]],
+) -> Tuple[List[Union[DataSegment, TextSegment]], Counter]:
+    """
+    Optimizes the text of a parsed program. Text and data are laid out
+    independently, so all text ends up in one segment after the data
+    """
+    datas = [segment for segment in segments if type(segment) is DataSegment]
+    items = [
+        item
+        for segment in segments
+        if type(segment) is TextSegment
+        for item in segment.items
+    ]
+    items, stats = optimize_items(items)
+    return [*datas, TextSegment(items)], stats
+
+
+def optimize_statements(
+    statements: Iterable[Union[Label, Instruction, Data]],
+) -> Tuple[List[Union[Label, Instruction, Data]], Counter]:
+    """
+    Same as optimize, but for a statement stream such as iter_parse's
+    """
+    datas = []
+    items = []
+    for statement in statements:
+        (datas if type(statement) is Data else items).append(statement)
+    items, stats = optimize_items(items)
+    return [*datas, *items], stats
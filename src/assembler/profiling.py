@@ -0,0 +1,121 @@
+import json
+import time
+import tracemalloc
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from typing import Dict, Iterator, List, Optional, Tuple
+from .assembler import Image, Layout, layout_image, resolve
+from .grammar import Token, lex, parse_program, preprocess, relative_to
+
+
+@dataclass
+class Stage:
+    name: str
+    seconds: float
+    peak_bytes: Optional[int]  # None when memory isn't traced
+    counts: Dict[str, int] = field(default_factory=dict)
+
+
+class Profiler:
+    """
+    Records the wall time, peak traced memory and item counts of each stage
+    of a run. Memory is traced with tracemalloc, which makes everything
+    several times slower, so it can be turned off to get realistic times
+    """
+
+    def __init__(self, memory: bool = True):
+        self.memory = memory
+        self.stages: List[Stage] = []
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[Dict[str, int]]:
+        """
+        Times the body as stage name. The body can fill in the yielded dict
+        with counts of what the stage processed
+        """
+        counts: Dict[str, int] = {}
+        started_tracing = False
+        if self.memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                started_tracing = True
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            yield counts
+        finally:
+            seconds = time.perf_counter() - start
+            peak = None
+            if self.memory:
+                peak = tracemalloc.get_traced_memory()[1]
+                if started_tracing:
+                    tracemalloc.stop()
+            self.stages.append(Stage(name, seconds, peak, counts))
+
+    def total_seconds(self) -> float:
+        return sum(stage.seconds for stage in self.stages)
+
+    def report(self) -> List[str]:
+        lines = [f"{'stage':<12} {'time (ms)':>10} {'peak (KiB)':>11}  counts"]
+        for stage in self.stages:
+            peak = "-" if stage.peak_bytes is None else f"{stage.peak_bytes // 1024}"
+            counts = " ".join(f"{k}={v}" for k, v in stage.counts.items())
+            lines.append(
+                f"{stage.name:<12} {stage.seconds * 1000:>10.2f} {peak:>11}  {counts}".rstrip()
+            )
+        lines.append(f"{'total':<12} {self.total_seconds() * 1000:>10.2f}")
+        return lines
+
+    def to_dict(self) -> dict:
+        return {
+            "stages": [asdict(stage) for stage in self.stages],
+            "total_seconds": self.total_seconds(),
+        }
+
+    def write_json(self, path: str):
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+            f.write("\n")
+
+
+def profile_assembly(
+    contents: str,
+    profiler: Profiler,
+    optimize: bool = False,
+    stats: Optional[Dict[str, int]] = None,
+    directory: Optional[str] = None,
+) -> Tuple[Layout, Image]:
+    """
+    Assembles contents one stage at a time under profiler. The normal
+    pipeline streams tokens from the lexer into the parser, so here they're
+    collected in between to time each stage on its own. Included files are
+    looked up relative to directory, as for process
+    """
+    with profiler.stage("lex") as counts:
+        tokens: List[Token] = list(lex(contents))
+        counts["tokens"] = len(tokens)
+    with profiler.stage("preprocess") as counts:
+        tokens = preprocess(tokens)
+        if directory is not None:
+            tokens = relative_to(tokens, directory)
+        tokens = list(tokens)
+        counts["tokens"] = len(tokens)
+    with profiler.stage("parse") as counts:
+        program = parse_program(tokens)
+        del tokens
+        counts["instructions"] = len(program)
+        counts["labels"] = len(program.label_ids)
+        counts["data"] = len(program.data_ids)
+        counts["data_words"] = sum(
+            program.data_length(i) for i in range(len(program.data_ids))
+        )
+    with profiler.stage("resolve") as counts:
+        result = resolve(program, optimize, stats)
+        counts["labels"] = len(result.labels)
+        counts["words"] = result.addresses[-1]
+        counts["relaxed"] = len(result.relaxed)
+    with profiler.stage("encode") as counts:
+        image = layout_image(result)
+        counts["text_words"] = len(image.text)
+        counts["data_words"] = len(image.data)
+    return result, image
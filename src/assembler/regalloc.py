@@ -0,0 +1,545 @@
+from bisect import insort
+from dataclasses import dataclass
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple, Union
+from .grammar import REGISTERS, Data, Instruction, Label, Token
+
+# ==============================
+# Register conventions
+# ==============================
+STAGING = 0  # push and pop go through r0, so nothing is kept in it
+ARGUMENT_REGISTERS = list(range(1, 9))  # r1-r8, in order
+RESULT = 1  # return value
+ZERO = 29  # zeroed on entry to main and never written again
+SCRATCH = 30  # spill slot addresses and values on their way in or out
+RETURN_ADDRESS = 31
+# registers values are allocated to, the ones no call passes anything in
+# first. every one of them is caller-saved
+ALLOCATABLE = [*range(9, ZERO), *ARGUMENT_REGISTERS, RETURN_ADDRESS]
+IMM_MIN, IMM_MAX = -(1 << 15), (1 << 15) - 1  # sign extended immediates
+
+# ==============================
+# Intermediate representation
+# ==============================
+# an operation is a machine instruction whose register operands are
+# virtual registers, or one of these
+LABEL = ".label"  # label name
+MOVE = ".move"  # destination, source
+CALL = ".call"  # function, result or None, arguments...
+ENTRY = ".entry"  # return address or None, parameters...
+RETURN = ".return"  # value or None, return address or None
+# instructions that write their first operand; the others only read
+DEFINES_FIRST = {
+    *("add", "sub", "mul", "and", "or", "nor", "slt", "sll", "srl"),
+    *("addi", "muli", "andi", "ori", "lui", "slti", "lw", "li", "la"),
+}
+BRANCHES = {"beq", "bne"}
+
+
+@dataclass(eq=False)
+class VReg:
+    __slots__ = ("number", "name", "hint", "fixed")
+    number: int
+    name: str  # what it holds, for reading the IR
+    hint: Optional[int]  # register it would save a move to be allocated to
+    fixed: Optional[int]  # register it always is, never allocated
+
+
+Operand = Union[VReg, int, str, None]  # literals are ints, labels strs
+
+
+@dataclass(eq=False)
+class Op:
+    __slots__ = ("name", "args", "line", "column")
+    name: str
+    args: List[Operand]
+    line: int  # where in the source it comes from, 0 when unknown
+    column: int
+
+
+@dataclass
+class Function:
+    name: str
+    ops: List[Op]
+    registers: List[VReg]  # every virtual register the ops use
+    exit: Optional[str] = None  # label a return without a return address jumps to
+
+
+def is_virtual(operand: Operand) -> bool:
+    return type(operand) is VReg and operand.fixed is None
+
+
+def defs(op: Op) -> List[VReg]:
+    name, args = op.name, op.args
+    if name in DEFINES_FIRST or name == MOVE:
+        found = args[:1]
+    elif name == CALL:
+        found = args[1:2]
+    elif name == ENTRY:
+        found = args
+    else:
+        found = []
+    return [arg for arg in found if is_virtual(arg)]
+
+
+def uses(op: Op) -> List[VReg]:
+    name, args = op.name, op.args
+    if name in DEFINES_FIRST or name == MOVE:
+        found = args[1:]
+    elif name == CALL:
+        found = args[2:]
+    elif name == ENTRY:
+        found = []
+    else:
+        found = args
+    return [arg for arg in found if is_virtual(arg)]
+
+
+def ends_block(op: Op) -> bool:
+    return op.name in BRANCHES or op.name in {"jmp", RETURN}
+
+
+# ==============================
+# Liveness
+# ==============================
+class Liveness:
+    """
+    Which virtual registers are live where in a function. The ops are split
+    into basic blocks at labels and after branches, jumps and returns, and
+    the registers live into and out of every block are found by iterating
+    to a fixed point
+    """
+
+    def __init__(self, function: Function):
+        ops = self.ops = function.ops
+        starts = {0}
+        for i, op in enumerate(ops):
+            if op.name == LABEL:
+                starts.add(i)
+            elif ends_block(op):
+                starts.add(i + 1)
+        self.starts = sorted(start for start in starts if start < len(ops))
+        self.ends = self.starts[1:] + [len(ops)]
+        block_at = {
+            ops[start].args[0]: block
+            for block, start in enumerate(self.starts)
+            if ops[start].name == LABEL
+        }
+        self.successors: List[List[int]] = []
+        for block, end in enumerate(self.ends):
+            last = ops[end - 1]
+            following = [block + 1] if block + 1 < len(self.starts) else []
+            if last.name == "jmp":
+                self.successors.append([block_at[last.args[0]]])
+            elif last.name in BRANCHES:
+                self.successors.append([block_at[last.args[2]], *following])
+            elif last.name == RETURN:
+                self.successors.append([])
+            else:
+                self.successors.append(following)
+
+        generated: List[Set[VReg]] = []
+        killed: List[Set[VReg]] = []
+        for start, end in zip(self.starts, self.ends):
+            read: Set[VReg] = set()
+            written: Set[VReg] = set()
+            for op in ops[start:end]:
+                read.update(v for v in uses(op) if v not in written)
+                written.update(defs(op))
+            generated.append(read)
+            killed.append(written)
+        self.live_in: List[Set[VReg]] = [set() for _ in self.starts]
+        self.live_out: List[Set[VReg]] = [set() for _ in self.starts]
+        changed = True
+        while changed:
+            changed = False
+            for block in reversed(range(len(self.starts))):
+                out = set()
+                for successor in self.successors[block]:
+                    out |= self.live_in[successor]
+                live = generated[block] | (out - killed[block])
+                if live != self.live_in[block] or out != self.live_out[block]:
+                    self.live_in[block] = live
+                    self.live_out[block] = out
+                    changed = True
+
+    def intervals(self) -> Dict[VReg, List[int]]:
+        """
+        Returns the [first, last] position every register is live at. Op i
+        reads its operands at position 2i and writes them at 2i + 1, so a
+        register can be reused by the op that reads it for the last time
+        """
+        found: Dict[VReg, List[int]] = {}
+
+        def extend(v: VReg, position: int):
+            interval = found.get(v)
+            if interval is None:
+                found[v] = [position, position]
+            elif position < interval[0]:
+                interval[0] = position
+            elif position > interval[1]:
+                interval[1] = position
+
+        for block, (start, end) in enumerate(zip(self.starts, self.ends)):
+            for v in self.live_in[block]:
+                extend(v, 2 * start)
+            for v in self.live_out[block]:
+                extend(v, 2 * end - 1)
+            for i in range(start, end):
+                for v in uses(self.ops[i]):
+                    extend(v, 2 * i)
+                for v in defs(self.ops[i]):
+                    extend(v, 2 * i + 1)
+        return found
+
+    def live_across_calls(self) -> Dict[int, Set[VReg]]:
+        """
+        Returns the registers still needed after every call, which the call
+        has to save, by the index of the call
+        """
+        found = {}
+        for block, (start, end) in enumerate(zip(self.starts, self.ends)):
+            live = set(self.live_out[block])
+            for i in reversed(range(start, end)):
+                op = self.ops[i]
+                live.difference_update(defs(op))
+                if op.name == CALL:
+                    found[i] = set(live)
+                live.update(uses(op))
+        return found
+
+
+# ==============================
+# Allocation
+# ==============================
+class Slot(NamedTuple):
+    index: int  # word in the function's spill area
+
+
+Location = Union[int, Slot]  # a register number, or a spill slot
+
+
+@dataclass
+class Allocation:
+    registers: Dict[VReg, int]
+    slots: Dict[VReg, int]
+    saved: Dict[int, Set[VReg]]  # call index : registers it saves
+
+    def location(self, v: VReg) -> Location:
+        if v.fixed is not None:
+            return v.fixed
+        if v in self.registers:
+            return self.registers[v]
+        return Slot(self.slots[v])
+
+
+def set_hints(function: Function):
+    # values that are passed to or from a call in a register would rather
+    # be in that register already
+    for op in function.ops:
+        args = op.args
+        if op.name == ENTRY:
+            hinted = [(args[0], RETURN_ADDRESS), *zip(args[1:], ARGUMENT_REGISTERS)]
+        elif op.name == CALL:
+            hinted = [(args[1], RESULT), *zip(args[2:], ARGUMENT_REGISTERS)]
+        elif op.name == RETURN:
+            hinted = [(args[0], RESULT)]
+        else:
+            continue
+        for v, register in hinted:
+            if is_virtual(v) and v.hint is None:
+                v.hint = register
+
+
+def linear_scan(
+    intervals: Dict[VReg, List[int]], pool: List[int] = ALLOCATABLE
+) -> Tuple[Dict[VReg, int], List[VReg]]:
+    """
+    Poletto and Sarkar's linear scan. Intervals are visited by start, and
+    each takes its hinted register if that's free, or the first free one in
+    pool. When none is free, whichever of it and the intervals holding a
+    register ends last is spilled. Returns the registers and the spilled
+    """
+    rank = {register: i for i, register in enumerate(pool)}
+    free = set(pool)
+    registers: Dict[VReg, int] = {}
+    spilled: List[VReg] = []
+    active: List[Tuple[int, int, VReg]] = []  # (end, number, register)
+    for v in sorted(intervals, key=lambda v: (intervals[v][0], v.number)):
+        start, end = intervals[v]
+        while active and active[0][0] < start:
+            free.add(registers[active.pop(0)[2]])
+        if free:
+            register = v.hint if v.hint in free else min(free, key=rank.__getitem__)
+            free.remove(register)
+        elif active[-1][0] > end:
+            # the longest lived gives its register up
+            _, _, longest = active.pop()
+            register = registers.pop(longest)
+            spilled.append(longest)
+        else:
+            spilled.append(v)
+            continue
+        registers[v] = register
+        insort(active, (end, v.number, v), key=lambda entry: entry[:2])
+    return registers, spilled
+
+
+def allocate(function: Function, naive: bool = False) -> Allocation:
+    """
+    Gives every virtual register of function a register or a spill slot.
+    Calls save only the registers that are live after them. With naive,
+    every value is spilled and every call saves all of them instead
+    """
+    liveness = Liveness(function)
+    if naive:
+        virtual = [v for v in function.registers if v.fixed is None]
+        slots = {v: i for i, v in enumerate(virtual)}
+        saved = {
+            i: {v for v in virtual if v not in defs(op)}
+            for i, op in enumerate(function.ops)
+            if op.name == CALL
+        }
+        return Allocation({}, slots, saved)
+    set_hints(function)
+    registers, spilled = linear_scan(liveness.intervals())
+    return Allocation(
+        registers, {v: i for i, v in enumerate(spilled)}, liveness.live_across_calls()
+    )
+
+
+# ==============================
+# Lowering
+# ==============================
+def register(number: int) -> Token:
+    return Token("register", REGISTERS[number])
+
+
+def operand_token(operand: Union[int, str]) -> Token:
+    if type(operand) is int:
+        return Token("literal", str(operand))
+    return Token("label", operand)
+
+
+class Lowering:
+    """
+    Turns the ops of an allocated function into instructions. Spilled values
+    are loaded into STAGING and SCRATCH around each op that uses them, with
+    the spill area's address in SCRATCH
+    """
+
+    def __init__(self, function: Function, allocation: Allocation):
+        self.function = function
+        self.allocation = allocation
+        self.spill_area = f"__{function.name}_spill"
+        self.statements: List[Union[Label, Instruction]] = []
+        self.line = self.column = 0
+        self.base_loaded = False  # whether SCRATCH holds the spill area's address
+
+    def emit(self, name: str, *args: Union[Token, int, str]):
+        tokens = [arg if type(arg) is Token else operand_token(arg) for arg in args]
+        self.statements.append(Instruction(name, tokens, self.line, self.column))
+        if name == "jal" or (
+            name in DEFINES_FIRST and tokens[0].contents == REGISTERS[SCRATCH]
+        ):
+            self.base_loaded = False
+
+    def label(self, name: str):
+        self.statements.append(Label(name))
+        self.base_loaded = False
+
+    def base(self) -> Token:
+        if not self.base_loaded:
+            self.emit("la", register(SCRATCH), self.spill_area)
+            self.base_loaded = True
+        return register(SCRATCH)
+
+    def load(self, destination: int, slot: Slot):
+        self.emit("lw", register(destination), self.base(), slot.index)
+
+    def store(self, source: int, slot: Slot):
+        self.emit("sw", register(source), self.base(), slot.index)
+
+    def move(self, destination: int, source: int):
+        if destination != source:
+            self.emit("addi", register(destination), register(source), 0)
+
+    def parallel_move(self, moves: List[Tuple[Location, Location]]):
+        """
+        Moves every (destination, source) pair as if all at once
+        """
+        for destination, source in moves:
+            # stores only read registers, so they go before anything's
+            # overwritten
+            if type(destination) is Slot:
+                if type(source) is Slot:
+                    self.load(STAGING, source)
+                    source = STAGING
+                self.store(source, destination)
+        pending = [
+            [destination, source]
+            for destination, source in moves
+            if type(destination) is not Slot
+            and type(source) is not Slot
+            and destination != source
+        ]
+        while pending:
+            sources = {source for _, source in pending}
+            for i, (destination, source) in enumerate(pending):
+                if destination not in sources:
+                    self.move(destination, source)
+                    del pending[i]
+                    break
+            else:
+                # every destination is still to be read: a cycle, broken by
+                # setting one source aside
+                source = pending[0][1]
+                self.move(SCRATCH, source)
+                for move in pending:
+                    if move[1] == source:
+                        move[1] = SCRATCH
+        for destination, source in moves:
+            if type(destination) is not Slot and type(source) is Slot:
+                self.load(destination, source)
+
+    def lower(self) -> List[Union[Label, Instruction]]:
+        location = self.allocation.location
+        for i, op in enumerate(self.function.ops):
+            self.line, self.column = op.line, op.column
+            name, args = op.name, op.args
+            if name == LABEL:
+                self.label(args[0])
+            elif name == MOVE:
+                self.parallel_move([(location(args[0]), location(args[1]))])
+            elif name == ENTRY:
+                incoming = [RETURN_ADDRESS, *ARGUMENT_REGISTERS]
+                self.parallel_move(
+                    [
+                        (location(v), register)
+                        for v, register in zip(args, incoming)
+                        if v is not None
+                    ]
+                )
+            elif name == CALL:
+                self.call(i, op)
+            elif name == RETURN:
+                self.ret(op)
+            else:
+                self.instruction(op)
+        if self.function.exit is not None:
+            self.label(self.function.exit)
+        return self.statements
+
+    def instruction(self, op: Op):
+        location = self.allocation.location
+        defined = op.args[0] if op.name in DEFINES_FIRST else None
+        loads = [STAGING, SCRATCH]
+        tokens = []
+        for i, arg in enumerate(op.args):
+            if type(arg) is not VReg:
+                tokens.append(operand_token(arg))
+                continue
+            where = location(arg)
+            if i == 0 and defined is not None:
+                tokens.append(register(STAGING if type(where) is Slot else where))
+            elif type(where) is Slot:
+                # the second load overwrites the spill area's address
+                loaded = loads.pop(0)
+                self.emit("lw", register(loaded), self.base(), where.index)
+                tokens.append(register(loaded))
+            else:
+                tokens.append(register(where))
+        self.emit(op.name, *tokens)
+        if defined is not None and type(location(defined)) is Slot:
+            self.store(STAGING, location(defined))
+
+    def call(self, i: int, op: Op):
+        location = self.allocation.location
+        saved = sorted(
+            (location(v) for v in self.allocation.saved.get(i, ())),
+            key=lambda where: (type(where) is Slot, where),
+        )
+        for where in saved:
+            if type(where) is Slot:
+                self.load(STAGING, where)
+            else:
+                self.move(STAGING, where)
+            self.emit("push")
+        function, result, *arguments = op.args
+        self.parallel_move(
+            [
+                (register, location(v))
+                for register, v in zip(ARGUMENT_REGISTERS, arguments)
+            ]
+        )
+        self.emit("jal", function)
+        if result is not None:
+            self.parallel_move([(location(result), RESULT)])
+        for where in reversed(saved):
+            self.emit("pop")
+            if type(where) is Slot:
+                self.store(STAGING, where)
+            else:
+                self.move(where, STAGING)
+
+    def ret(self, op: Op):
+        location = self.allocation.location
+        value, return_address = op.args
+        moves = [] if value is None else [(RESULT, location(value))]
+        if return_address is None:
+            self.parallel_move(moves)
+            self.emit("jmp", self.function.exit)
+            return
+        where = location(return_address)
+        if type(where) is Slot or where == RESULT:
+            # out of the way of the result
+            moves.append((SCRATCH, where))
+            where = SCRATCH
+        self.parallel_move(moves)
+        self.emit("jr", register(where))
+
+
+def tidy(
+    statements: List[Union[Label, Instruction]],
+) -> List[Union[Label, Instruction]]:
+    """
+    Drops jmps to the labels right after them
+    """
+    kept = []
+    for i, statement in enumerate(statements):
+        if type(statement) is Instruction and statement.name == "jmp":
+            target = statement.args[0].contents
+            following = i + 1
+            while following < len(statements) and type(statements[following]) is Label:
+                if statements[following].name == target:
+                    break
+                following += 1
+            else:
+                kept.append(statement)
+            continue
+        kept.append(statement)
+    return kept
+
+
+def lower(
+    function: Function, allocation: Allocation
+) -> Tuple[List[Union[Label, Instruction]], List[Data]]:
+    """
+    Returns the text of an allocated function and the data it spills to
+    """
+    lowering = Lowering(function, allocation)
+    text = tidy(lowering.lower())
+    if text and type(text[-1]) is Label:
+        # labels after the last instruction point nowhere, so the returns
+        # from main land on a nop
+        text.append(
+            Instruction("sll", [register(STAGING), register(STAGING), operand_token(0)])
+        )
+    data = []
+    if allocation.slots:
+        data.append(
+            Data(
+                lowering.spill_area,
+                [Token("directive", ".space"), operand_token(len(allocation.slots))],
+            )
+        )
+    return text, data
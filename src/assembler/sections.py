@@ -0,0 +1,155 @@
+from bisect import bisect_right
+from typing import Dict, Set, Tuple
+from .assembler import DATA_START_ADDR
+from .grammar import LABEL, LITERAL, MNEMONICS, Instruction, Label, Program
+from .peephole import UNCONDITIONAL
+from .translator import IMM_WIDTH, WORD_MASK, size_of
+
+MAIN = "main"
+# instructions whose label operand is another piece of text
+TEXT_REFERENCES = {"jal", "jmp", "beq", "bne"}
+# instructions that can build an address from a literal, and how far it's
+# shifted
+ADDRESS_LITERALS = {"lui": IMM_WIDTH, "li": 0, "la": 0}
+
+
+class Reachability:
+    """
+    Reference graph of a program. The text is split into blocks at every
+    label, and a block is reachable from main when a reachable block jumps,
+    branches or calls to one of its labels, or falls through into it. A
+    data item is used when a reachable block loads its address with la.
+    Reachable code that builds an address in the data segment out of
+    literals, like lui r29, 0x100, could reach any data, so then all of it
+    is used
+    """
+
+    def __init__(self, program: Program):
+        self.program = program
+        symbols = program.symbols.ids
+        # text label symbol : instruction it points to
+        self.labels: Dict[int, int] = {}
+        for symbol, at in zip(program.label_ids, program.label_at):
+            self.labels.setdefault(symbol, at)
+        # data symbol : data item
+        self.datas: Dict[int, int] = {}
+        for i, symbol in enumerate(program.data_ids):
+            self.datas.setdefault(symbol, i)
+        # first instruction of every block
+        self.starts = sorted({0, *program.label_at})
+        self.blocks: Set[int] = set()
+        self.used_data: Set[int] = set()
+        self.absolute_data = False
+        main = symbols.get(MAIN)
+        # a main after the last instruction is left for resolve to reject
+        if self.labels.get(main, len(program)) < len(program):
+            self.walk(self.block_of(self.labels[main]))
+
+    def block_of(self, at: int) -> int:
+        return bisect_right(self.starts, at) - 1
+
+    def block_range(self, block: int) -> Tuple[int, int]:
+        end = (
+            self.starts[block + 1]
+            if block + 1 < len(self.starts)
+            else len(self.program)
+        )
+        return self.starts[block], end
+
+    def walk(self, first: int):
+        program = self.program
+        ops, arg_start, kinds, args = (
+            program.ops,
+            program.arg_start,
+            program.arg_kinds,
+            program.args,
+        )
+        literal_values = program.literal_values
+        pending = [first]
+        while pending:
+            block = pending.pop()
+            if block in self.blocks or block >= len(self.starts):
+                continue
+            self.blocks.add(block)
+            start, end = self.block_range(block)
+            for i in range(start, end):
+                name = MNEMONICS[ops[i]]
+                for j in range(arg_start[i], arg_start[i + 1]):
+                    if kinds[j] == LITERAL and name in ADDRESS_LITERALS:
+                        # the highest address the literal can be part of
+                        shift = ADDRESS_LITERALS[name]
+                        value = literal_values[args[j]] << shift | ((1 << shift) - 1)
+                        if value & WORD_MASK >= DATA_START_ADDR:
+                            self.absolute_data = True
+                    if kinds[j] != LABEL:
+                        continue
+                    if name in TEXT_REFERENCES and args[j] in self.labels:
+                        pending.append(self.block_of(self.labels[args[j]]))
+                    elif args[j] in self.datas:
+                        self.used_data.add(self.datas[args[j]])
+            if start == end or MNEMONICS[ops[end - 1]] not in UNCONDITIONAL:
+                pending.append(block + 1)
+
+    def kept_instructions(self) -> bytearray:
+        """
+        Returns a flag per instruction, set when it's reachable
+        """
+        kept = bytearray(len(self.program))
+        for block in self.blocks:
+            start, end = self.block_range(block)
+            kept[start:end] = b"\1" * (end - start)
+        return kept
+
+
+def gc_sections(program: Program) -> Tuple[Program, Dict[str, int]]:
+    """
+    Drops the text that can't be reached from main and the data no
+    reachable code loads the address of, before anything is laid out.
+    Returns the smaller program and the words it saved in each segment.
+    Without a main the program is returned as it is
+    """
+    if MAIN not in program.symbols.ids:
+        return program, {"text": 0, "data": 0}
+    reachable = Reachability(program)
+    check_labels(program, reachable)
+    kept = reachable.kept_instructions()
+
+    result = Program()
+    saved = {"text": 0, "data": 0}
+    instruction = 0
+    data = 0
+    for statement in program.statements():
+        if type(statement) is Label:
+            # a label is kept with the block it starts
+            if instruction >= len(kept) or kept[instruction]:
+                result.label(statement.name)
+        elif type(statement) is Instruction:
+            if kept[instruction]:
+                result.instruction(
+                    statement.name, statement.args, statement.line, statement.column
+                )
+            else:
+                saved["text"] += size_of(statement.name, *program.operands(instruction))
+            instruction += 1
+        else:
+            if reachable.absolute_data or data in reachable.used_data:
+                result.data(
+                    statement.name, statement.values, statement.line, statement.column
+                )
+            else:
+                saved["data"] += program.data_length(data)
+            data += 1
+    return result, saved
+
+
+def check_labels(program: Program, reachable: Reachability):
+    # code that's dropped still has to make sense, so that collecting it
+    # never hides an error
+    names = program.symbols.names
+    for kind, symbol in zip(program.arg_kinds, program.args):
+        if (
+            kind == LABEL
+            and symbol not in reachable.labels
+            and symbol not in reachable.datas
+        ):
+            raise Exception(f"Unknown label {names[symbol]}")
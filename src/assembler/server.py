@@ -0,0 +1,326 @@
+import asyncio
+import json
+import os
+import signal
+import socket
+import sys
+import threading
+from argparse import SUPPRESS, ArgumentParser
+from collections import Counter
+from concurrent.futures import Executor, ProcessPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, List, Optional
+from .assembler import assemble_image, assemble_lines
+from .client import DEFAULT_PORT, default_socket_path
+from .grammar import process
+from .output import ihex_lines, memh_lines
+
+# Requests and responses are JSON objects. Over the unix socket every
+# message is one line, and a connection can carry any number of them. Over
+# HTTP a request is the body of a POST to /assemble.
+#   request   {"source": str, "format": "memh" | "ihex", "optimize": bool,
+#              "comments": bool}
+#   response  {"ok": true, "output": str, "removed": {rule: count}}
+#             {"ok": false, "error": str}
+# Sources come from untrusted clients, so they can't include files, and
+# each one gets a time limit so that a huge .rept can't hold up a worker.
+FORMATS = {"memh", "ihex"}
+DEFAULT_QUEUE_SIZE = 256
+MAX_REQUEST_BYTES = 64 * 1024 * 1024
+DEFAULT_TIME_LIMIT = 10.0  # seconds
+WARM_UP = ".data\nA: 1;\n.text\nmain: la r1, A; beq r1, r1, main;"
+
+
+@contextmanager
+def time_limit(seconds: Optional[float]):
+    """
+    Raises inside the block once it has run for seconds. Only works in a
+    process's main thread, which is where the pool's workers run requests
+    """
+    if (
+        not seconds
+        or not hasattr(signal, "setitimer")
+        or threading.current_thread() is not threading.main_thread()
+    ):
+        yield
+        return
+
+    def expire(signum, frame):
+        raise Exception(f"Took longer than {seconds:g} s")
+
+    previous = signal.signal(signal.SIGALRM, expire)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+def assemble_request(request: dict, limit: Optional[float] = None) -> dict:
+    """
+    Handles one request, returning the response. Runs in the workers
+    """
+    try:
+        source = request["source"]
+        format = request.get("format", "memh")
+        optimize = bool(request.get("optimize", False))
+        if format not in FORMATS:
+            raise Exception(f"Unsupported format {format}")
+        stats = Counter()
+        with time_limit(limit):
+            program = process(source, includes=False)
+            if format == "memh" and request.get("comments", True):
+                lines = assemble_lines(program, optimize, stats)
+            else:
+                image = assemble_image(program, optimize, stats)
+                lines = memh_lines(image) if format == "memh" else ihex_lines(image)
+            output = "".join(f"{line}\n" for line in lines)
+    except Exception as e:
+        return {"ok": False, "error": f"{type(e).__name__}: {e}"}
+    return {"ok": True, "output": output, "removed": dict(stats)}
+
+
+def warm_up():
+    # the first assembly in a process pays for building every table
+    assemble_request({"source": WARM_UP})
+
+
+class AssemblyServer:
+    """
+    Assembles requests from any number of connections on a pool of warm
+    worker processes. Requests wait in a bounded queue for a free worker,
+    and are turned away straight away once it is full so that callers never
+    wait behind an unbounded backlog. A request that runs longer than
+    time_limit seconds fails
+    """
+
+    def __init__(
+        self,
+        workers: Optional[int] = None,
+        queue_size: int = DEFAULT_QUEUE_SIZE,
+        executor: Optional[Executor] = None,
+        time_limit: Optional[float] = DEFAULT_TIME_LIMIT,
+    ):
+        self.workers = workers or os.cpu_count() or 1
+        self.queue_size = queue_size
+        self.executor = executor
+        self.time_limit = time_limit
+        self.queue: Optional[asyncio.Queue] = None
+        self.stopped: Optional[asyncio.Event] = None
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.handled = 0
+
+    async def submit(self, request: dict) -> dict:
+        future = self.loop.create_future()
+        try:
+            self.queue.put_nowait((request, future))
+        except asyncio.QueueFull:
+            return {"ok": False, "error": "Server is busy, try again later"}
+        return await future
+
+    async def dispatch(self):
+        while True:
+            request, future = await self.queue.get()
+            try:
+                response = await self.loop.run_in_executor(
+                    self.executor, assemble_request, request, self.time_limit
+                )
+            except Exception as e:
+                response = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+            self.handled += 1
+            if not future.cancelled():
+                future.set_result(response)
+
+    async def handle_request(self, body: bytes) -> dict:
+        try:
+            request = json.loads(body)
+            if not isinstance(request, dict) or not isinstance(
+                request.get("source"), str
+            ):
+                raise ValueError("expected an object with a source")
+        except ValueError as e:
+            return {"ok": False, "error": f"Bad request: {e}"}
+        return await self.submit(request)
+
+    async def handle_unix(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                response = await self.handle_request(line)
+                writer.write(json.dumps(response).encode() + b"\n")
+                await writer.drain()
+        except (ConnectionError, asyncio.LimitOverrunError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def handle_http(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = (await reader.readline()).decode("latin-1").strip()
+                    if not line:
+                        break
+                    name, _, value = line.partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get("content-length", 0))
+                if length > MAX_REQUEST_BYTES:
+                    await self.respond(writer, 413, {"ok": False, "error": "Too large"})
+                    break
+                body = await reader.readexactly(length)
+                if method == "POST" and path == "/assemble":
+                    status, response = 200, await self.handle_request(body)
+                elif method == "GET" and path == "/health":
+                    status, response = 200, {"ok": True, "handled": self.handled}
+                else:
+                    status, response = 404, {"ok": False, "error": "Not found"}
+                await self.respond(writer, status, response)
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def respond(self, writer: asyncio.StreamWriter, status: int, response: dict):
+        body = json.dumps(response).encode()
+        reason = {200: "OK", 404: "Not Found", 413: "Payload Too Large"}[status]
+        writer.write(
+            f"HTTP/1.1 {status} {reason}\r\n"
+            f"Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+
+    async def serve(
+        self,
+        socket_path: Optional[str] = None,
+        host: str = "127.0.0.1",
+        port: Optional[int] = None,
+        ready: Optional[Callable[[asyncio.AbstractServer], None]] = None,
+    ):
+        """
+        Serves HTTP when port is given and the unix socket otherwise, until
+        stop() is called
+        """
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(self.queue_size)
+        self.stopped = asyncio.Event()
+        owns_executor = self.executor is None
+        if owns_executor:
+            self.executor = ProcessPoolExecutor(self.workers, initializer=warm_up)
+        dispatchers = [
+            asyncio.create_task(self.dispatch()) for _ in range(self.workers)
+        ]
+        if port is not None:
+            server = await asyncio.start_server(
+                self.handle_http, host, port, limit=MAX_REQUEST_BYTES
+            )
+        else:
+            remove_stale_socket(socket_path)
+            server = await asyncio.start_unix_server(
+                self.handle_unix, socket_path, limit=MAX_REQUEST_BYTES
+            )
+        try:
+            if ready is not None:
+                ready(server)
+            await self.stopped.wait()
+        finally:
+            server.close()
+            await server.wait_closed()
+            for dispatcher in dispatchers:
+                dispatcher.cancel()
+            if owns_executor:
+                self.executor.shutdown(cancel_futures=True)
+            if port is None and os.path.exists(socket_path):
+                os.remove(socket_path)
+
+    def stop(self):
+        """
+        Stops serve(). Can be called from any thread
+        """
+        self.loop.call_soon_threadsafe(self.stopped.set)
+
+
+def remove_stale_socket(path: str):
+    """
+    Removes a socket left behind by a server that didn't shut down cleanly,
+    but refuses to take over one that is still being served
+    """
+    if not os.path.exists(path):
+        return
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except (ConnectionRefusedError, FileNotFoundError):
+        os.remove(path)
+    else:
+        raise Exception(f"A server is already listening on {path}")
+    finally:
+        probe.close()
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = ArgumentParser("dvassembler serve")
+    listen = parser.add_mutually_exclusive_group()
+    listen.add_argument(
+        "--socket",
+        type=str,
+        metavar="PATH",
+        help=f"unix socket to listen on (default: {default_socket_path()})",
+    )
+    listen.add_argument(
+        "--port",
+        type=int,
+        nargs="?",
+        const=DEFAULT_PORT,
+        help=f"serve HTTP on localhost instead (default port: {DEFAULT_PORT})",
+    )
+    parser.add_argument("--host", type=str, default="127.0.0.1", help=SUPPRESS)
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="processes to assemble with (default: one per CPU)",
+    )
+    parser.add_argument(
+        "--queue-size",
+        type=int,
+        default=DEFAULT_QUEUE_SIZE,
+        help="requests that can wait for a worker before new ones are turned away",
+    )
+    parser.add_argument(
+        "--time-limit",
+        type=float,
+        default=DEFAULT_TIME_LIMIT,
+        metavar="SECONDS",
+        help="fail requests that take longer than this (0 for no limit)",
+    )
+    args = parser.parse_args(argv)
+
+    socket_path = args.socket or default_socket_path()
+    if args.port is not None:
+        address = f"http://{args.host}:{args.port}"
+    else:
+        address = socket_path
+
+    def ready(_):
+        print(f"serving on {address}", file=sys.stderr)
+
+    server = AssemblyServer(args.workers, args.queue_size, time_limit=args.time_limit)
+    try:
+        asyncio.run(server.serve(socket_path, args.host, args.port, ready))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,390 @@
+import sys
+from argparse import ArgumentParser
+from typing import Callable, Dict, Iterable, List, Tuple
+from .assembler import DATA_START_ADDR, PROGRAM_START_ADDR, Image, assemble_image
+from .grammar import process
+from .translator import (
+    FUNCTS,
+    IMM_MASK,
+    JMP_ADDR_MASK,
+    OPCODE_SHIFT,
+    OPCODES,
+    RD_SHIFT,
+    REG_MASK,
+    RS_SHIFT,
+    RT_SHIFT,
+    SHAMT_MASK,
+    SHAMT_SHIFT,
+    WORD_MASK,
+)
+
+ADDR_MASK = (1 << 26) - 1  # memory is 64M words
+INIT_STACK_POINTER = 0x03FFFFFF
+RETURN_REGISTER = 31
+DEFAULT_BUDGET = 10_000_000
+
+FUNCT_MASK = (1 << 6) - 1
+SIGN_BIT = 1 << 31
+
+
+def sign_extend(imm: int) -> int:
+    return imm - (1 << 16) if imm & (1 << 15) else imm
+
+
+def signed(word: int) -> int:
+    return word - (1 << 32) if word & SIGN_BIT else word
+
+
+class Halt(Exception):
+    """
+    Raised by a handler when execution leaves the program
+    """
+
+    def __init__(self, pc: int, executed: bool):
+        self.pc = pc
+        self.executed = executed  # whether the raising instruction ran
+
+
+def load_memh(lines: Iterable[str]) -> Dict[int, int]:
+    """
+    Reads a memdump into an address : word map
+    """
+    memory = {}
+    addr = 0
+    for line in lines:
+        line = line.split("//", 1)[0].strip()
+        if not line:
+            continue
+        if line.startswith("@"):
+            addr = int(line[1:], 16)
+            continue
+        memory[addr] = int(line, 16)
+        addr += 1
+    return memory
+
+
+def image_memory(image: Image) -> Dict[int, int]:
+    memory = dict(enumerate(image.text, PROGRAM_START_ADDR))
+    memory.update(enumerate(image.data, DATA_START_ADDR))
+    return memory
+
+
+Handler = Callable[[int, int, int, int], int]
+
+
+class Machine:
+    """
+    DaVinci instruction set simulator. The words from PROGRAM_START_ADDR up
+    to the first gap in memory are decoded once into (handler, a, b, c)
+    tuples, where every handler takes its operands and the pc and returns
+    the next pc. Execution stops when the pc leaves those words
+    """
+
+    def __init__(self, memory: Dict[int, int]):
+        self.memory = dict(memory)
+        self.regs = [0] * 32
+        self.pc = PROGRAM_START_ADDR
+        self.sp = INIT_STACK_POINTER
+        self.executed = 0
+        self.halted = False
+        self.base = PROGRAM_START_ADDR
+        end = self.base
+        while end in self.memory:
+            end += 1
+        self.end = end
+        self.handlers = self.make_handlers()
+        # code is indexed by the pc itself, padded with entries that stop the
+        # machine below the program and after its end
+        halt = (self.handlers["halt"], 0, 0, 0)
+        self.code = [halt] * self.base
+        self.code.extend(
+            self.decode(addr, self.memory[addr]) for addr in range(self.base, end)
+        )
+        self.code.append(halt)
+
+    @classmethod
+    def from_image(cls, image: Image) -> "Machine":
+        return cls(image_memory(image))
+
+    def make_handlers(self) -> Dict[str, Handler]:
+        regs = self.regs
+        mem = self.memory
+        machine = self
+        base, end = self.base, self.end
+        M = WORD_MASK
+
+        def add(rd, rs, rt, pc):
+            regs[rd] = (regs[rs] + regs[rt]) & M
+            return pc + 1
+
+        def sub(rd, rs, rt, pc):
+            regs[rd] = (regs[rs] - regs[rt]) & M
+            return pc + 1
+
+        def mul(rd, rs, rt, pc):
+            regs[rd] = (regs[rs] * regs[rt]) & M
+            return pc + 1
+
+        def and_(rd, rs, rt, pc):
+            regs[rd] = regs[rs] & regs[rt]
+            return pc + 1
+
+        def or_(rd, rs, rt, pc):
+            regs[rd] = regs[rs] | regs[rt]
+            return pc + 1
+
+        def nor(rd, rs, rt, pc):
+            regs[rd] = ~(regs[rs] | regs[rt]) & M
+            return pc + 1
+
+        def slt(rd, rs, rt, pc):
+            regs[rd] = int(signed(regs[rs]) < signed(regs[rt]))
+            return pc + 1
+
+        def sll(rd, rs, shamt, pc):
+            regs[rd] = (regs[rs] << shamt) & M
+            return pc + 1
+
+        def srl(rd, rs, shamt, pc):
+            regs[rd] = regs[rs] >> shamt
+            return pc + 1
+
+        def jr(rs, _, __, pc):
+            target = regs[rs]
+            if not base <= target < end:
+                raise Halt(target, True)
+            return target
+
+        # immediates are already sign or zero extended by decode
+        def addi(rt, rs, imm, pc):
+            regs[rt] = (regs[rs] + imm) & M
+            return pc + 1
+
+        def muli(rt, rs, imm, pc):
+            regs[rt] = (regs[rs] * imm) & M
+            return pc + 1
+
+        def andi(rt, rs, imm, pc):
+            regs[rt] = regs[rs] & imm
+            return pc + 1
+
+        def ori(rt, rs, imm, pc):
+            regs[rt] = regs[rs] | imm
+            return pc + 1
+
+        def lui(rt, _, imm, pc):
+            regs[rt] = imm << 16
+            return pc + 1
+
+        def slti(rt, rs, imm, pc):
+            regs[rt] = int(signed(regs[rs]) < imm)
+            return pc + 1
+
+        # branch and jump targets are absolute and checked by decode
+        def beq(rt, rs, target, pc):
+            return target if regs[rs] == regs[rt] else pc + 1
+
+        def bne(rt, rs, target, pc):
+            return target if regs[rs] != regs[rt] else pc + 1
+
+        def lw(rt, rs, imm, pc):
+            regs[rt] = mem.get((regs[rs] + imm) & ADDR_MASK, 0)
+            return pc + 1
+
+        def sw(rt, rs, imm, pc):
+            addr = (regs[rs] + imm) & ADDR_MASK
+            mem[addr] = regs[rt]
+            if base <= addr < end:
+                machine.code[addr] = machine.decode(addr, regs[rt])
+            return pc + 1
+
+        def jmp(target, _, __, pc):
+            return target
+
+        def jal(target, _, __, pc):
+            regs[RETURN_REGISTER] = pc + 1
+            return target
+
+        def push(_, __, ___, pc):
+            mem[machine.sp] = regs[0]
+            machine.sp = (machine.sp - 1) & ADDR_MASK
+            return pc + 1
+
+        def pop(_, __, ___, pc):
+            machine.sp = (machine.sp + 1) & ADDR_MASK
+            regs[0] = mem.get(machine.sp, 0)
+            return pc + 1
+
+        # jumps and taken branches that leave the program
+        def beq_leave(rt, rs, target, pc):
+            if regs[rs] == regs[rt]:
+                raise Halt(target, True)
+            return pc + 1
+
+        def bne_leave(rt, rs, target, pc):
+            if regs[rs] != regs[rt]:
+                raise Halt(target, True)
+            return pc + 1
+
+        def jmp_leave(target, _, __, pc):
+            raise Halt(target, True)
+
+        def jal_leave(target, _, __, pc):
+            regs[RETURN_REGISTER] = pc + 1
+            raise Halt(target, True)
+
+        def halt(_, __, ___, pc):
+            raise Halt(pc, False)
+
+        return {
+            "add": add,
+            "sub": sub,
+            "mul": mul,
+            "and": and_,
+            "or": or_,
+            "nor": nor,
+            "slt": slt,
+            "sll": sll,
+            "srl": srl,
+            "jr": jr,
+            "addi": addi,
+            "muli": muli,
+            "andi": andi,
+            "ori": ori,
+            "lui": lui,
+            "slti": slti,
+            "beq": beq,
+            "bne": bne,
+            "lw": lw,
+            "sw": sw,
+            "jmp": jmp,
+            "jal": jal,
+            "push": push,
+            "pop": pop,
+            "beq_leave": beq_leave,
+            "bne_leave": bne_leave,
+            "jmp_leave": jmp_leave,
+            "jal_leave": jal_leave,
+            "halt": halt,
+        }
+
+    def decode(self, addr: int, word: int) -> Tuple[Handler, int, int, int]:
+        handlers = self.handlers
+        opcode = word >> OPCODE_SHIFT
+        rs = (word >> RS_SHIFT) & REG_MASK
+        rt = (word >> RT_SHIFT) & REG_MASK
+        imm = word & IMM_MASK
+        if opcode == 0:
+            name = FUNCT_NAMES.get(word & FUNCT_MASK)
+            rd = (word >> RD_SHIFT) & REG_MASK
+            if name in {"sll", "srl"}:
+                return handlers[name], rd, rs, (word >> SHAMT_SHIFT) & SHAMT_MASK
+            if name == "jr":
+                return handlers[name], rs, 0, 0
+            if name is not None:
+                return handlers[name], rd, rs, rt
+        else:
+            name = OPCODE_NAMES.get(opcode)
+            if name in {"beq", "bne"}:
+                target = addr + 1 + sign_extend(imm)
+                if not self.base <= target < self.end:
+                    name += "_leave"
+                return handlers[name], rt, rs, target
+            if name in {"jmp", "jal"}:
+                target = word & JMP_ADDR_MASK
+                if not self.base <= target < self.end:
+                    name += "_leave"
+                return handlers[name], target, 0, 0
+            if name in {"andi", "ori", "lui"}:
+                return handlers[name], rt, rs, imm
+            if name in {"push", "pop"}:
+                return handlers[name], 0, 0, 0
+            if name is not None:
+                return handlers[name], rt, rs, sign_extend(imm)
+        return self.invalid(addr, word)
+
+    def invalid(self, addr: int, word: int):
+        def invalid(_, __, ___, pc):
+            raise Exception(f"Invalid instruction {word:08X} at {addr:08x}")
+
+        return invalid, 0, 0, 0
+
+    def run(self, budget: int = DEFAULT_BUDGET) -> int:
+        """
+        Runs until the program ends or budget instructions have executed,
+        returning the number of instructions executed
+        """
+        code = self.code
+        pc = self.pc
+        count = 0
+        try:
+            for count in range(budget):
+                handler, a, b, c = code[pc]
+                pc = handler(a, b, c, pc)
+            else:
+                count = budget
+        except Halt as halt:
+            pc = halt.pc
+            count += halt.executed
+            self.halted = True
+        self.pc = pc
+        self.executed += count
+        return count
+
+    def dump_registers(self) -> List[str]:
+        lines = [f"pc  = {self.pc:08x}", f"sp  = {self.sp:08x}"]
+        for i, value in enumerate(self.regs):
+            lines.append(f"r{i:<2} = {value:08x} ({signed(value)})")
+        return lines
+
+    def dump_memory(self, include_program: bool = False) -> List[str]:
+        """
+        Returns every word that's set as memdump lines
+        """
+        lines = []
+        prev = None
+        for addr in sorted(self.memory):
+            if not include_program and self.base <= addr < self.end:
+                continue
+            if prev is None or addr != prev + 1:
+                lines.append(f"@{addr:08x}")
+            lines.append(f"{self.memory[addr]:08x}")
+            prev = addr
+        return lines
+
+
+OPCODE_NAMES = {opcode: name for name, opcode in OPCODES.items()}
+FUNCT_NAMES = {funct: name for name, funct in FUNCTS.items()}
+
+
+def main():
+    parser = ArgumentParser("CS147 Simulator")
+    parser.add_argument("INPUT_FILE", type=str, help=".asm source or memdump")
+    parser.add_argument(
+        "--budget",
+        type=int,
+        default=DEFAULT_BUDGET,
+        help="stop after this many instructions",
+    )
+    parser.add_argument(
+        "--dump-memory", action="store_true", help="also print the final memory"
+    )
+    args = parser.parse_args()
+
+    with open(args.INPUT_FILE) as f:
+        if args.INPUT_FILE.endswith(".asm"):
+            machine = Machine.from_image(assemble_image(process(f.read())))
+        else:
+            machine = Machine(load_memh(f))
+    machine.run(args.budget)
+    status = "halted" if machine.halted else "budget exhausted"
+    print(f"// {status} after {machine.executed} instructions")
+    for line in machine.dump_registers():
+        print(f"// {line}")
+    if args.dump_memory:
+        for line in machine.dump_memory():
+            print(line)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
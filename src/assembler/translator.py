@@ -1,4 +1,4 @@
-from typing import Optional
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple, Union
 
 # ==============================
 # Constants
@@ -9,211 +9,384 @@ SHAMT_WIDTH = 5
 FUNCT_WIDTH = 6
 JMP_ADDR_WIDTH = 26
 IMM_WIDTH = 16
+WORD_WIDTH = 32
 OPCODES = {
-    "addi": bin(int(0x08))[2:].rjust(OPCODE_WIDTH, "0"),
-    "muli": bin(int(0x1D))[2:].rjust(OPCODE_WIDTH, "0"),
-    "andi": bin(int(0x0C))[2:].rjust(OPCODE_WIDTH, "0"),
-    "ori": bin(int(0x0D))[2:].rjust(OPCODE_WIDTH, "0"),
-    "lui": bin(int(0x0F))[2:].rjust(OPCODE_WIDTH, "0"),
-    "slti": bin(int(0x0A))[2:].rjust(OPCODE_WIDTH, "0"),
-    "beq": bin(int(0x04))[2:].rjust(OPCODE_WIDTH, "0"),
-    "bne": bin(int(0x05))[2:].rjust(OPCODE_WIDTH, "0"),
-    "lw": bin(int(0x23))[2:].rjust(OPCODE_WIDTH, "0"),
-    "sw": bin(int(0x2B))[2:].rjust(OPCODE_WIDTH, "0"),
-    "jmp": bin(int(0x02))[2:].rjust(OPCODE_WIDTH, "0"),
-    "jal": bin(int(0x03))[2:].rjust(OPCODE_WIDTH, "0"),
-    "push": bin(int(0x1B))[2:].rjust(OPCODE_WIDTH, "0"),
-    "pop": bin(int(0x1C))[2:].rjust(OPCODE_WIDTH, "0"),
+    "addi": 0x08,
+    "muli": 0x1D,
+    "andi": 0x0C,
+    "ori": 0x0D,
+    "lui": 0x0F,
+    "slti": 0x0A,
+    "beq": 0x04,
+    "bne": 0x05,
+    "lw": 0x23,
+    "sw": 0x2B,
+    "jmp": 0x02,
+    "jal": 0x03,
+    "push": 0x1B,
+    "pop": 0x1C,
 }
 FUNCTS = {
-    "add": bin(int(0x20))[2:].rjust(FUNCT_WIDTH, "0"),
-    "sub": bin(int(0x22))[2:].rjust(FUNCT_WIDTH, "0"),
-    "mul": bin(int(0x2C))[2:].rjust(FUNCT_WIDTH, "0"),
-    "and": bin(int(0x24))[2:].rjust(FUNCT_WIDTH, "0"),
-    "or": bin(int(0x25))[2:].rjust(FUNCT_WIDTH, "0"),
-    "nor": bin(int(0x27))[2:].rjust(FUNCT_WIDTH, "0"),
-    "slt": bin(int(0x2A))[2:].rjust(FUNCT_WIDTH, "0"),
-    "sll": bin(int(0x01))[2:].rjust(FUNCT_WIDTH, "0"),
-    "srl": bin(int(0x02))[2:].rjust(FUNCT_WIDTH, "0"),
-    "jr": bin(int(0x08))[2:].rjust(FUNCT_WIDTH, "0"),
+    "add": 0x20,
+    "sub": 0x22,
+    "mul": 0x2C,
+    "and": 0x24,
+    "or": 0x25,
+    "nor": 0x27,
+    "slt": 0x2A,
+    "sll": 0x01,
+    "srl": 0x02,
+    "jr": 0x08,
 }
 INSTRUCTIONS = set(OPCODES.keys()) | set(FUNCTS.keys())
 GENERIC_R_TYPES = [key for key in FUNCTS if key not in ["jr", "sll", "srl"]]
 GENERIC_I_TYPES = ["addi", "muli", "andi", "ori", "slti", "beq", "bne", "lw", "sw"]
 
+# field positions within a word
+OPCODE_SHIFT = 26
+RS_SHIFT = 21
+RT_SHIFT = 16
+RD_SHIFT = 11
+SHAMT_SHIFT = 6
+REG_MASK = (1 << REG_WIDTH) - 1
+SHAMT_MASK = (1 << SHAMT_WIDTH) - 1
+IMM_MASK = (1 << IMM_WIDTH) - 1
+JMP_ADDR_MASK = (1 << JMP_ADDR_WIDTH) - 1
+WORD_MASK = (1 << WORD_WIDTH) - 1
+# immediates and words can be written signed or unsigned
+IMM_MIN = -(1 << (IMM_WIDTH - 1))
+WORD_MIN = -(1 << (WORD_WIDTH - 1))
+
+REGISTER_IDS = {f"r{i}": i for i in range(1 << REG_WIDTH)}
+
+Operand = Union[str, int]
+
+
+def reg_to_int(reg: Operand) -> int:
+    if type(reg) is int:
+        return reg
+    try:
+        return REGISTER_IDS[reg]
+    except KeyError:
+        raise Exception(f"Expected register, got {reg}") from None
+
+
+def imm_to_int(imm: Operand) -> int:
+    if type(imm) is int:
+        return imm
+    if imm.startswith("0x"):
+        return int(imm[2:], 16)  # hex
+    if imm.startswith("0b"):
+        return int(imm[2:], 2)  # binary
+    return int(imm)  # decimal
+
+
+def checked(value: Operand, low: int, high: int, what: str) -> int:
+    """
+    Returns value as an int, raising when it's outside [low, high] rather
+    than letting the mask turn it into a different instruction
+    """
+    number = imm_to_int(value)
+    if not low <= number <= high:
+        raise Exception(f"{what} {value} is out of range")
+    return number
 
-def reg_to_binary(reg_num: str):
-    assert reg_num.startswith("r"), f"Expected register, got {reg_num}"
-    return bin(int(reg_num.removeprefix("r")))[2:].rjust(5, "0")
 
+def to_hex(word: int) -> str:
+    return f"{word:08X}"
 
-def imm_to_binary(imm: str, size: int = IMM_WIDTH):
-    if imm.startswith("0x"):
-        imm = int(imm[2:], 16)  # hex
-    elif imm.startswith("0b"):
-        imm = int(imm[2:], 2)  # binary
-    else:  # decimal
-        imm = int(imm)
-    if imm < 0:
-        tmp = list(map(lambda x: x, bin(imm)[3:].rjust(size, "0")))
-        first_one_index = size - 1
-        while first_one_index > -1 and tmp[first_one_index] != "1":
-            first_one_index -= 1
-        # now, everything before this must get swapped
-        for i in range(first_one_index - 1, -1, -1):
-            if tmp[i] == "1":
-                tmp[i] = "0"
-            else:
-                tmp[i] = "1"
-        return "".join(tmp)
-
-    return bin(imm)[2:].rjust(size, "0")
-
-
-def to_hex(*args):
-    return hex(int("".join(args), 2))[2:].rjust(8, "0").upper()
-
-
-def encode_r_type(
-    opcode: Optional[str] = None,
-    rs: Optional[str] = None,
-    rt: Optional[str] = None,
-    rd: Optional[str] = None,
-    shamt: Optional[str] = None,
-    funct: Optional[str] = None,
-):
+
+# ==============================
+# Packers
+# ==============================
+# every packer takes the opcode and funct from the encoding table followed
+# by the instruction's operands in assembly order, and returns the word
+def pack_rrr(opcode: int, funct: int, rd: Operand, rs: Operand, rt: Operand) -> int:
+    return (
+        (opcode << OPCODE_SHIFT)
+        | (reg_to_int(rs) << RS_SHIFT)
+        | (reg_to_int(rt) << RT_SHIFT)
+        | (reg_to_int(rd) << RD_SHIFT)
+        | funct
+    )
+
+
+def pack_shift(
+    opcode: int, funct: int, rd: Operand, rs: Operand, shamt: Operand
+) -> int:
+    return (
+        (opcode << OPCODE_SHIFT)
+        | (reg_to_int(rs) << RS_SHIFT)
+        | (reg_to_int(rd) << RD_SHIFT)
+        | (checked(shamt, 0, SHAMT_MASK, "Shift amount") << SHAMT_SHIFT)
+        | funct
+    )
+
+
+def pack_jr(opcode: int, funct: int, rs: Operand) -> int:
+    return (opcode << OPCODE_SHIFT) | (reg_to_int(rs) << RS_SHIFT) | funct
+
+
+def pack_rri(opcode: int, funct: int, rt: Operand, rs: Operand, imm: Operand) -> int:
+    return (
+        (opcode << OPCODE_SHIFT)
+        | (reg_to_int(rs) << RS_SHIFT)
+        | (reg_to_int(rt) << RT_SHIFT)
+        | (checked(imm, IMM_MIN, IMM_MASK, "Immediate") & IMM_MASK)
+    )
+
+
+def pack_lui(opcode: int, funct: int, rt: Operand, imm: Operand) -> int:
+    rt = reg_to_int(rt)
+    return (
+        (opcode << OPCODE_SHIFT)
+        | (rt << RS_SHIFT)
+        | (rt << RT_SHIFT)
+        | (checked(imm, IMM_MIN, IMM_MASK, "Immediate") & IMM_MASK)
+    )
+
+
+def pack_jump(opcode: int, funct: int, addr: Operand) -> int:
+    return (opcode << OPCODE_SHIFT) | checked(addr, 0, JMP_ADDR_MASK, "Jump address")
+
+
+def pack_none(opcode: int, funct: int) -> int:
+    return opcode << OPCODE_SHIFT
+
+
+# mnemonic : (packer, opcode, funct)
+ENCODINGS: Dict[str, Tuple[Callable[..., int], int, int]] = {
+    **{inst: (pack_rrr, 0, FUNCTS[inst]) for inst in GENERIC_R_TYPES},
+    "sll": (pack_shift, 0, FUNCTS["sll"]),
+    "srl": (pack_shift, 0, FUNCTS["srl"]),
+    "jr": (pack_jr, 0, FUNCTS["jr"]),
+    **{inst: (pack_rri, OPCODES[inst], 0) for inst in GENERIC_I_TYPES},
+    "lui": (pack_lui, OPCODES["lui"], 0),
+    "jmp": (pack_jump, OPCODES["jmp"], 0),
+    "jal": (pack_jump, OPCODES["jal"], 0),
+    "push": (pack_none, OPCODES["push"], 0),
+    "pop": (pack_none, OPCODES["pop"], 0),
+}
+
+
+# ==============================
+# Assembler macros
+# ==============================
+def expand_la(reg: Operand, addr: Operand) -> List[Tuple[str, Tuple[Operand, ...]]]:
+    # addr is the 32 bit addr
+    # so we lui the top
+    # and ori the bottom
+    addr = checked(addr, WORD_MIN, WORD_MASK, "Address") & WORD_MASK
+    return [
+        ("lui", (reg, addr >> IMM_WIDTH)),
+        ("ori", (reg, reg, addr & IMM_MASK)),
+    ]
+
+
+def expand_li(reg: Operand, value: Operand) -> List[Tuple[str, Tuple[Operand, ...]]]:
+    # lui alone when the bottom half is zero, otherwise the same as la
+    value = checked(value, WORD_MIN, WORD_MASK, "Value") & WORD_MASK
+    if value & IMM_MASK == 0:
+        return [("lui", (reg, value >> IMM_WIDTH))]
+    return expand_la(reg, value)
+
+
+def _far_branch(inverse: str):
+    # the inverted branch skips over the jmp when the original isn't taken
+    def expand_far(
+        rt: Operand, rs: Operand, addr: Operand
+    ) -> List[Tuple[str, Tuple[Operand, ...]]]:
+        return [(inverse, (rt, rs, 1)), ("jmp", (addr,))]
+
+    return expand_far
+
+
+MACROS = {
+    "la": expand_la,
+    "li": expand_li,
+    # relaxed beq/bne, only produced by the assembler's layout pass
+    "beq.far": _far_branch("bne"),
+    "bne.far": _far_branch("beq"),
+}
+# macros that can be written in source
+PSEUDO_INSTRUCTIONS = {"la", "li"}
+# macros whose size doesn't depend on their operands
+FIXED_SIZES = {"la": 2, "beq.far": 2, "bne.far": 2}
+
+
+def size_of(inst: str, *args: Operand) -> int:
+    """
+    Returns the number of words inst takes. The operands are only looked at
+    when the size depends on them, so they can still be labels otherwise
+    """
+    if inst in FIXED_SIZES:
+        return FIXED_SIZES[inst]
+    if inst in MACROS:
+        return len(MACROS[inst](*args))
+    return 1
+
+
+# ==============================
+# Integer encoding
+# ==============================
+def encode_word(inst: str, *args: Operand) -> int:
+    """
+    Returns the encoding of a single-word instruction
+    """
+    try:
+        pack, opcode, funct = ENCODINGS[inst]
+    except KeyError:
+        raise Exception(f"Unknown instruction {inst}") from None
+    return pack(opcode, funct, *args)
+
+
+def encode_words(inst: str, *args: Operand) -> List[int]:
     """
-    Returns the 8-digit hex encoding
+    Returns the encoding of any instruction or macro, one int per word
     """
-    opcode = opcode or "0" * OPCODE_WIDTH
-    rs = rs or "0" * REG_WIDTH
-    rt = rt or "0" * REG_WIDTH
-    rd = rd or "0" * REG_WIDTH
-    shamt = shamt or "0" * SHAMT_WIDTH
-    funct = funct or "0" * FUNCT_WIDTH
-    return to_hex(opcode, rs, rt, rd, shamt, funct)
-
-
-def encode_i_type(
-    opcode: Optional[str] = None,
-    rs: Optional[str] = None,
-    rt: Optional[str] = None,
-    imm: Optional[str] = None,
-):
+    if inst in MACROS:
+        return [encode_word(name, *margs) for name, margs in MACROS[inst](*args)]
+    return [encode_word(inst, *args)]
+
+
+def encode_many(instructions: Iterable[Tuple[str, Sequence[Operand]]]) -> List[int]:
     """
-    Returns the 8-digit hex encoding
+    Encodes (name, args) pairs in bulk, returning one int per word
     """
-    opcode = opcode or "0" * OPCODE_WIDTH
-    rs = rs or "0" * REG_WIDTH
-    rt = rt or "0" * REG_WIDTH
-    imm = imm or "0" * IMM_WIDTH
-    return to_hex(opcode, rs, rt, imm)
+    words = []
+    append = words.append
+    encodings = ENCODINGS
+    for inst, args in instructions:
+        entry = encodings.get(inst)
+        if entry is None:
+            words.extend(encode_words(inst, *args))
+        else:
+            pack, opcode, funct = entry
+            append(pack(opcode, funct, *args))
+    return words
 
 
-def encode_j_type(
-    opcode: Optional[str] = None,
-    addr: Optional[str] = None,
-):
-    opcode = opcode or "0" * OPCODE_WIDTH
-    addr = addr or "0" * JMP_ADDR_WIDTH
-    return to_hex(opcode, addr)
+# ==============================
+# Vectorized encoding
+# ==============================
+# packers in the order pack_columns numbers them, and how many operands
+# each one takes
+PACKERS = [pack_rrr, pack_shift, pack_jr, pack_rri, pack_lui, pack_jump, pack_none]
+ARITIES = [3, 3, 1, 3, 2, 1, 0]
+
+
+def pack_columns(packer, opcode, funct, first, second, third):
+    """
+    Packs one instruction per row of numpy int64 columns: the index of its
+    packer in PACKERS, its opcode and funct, and its first three operands
+    as ints. Returns the uint32 words along with which rows had every field
+    in range, the others need packing one at a time to raise their error
+    """
+    import numpy as np
+
+    rrr, shift, jr, rri, lui, jump = (packer == i for i in range(6))
+    rd = np.where(rrr | shift, first, 0)
+    rs = np.select([rrr | shift | rri, jr | lui], [second, first], 0)
+    rt = np.select([rrr, rri | lui], [third, first], 0)
+    shamt = np.where(shift, third, 0)
+    imm = np.select([rri, jump, lui], [third, first, second], 0)
+
+    in_range = ((rs | rt | rd) & ~REG_MASK) == 0
+    in_range &= (shamt & ~SHAMT_MASK) == 0
+    in_range &= ~(rri | lui) | ((imm >= IMM_MIN) & (imm <= IMM_MASK))
+    in_range &= ~jump | ((imm >= 0) & (imm <= JMP_ADDR_MASK))
+    # the mask takes care of negative immediates, which are already in
+    # two's complement as int64
+    words = (
+        (opcode << OPCODE_SHIFT)
+        | (rs << RS_SHIFT)
+        | (rt << RT_SHIFT)
+        | (rd << RD_SHIFT)
+        | (shamt << SHAMT_SHIFT)
+        | funct
+        | np.where(jump, imm, imm & IMM_MASK)
+    )
+    return words.astype(np.uint32), in_range
 
 
 # ==============================
 # R Types
 # ==============================
+def _r_type(inst: str):
+    def encode_r(rd, rs, rt):
+        return to_hex(encode_word(inst, rd, rs, rt))
+
+    encode_r.__name__ = encode_r.__qualname__ = f"encode_{inst}"
+    return encode_r
+
+
 for inst in GENERIC_R_TYPES:
-    exec(
-        f"""
-def encode_{inst}(rd, rs, rt):
-    return encode_r_type(rd=reg_to_binary(rd), rs=reg_to_binary(rs), rt=reg_to_binary(rt), funct=FUNCTS["{inst}"])
-""".strip()
-    )
+    globals()[f"encode_{inst}"] = _r_type(inst)
 
 
 def encode_srl(rd, rs, shamt):
-    return encode_r_type(
-        rd=reg_to_binary(rd),
-        rs=reg_to_binary(rs),
-        shamt=imm_to_binary(shamt, SHAMT_WIDTH),
-        funct=FUNCTS["srl"],
-    )
+    return to_hex(encode_word("srl", rd, rs, shamt))
 
 
 def encode_sll(rd, rs, shamt):
-    return encode_r_type(
-        rd=reg_to_binary(rd),
-        rs=reg_to_binary(rs),
-        shamt=imm_to_binary(shamt, SHAMT_WIDTH),
-        funct=FUNCTS["sll"],
-    )
+    return to_hex(encode_word("sll", rd, rs, shamt))
 
 
 def encode_jr(rs):
-    return encode_r_type(rs=reg_to_binary(rs), funct=FUNCTS["jr"])
+    return to_hex(encode_word("jr", rs))
 
 
 # ==============================
 # I Types
 # ==============================
+def _i_type(inst: str):
+    def encode_i(rt, rs, imm):
+        return to_hex(encode_word(inst, rt, rs, imm))
+
+    encode_i.__name__ = encode_i.__qualname__ = f"encode_{inst}"
+    return encode_i
+
+
 for inst in GENERIC_I_TYPES:
-    exec(
-        f"""
-def encode_{inst}(rt, rs, imm):
-    return encode_i_type(rt=reg_to_binary(rt), rs=reg_to_binary(rs), imm=imm_to_binary(imm), opcode=OPCODES["{inst}"])
-        """.strip()
-    )
+    globals()[f"encode_{inst}"] = _i_type(inst)
 
 
 def encode_lui(rt, imm):
-    return encode_i_type(
-        rt=reg_to_binary(rt),
-        rs=reg_to_binary(rt),
-        imm=imm_to_binary(imm),
-        opcode=OPCODES["lui"],
-    )
+    return to_hex(encode_word("lui", rt, imm))
 
 
 # ==============================
 # J Types
 # ==============================
 def encode_jmp(addr):
-    return encode_j_type(
-        opcode=OPCODES["jmp"], addr=imm_to_binary(addr, JMP_ADDR_WIDTH)
-    )
+    return to_hex(encode_word("jmp", addr))
 
 
 def encode_jal(addr):
-    return encode_j_type(
-        opcode=OPCODES["jal"], addr=imm_to_binary(addr, JMP_ADDR_WIDTH)
-    )
+    return to_hex(encode_word("jal", addr))
 
 
 def encode_push():
-    return encode_j_type(opcode=OPCODES["push"])
+    return to_hex(encode_word("push"))
 
 
 def encode_pop():
-    return encode_j_type(opcode=OPCODES["pop"])
+    return to_hex(encode_word("pop"))
 
 
-# ==============================
-# Assembler macros
-# ==============================
 def encode_la(reg: str, addr: str):
-    # addr is the 32 bit addr
-    # so we lui the top
-    # and ori the bottom
-    addr = imm_to_binary(addr, 32)
-    result = encode_lui(reg, f"0b{addr[:16]}")
-    result += "\n" + encode("ori", reg, reg, f"0b{addr[16:]}")
-    return result
+    return encode("la", reg, addr)
+
+
+def encode_li(reg: str, value: str):
+    return encode("li", reg, value)
 
 
 # ==============================
 # Top Level function
 # ==============================
-def encode(inst: str, *args: str) -> str:
-    local_dict = {}
-    exec(f"f = encode_{inst}", globals(), local_dict)
-    return local_dict["f"](*args)
+def encode(inst: str, *args: Operand) -> str:
+    """
+    Returns the 8-digit hex encoding, one line per word
+    """
+    return "\n".join(map(to_hex, encode_words(inst, *args)))
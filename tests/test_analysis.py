@@ -0,0 +1,101 @@
+import os
+import pytest
+from assembler.analysis import Analysis, CostModel, analyze
+from assembler.assembler import assemble, resolve
+from assembler.grammar import process
+
+EXAMPLES = os.path.join(os.path.dirname(__file__), "..", "examples")
+
+
+def analyzed(source: str, costs: CostModel = None) -> Analysis:
+    return analyze(resolve(process(source)), costs)
+
+
+def example(name: str) -> str:
+    with open(os.path.join(EXAMPLES, name)) as f:
+        return f.read()
+
+
+class TestAnalysis:
+
+    def test_blocks_and_loops(self):
+        analysis = analyzed(example("cs147.asm"))
+        blocks = {block.label: block for block in analysis.blocks}
+        assert list(blocks) == ["(start)", "main", "LOOP", "LOOP+1", "END"]
+        assert [block.depth for block in blocks.values()] == [0, 0, 1, 1, 0]
+        # two lw, one sw, a jmp, three alu and two hazard stalls
+        assert blocks["LOOP+1"].cycles == 3 * 3 + 2 + 3 * 1 + 2 * 1
+        assert analysis.hot_spots(1) == [blocks["LOOP+1"]]
+        (main,) = analysis.functions
+        assert main.name == "main" and main.blocks == 4
+        assert main.weighted == 4 + 10 * (3 + 16) + 3
+
+    def test_functions(self):
+        analysis = analyzed(example("recfib.asm"))
+        costs = {function.name: function for function in analysis.functions}
+        assert sorted(costs) == ["fib", "main"]
+        # recursion isn't a loop
+        assert all(block.depth == 0 for block in analysis.blocks)
+        assert costs["fib"].cycles == costs["fib"].weighted
+
+    def test_nested_loops(self):
+        source = """
+        .text
+        main:
+        outer:
+            addi r1, r1, -1;
+        inner:
+            addi r2, r2, -1;
+            bne r2, r0, inner;
+            bne r1, r0, outer;
+        """
+        blocks = analyzed(source).blocks
+        assert [block.depth for block in blocks] == [0, 1, 2, 1]
+
+    def test_hazards(self):
+        source = """
+        .text
+        main:
+            lw r1, r2, 0;
+            add r3, r1, r1;
+            jal f;
+            add r4, r31, r0;
+        f:
+            la r5, A;
+            jr r31;
+        .data
+        A: 1;
+        """
+        analysis = analyzed(source)
+        found = [(h.register, h.writer, h.reader) for h in analysis.hazards]
+        # the word after a jal runs after the call returns, and la is lui
+        # then ori
+        assert found == [(1, "lw", "add"), (5, "lui", "ori")]
+
+    def test_costs(self):
+        source = ".text\nmain:\n    mul r1, r1, r1;\n    push;\n    muli r2, r2, 3;\n"
+        costs = CostModel.parse(["multiply=10", "memory=7"])
+        _, main = analyzed(source, costs).blocks
+        assert main.cycles == 10 + 7 + 10
+        with pytest.raises(Exception, match="Expected NAME=CYCLES"):
+            CostModel.parse(["divide=3"])
+
+    def test_far_branches(self):
+        # a relaxed branch is an inverted branch over a jmp
+        source = (
+            ".text\nmain:\n    beq r1, r2, end;\n" + "    addi r1, r1, 1;\n" * 40000
+        )
+        source += "end:\n    jr r31;\n"
+        analysis = analyzed(source)
+        assert analysis.successors[1] == [3, 2]
+        assert analysis.blocks[1].cycles == 2 + 2
+
+    def test_assemble(self):
+        analysis = Analysis()
+        source = example("binsearch.asm")
+        assert assemble(process(source), analysis=analysis) == assemble(process(source))
+        assert {function.name for function in analysis.functions} == {
+            "binsearch",
+            "main",
+        }
+        assert analysis.report()[0].startswith("analysis: 41 words in 10 blocks")
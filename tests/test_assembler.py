@@ -0,0 +1,239 @@
+import os
+import sys
+from array import array
+import pytest
+from assembler.assembler import (
+    assemble,
+    assemble_image,
+    assemble_stream,
+    encode_columns,
+    jump_address,
+    resolve,
+)
+from assembler.translator import encode_many
+from assembler.grammar import iter_parse, lex, lex_lines, process, relative_to
+from assembler.sim import Machine
+
+EXAMPLES = os.path.join(os.path.dirname(__file__), "..", "examples")
+SOURCE = """
+.text
+loop:
+    beq r1, r2, done;
+    addi r1, r1, 1;
+    jmp loop;
+done:
+    la r3, B;
+    jr r31;
+main:
+    jal loop;
+.data
+A: 1, 2, 3;
+B: 0x10;
+"""
+
+
+def stream(source: str):
+    return assemble_stream(iter_parse(lex(source)))
+
+
+class TestStreamAssembler:
+
+    def test_matches_assemble(self):
+        for name in ["binsearch", "recfib", "cs147"]:
+            with open(f"{EXAMPLES}/{name}.asm") as f:
+                source = f.read()
+            image = stream(source)
+            classic = assemble_image(process(source))
+            assert list(image.text) == list(classic.text)
+            assert list(image.data) == list(classic.data)
+
+    def test_patches_forward_references(self):
+        image = stream(SOURCE)
+        assert image.text[0] == 0x08001007  # jmp main
+        assert image.text[1] == 0x10410002  # beq r1, r2, done
+        assert list(image.text[4:6]) == [0x3C630100, 0x34638003]  # la r3, B
+        assert image.text[7] == 0x0C001001  # jal loop
+
+    def test_lex_lines(self):
+        image = assemble_stream(iter_parse(lex_lines(SOURCE.splitlines(True))))
+        assert list(image.text) == list(stream(SOURCE).text)
+
+    def test_unknown_label(self):
+        with pytest.raises(Exception, match="Unknown label"):
+            stream(".text\nmain: jmp nowhere;")
+
+    def test_branch_out_of_range(self):
+        source = ".text\nmain: beq r0, r0, far;\n" + "push;\n" * 40000 + "far: pop;"
+        with pytest.raises(Exception, match="out of range"):
+            stream(source)
+
+    def test_duplicate_label(self):
+        with pytest.raises(Exception, match="already exists"):
+            stream(".text\nmain: push;\nmain: pop;")
+
+
+class TestLayout:
+
+    def test_labels_after_la(self):
+        # la is two words, so loop is at 0x1004 and not 0x1003
+        image = assemble_image(process(SOURCE))
+        assert list(image.text) == list(stream(SOURCE).text)
+
+    def test_li(self):
+        source = ".text\nmain: li r1, 0x20000; li r2, -2; end: jmp end;"
+        image = assemble_image(process(source))
+        assert list(image.text) == [
+            0x08001001,
+            0x3C210002,
+            0x3C42FFFF,
+            0x3442FFFE,
+            0x08001004,
+        ]
+        assert list(image.text) == list(stream(source).text)
+
+    def test_relaxes_far_branches(self):
+        source = (
+            ".text\nmain: addi r1, r1, 1; beq r1, r1, far;\n"
+            + "push;\n" * 40000
+            + "far: addi r2, r2, 1; beq r0, r1, main;"
+        )
+        image = assemble_image(process(source))
+        assert image.text[2] == 0x14210001  # bne r1, r1, 1
+        assert image.text[3] == 0x08000000 | 40004 + 0x1000  # jmp far
+        assert image.text[-2] == 0x14200001  # beq r0, r1 inverted to bne
+        assert image.text[-1] == 0x08001001  # jmp main
+        machine = Machine.from_image(image)
+        machine.run(20)
+        assert machine.halted
+        assert machine.regs[1:3] == [1, 1]
+
+    def test_relaxed_branches_are_annotated(self):
+        source = ".text\nmain: bne r1, r2, far;\n" + "push;\n" * 40000 + "far: pop;"
+        lines = assemble(process(source)).splitlines()
+        assert lines[3] == "10410001"
+        assert lines[4] == "0800AC43    // main: bne.far r1, r2, 0xac43;"
+
+    def test_jump_range(self):
+        assert jump_address(0) == 0x1000
+        with pytest.raises(Exception, match="out of range"):
+            jump_address(1 << 26)
+
+    def test_unknown_label(self):
+        with pytest.raises(Exception, match="Unknown label nowhere"):
+            assemble_image(process(".text\nmain: beq r1, r1, nowhere;"))
+        with pytest.raises(Exception, match="Didn't expect a label"):
+            assemble_image(process(".text\nmain: li r1, main;"))
+
+
+COLUMNS = (
+    ".text\nloop: add r3, r2, r1; sll r2, r2, 12; srl r2, r2, 0x1F;\n"
+    "jr r13; lui r4, 32768; addi r5, r5, -1; li r6, 0x10000; li r7, -2;\n"
+    "la r1, B; beq r1, r9, loop; bne r1, r9, far; slti r1, r1, 0b11;\n"
+    "jal loop; push; pop;\n" + "push;\n" * 40000 + "far: jmp loop;\n"
+    "main: beq r0, r0, loop;\n.data\nB: 1;"
+)
+
+
+class TestColumnEncoding:
+
+    def test_matches_encode_many(self):
+        pytest.importorskip("numpy")
+        result = resolve(process(COLUMNS))
+        assert result.relaxed
+        words = encode_columns(result)
+        assert words.typecode == "I"
+        assert words == array("I", encode_many(result.statements()))
+
+    @pytest.mark.parametrize("name", ["binsearch.asm", "cs147.asm", "recfib.asm"])
+    def test_examples(self, name):
+        pytest.importorskip("numpy")
+        with open(os.path.join(EXAMPLES, name)) as f:
+            result = resolve(process(f.read(), EXAMPLES))
+        assert encode_columns(result) == array("I", encode_many(result.statements()))
+
+    @pytest.mark.parametrize(
+        "source, message",
+        [
+            ("main: addi r1, r1, 70000;", "Immediate 70000 is out of range"),
+            ("main: sll r1, r1, 40;", "Shift amount 40 is out of range"),
+            ("main: push; lui r1, -32769;", "Immediate -32769 is out of range"),
+            ("main: jmp nowhere;", "Unknown label nowhere"),
+        ],
+    )
+    def test_errors(self, source, message):
+        pytest.importorskip("numpy")
+        with pytest.raises(Exception, match=message):
+            encode_columns(resolve(process(f".text\n{source}")))
+
+    def test_without_numpy(self, monkeypatch):
+        image = assemble_image(process(COLUMNS))
+        monkeypatch.setitem(sys.modules, "numpy", None)
+        assert assemble_image(process(COLUMNS)) == image
+
+
+BULK = """
+.data
+A: 1, 2;
+T: .incbin "table.bin";
+Z: .space 3;
+F: .fill 2, 0xAB;
+B: 7;
+.text
+main: la r1, B; la r2, T;
+"""
+
+
+class TestDataDirectives:
+
+    @pytest.fixture
+    def directory(self, tmp_path):
+        (tmp_path / "table.bin").write_bytes(bytes([1, 2, 3, 4, 5, 6]))
+        return str(tmp_path)
+
+    def test_image(self, directory):
+        image = assemble_image(process(BULK, directory))
+        assert list(image.data[:7]) == [1, 2, 0x01020304, 0x05060000, 0, 0, 0]
+        assert list(image.data[7:]) == [0xAB, 0xAB, 7]
+        # B is at offset 9 and T at offset 2
+        assert image.text[2] == 0x34218009 and image.text[4] == 0x34428002
+
+    def test_annotated(self, directory):
+        lines = assemble(process(BULK, directory)).splitlines()
+        start = lines.index("@01008000")
+        assert lines[start + 3 : start + 7] == [
+            f'01020304    // T: .incbin "{directory}/table.bin";',
+            "05060000",
+            "00000000    // Z: .space 3;",
+            "00000000",
+        ]
+        assert lines[-1] == "00000007    // B: 7;"
+
+    def test_every_path_agrees(self, directory):
+        image = assemble_image(process(BULK, directory))
+        tokens = relative_to(lex(BULK), directory)
+        assert assemble_stream(iter_parse(tokens)) == image
+        assert assemble_image(process(BULK, directory), optimize=True) == image
+
+    def test_large(self, tmp_path):
+        (tmp_path / "big.bin").write_bytes(bytes(range(256)) * 4096)
+        source = (
+            '.data\nT: .incbin "big.bin";\nF: .fill 100000, -1;\n.text\nmain: jr r31;'
+        )
+        program = process(source, str(tmp_path))
+        assert len(program.data_values) == 0
+        data = assemble_image(program).data
+        assert len(data) == 262144 + 100000
+        assert data[0] == 0x00010203 and data[-1] == 0xFFFFFFFF
+
+    @pytest.mark.parametrize(
+        "value, message",
+        [
+            ('.incbin "missing.bin"', "Can't include missing.bin"),
+            (".fill 3", "Expected .fill count, value"),
+            (".space -1", "Can't repeat a word -1 times"),
+            (".align 4", "Unknown data directive .align"),
+        ],
+    )
+    def test_errors(self, value, message):
+        with pytest.raises(Exception, match=message):
+            assemble(process(f".data\nA: {value};\n.text\nmain: jr r31;"))
@@ -0,0 +1,63 @@
+import os
+from assembler.assembler import assemble_fragment, assemble_image, link
+from assembler.cache import AssemblyCache, assemble_cached, split_segments
+from assembler.grammar import iter_parse, lex, process
+
+SOURCE = """
+.data
+A: 1, 2; # .text in a comment
+.text
+f: addi r1, r1, 1;
+jr r31;
+tail:
+.text
+main: jal f;
+beq r0, r0, tail;
+"""
+
+
+class TestCache:
+
+    def test_split_segments(self):
+        chunks = split_segments(SOURCE)
+        assert [chunk.split()[0] for chunk in chunks[1:]] == [".data", ".text", ".text"]
+        assert "".join(chunks) == SOURCE
+
+    def test_link_matches_stream(self):
+        fragments = [
+            assemble_fragment(iter_parse(lex(chunk)))
+            for chunk in split_segments(SOURCE)
+        ]
+        image = link(fragments)
+        classic = assemble_image(process(SOURCE))
+        assert list(image.text) == list(classic.text)
+        assert list(image.data) == list(classic.data)
+
+    def test_reuses_unchanged_segments(self, tmp_path):
+        cache = AssemblyCache(str(tmp_path))
+        first = assemble_cached(SOURCE, cache)
+        assert cache.hits == 0
+
+        edited = SOURCE.replace("main: jal f;", "main: jal f;\npush;")
+        cache = AssemblyCache(str(tmp_path))  # start from disk only
+        second = assemble_cached(edited, cache)
+        assert (cache.hits, cache.misses) == (3, 1)
+        assert list(second.text) == list(assemble_image(process(edited)).text)
+        assert list(first.text) != list(second.text)
+
+    def test_evicts_least_recently_used(self, tmp_path):
+        cache = AssemblyCache(str(tmp_path), max_bytes=0)
+        assemble_cached(SOURCE, cache)
+        assert os.listdir(tmp_path) == []
+
+    def test_directives_in_strings(self, tmp_path):
+        (tmp_path / "tbl.data").write_bytes(bytes([1, 2, 3, 4]))
+        (tmp_path / "a.text").write_bytes(bytes([5, 6, 7, 8]))
+        source = (
+            '.data\nt: .incbin "tbl.data";\nu: .incbin "a.text";\n'
+            ".text\nmain: la r1, u;"
+        )
+        assert len(split_segments(source)) == 2
+        image = assemble_cached(source, AssemblyCache(str(tmp_path)), str(tmp_path))
+        assert image == assemble_image(process(source, str(tmp_path)))
+        assert list(image.data) == [0x01020304, 0x05060708]
@@ -0,0 +1,157 @@
+import os
+import pytest
+from assembler.assembler import assemble_image
+from assembler.compiler import compile_c, compile_program, format_statements
+from assembler.grammar import Instruction, process
+from assembler.sim import Machine, signed
+
+EXAMPLES = os.path.join(os.path.dirname(__file__), "..", "examples")
+
+
+def example(name: str) -> str:
+    with open(os.path.join(EXAMPLES, f"{name}.c")) as f:
+        return f.read()
+
+
+def run(source: str, naive: bool = False) -> Machine:
+    machine = Machine.from_image(assemble_image(compile_program(source, naive)))
+    machine.run()
+    assert machine.halted
+    return machine
+
+
+def returned(source: str, naive: bool = False) -> int:
+    return signed(run(source, naive).regs[1])
+
+
+def instructions(source: str, function: str):
+    statements = compile_c(source)
+    names = [getattr(statement, "name", None) for statement in statements]
+    start = names.index(function)
+    found = []
+    for statement in statements[start + 1 :]:
+        if type(statement) is not Instruction:
+            if not statement.name.startswith("__"):
+                break
+            continue
+        found.append(statement.name)
+    return found
+
+
+class TestCompiler:
+
+    @pytest.mark.parametrize(
+        "name, expected", [("fib", 610), ("binsearch", 51), ("sort", 1046)]
+    )
+    def test_examples(self, name, expected):
+        source = example(name)
+        allocated, naive = run(source), run(source, naive=True)
+        assert signed(allocated.regs[1]) == signed(naive.regs[1]) == expected
+        assert allocated.executed < naive.executed
+
+    def test_operators(self):
+        source = """
+        int f(int a, int b) {
+            int r = 0;
+            if (a > 3 && b <= 5) r = r | 1;
+            if (a >= 3 || b != 5) r = r | 2;
+            if (!(a == b)) r = r | 4;
+            r = r | ((a < b) << 3) | ((a > b) << 4) | (!a << 5);
+            return r + (-a) * 1000 + (~b << 12) + (a ^ b) * 100000;
+        }
+        int main() { return f(3, 5) - f(7, 2) + (0x10 >> 2) * 2; }
+        """
+
+        def f(a, b):
+            r = 0
+            if a > 3 and b <= 5:
+                r |= 1
+            if a >= 3 or b != 5:
+                r |= 2
+            if a != b:
+                r |= 4
+            r |= ((a < b) << 3) | ((a > b) << 4) | ((not a) << 5)
+            return r + (-a) * 1000 + ((~b) << 12) + (a ^ b) * 100000
+
+        assert returned(source) == f(3, 5) - f(7, 2) + 8
+
+    def test_globals_and_loops(self):
+        source = """
+        int total;
+        int squares[10];
+        void fill() {
+            int i = 0;
+            while (1) {
+                i = i + 1;
+                if (i >= 10) break;
+                if (i & 1) continue;
+                squares[i] = i * i;
+            }
+        }
+        int main() {
+            fill();
+            int i = 0;
+            while (i < 10) {
+                total = total + squares[i];
+                i = i + 1;
+            }
+            return total;
+        }
+        """
+        assert returned(source) == 4 + 16 + 36 + 64
+
+    def test_spills(self):
+        # more values live across the calls than there are registers
+        count = 40
+        body = "".join(f"int v{i} = g({i});\n" for i in range(count))
+        total = " + ".join(f"v{i}" for i in range(count))
+        source = (
+            "int g(int x) { return x * 3 - 1; }\n"
+            f"int main() {{\n{body}return {total};\n}}\n"
+        )
+        expected = sum(i * 3 - 1 for i in range(count))
+        statements = compile_c(source)
+        assert "__main_spill" in [statement.name for statement in statements]
+        assert returned(source) == returned(source, naive=True) == expected
+
+    def test_eight_arguments(self):
+        source = """
+        int f(int a, int b, int c, int d, int e, int f, int g, int h) {
+            return a - b + c - d + e - f + g - h * 2;
+        }
+        int main() { return f(8, 7, 6, 5, 4, 3, 2, 1); }
+        """
+        assert returned(source) == 3
+
+    def test_saves_only_live_registers(self):
+        source = example("fib")
+        # a leaf saves nothing, and its return address stays in r31
+        leaf = "int leaf(int x) { return x + 1; }\nint main() { return leaf(1); }"
+        assert "push" not in instructions(leaf, "leaf")
+        # fib keeps n and its return address over the first call, and the
+        # first result and its return address over the second
+        assert instructions(source, "fib").count("push") == 4
+
+    def test_assembly_text(self):
+        source = example("sort")
+        text = "\n".join(format_statements(compile_c(source)))
+        assert assemble_image(process(text)) == assemble_image(compile_program(source))
+
+    @pytest.mark.parametrize(
+        "source, message",
+        [
+            ("int main() { return x; }", "Unknown name x"),
+            ("int main() { return f(1); }", "Unknown function f"),
+            ("void f() { } int main() { return f(); }", "f doesn't return a value"),
+            ("int main() { int a[3]; return 0; }", "Arrays have to be global"),
+            ("int main() { return 1 / 2; }", "There's no division"),
+            ("int main() { int x = 1; return x << x; }", "Shift amounts"),
+            ("int add() { return 1; } int main() { return 0; }", "add is reserved"),
+            ("int f() { return 1; }", "There's no main function"),
+            ("int main() { break; }", "break outside of a loop"),
+            ("int main() { return 1 }", r"Expected ;, got } \(line 1, column 23\)"),
+        ],
+    )
+    def test_errors(self, source, message):
+        with pytest.raises(Exception, match=message):
+            compile_c(source)
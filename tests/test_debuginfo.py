@@ -0,0 +1,110 @@
+import os
+import pytest
+from assembler.assembler import DATA_START_ADDR, PROGRAM_START_ADDR, resolve
+from assembler.debuginfo import DebugInfo, Location, write_debug_info
+from assembler.grammar import Instruction, Token, iter_parse, lex, process
+
+EXAMPLES = os.path.join(os.path.dirname(__file__), "..", "examples")
+SOURCE = """.data
+A: 1, 2, 3;
+Z: .space 0;
+B: .fill 4, 7;
+.text
+loop:
+    addi r1, r1, 1;
+    bne r1, r2, loop;
+    jr r31;
+main:
+    la r3, B;
+    jal loop;
+"""
+
+
+@pytest.fixture
+def debug_info(tmp_path):
+    opened = []
+
+    def write(source, optimize=False):
+        path = str(tmp_path / "program.dbg")
+        write_debug_info(resolve(process(source), optimize), "program.asm", path)
+        opened.append(DebugInfo(path))
+        return opened[-1]
+
+    yield write
+    for info in opened:
+        info.close()
+
+
+class TestDebugInfo:
+
+    def test_positions(self):
+        statements = list(iter_parse(lex(SOURCE)))
+        assert [(s.line, s.column) for s in statements[4:6]] == [(7, 5), (8, 5)]
+        # where an instruction is isn't part of its value
+        assert statements[4] == Instruction(
+            "addi",
+            [Token("register", "r1"), Token("register", "r1"), Token("literal", "1")],
+        )
+
+    def test_lookup(self, debug_info):
+        info = debug_info(SOURCE)
+        assert info.lookup(PROGRAM_START_ADDR) is None  # jmp main
+        assert info.lookup(PROGRAM_START_ADDR + 1) == Location(
+            "program.asm", 7, 5, "loop"
+        )
+        assert info.lookup(PROGRAM_START_ADDR + 3).line == 9
+        # la takes two words
+        assert info.lookup(PROGRAM_START_ADDR + 4) == Location(
+            "program.asm", 11, 5, "main"
+        )
+        assert info.lookup(PROGRAM_START_ADDR + 5).line == 11
+        assert info.lookup(PROGRAM_START_ADDR + 6).line == 12
+        assert info.lookup(PROGRAM_START_ADDR + 7) is None
+        assert info.lookup(PROGRAM_START_ADDR - 1) is None
+        assert info.lookup(DATA_START_ADDR + 2) == Location("program.asm", 2, 1, "A")
+        assert info.lookup(DATA_START_ADDR + 6) == Location("program.asm", 4, 1, "B")
+        assert info.lookup(DATA_START_ADDR + 7) is None
+
+    def test_symbolize(self, debug_info):
+        info = debug_info(SOURCE)
+        addresses = list(range(PROGRAM_START_ADDR - 2, PROGRAM_START_ADDR + 10))
+        addresses += list(range(DATA_START_ADDR, DATA_START_ADDR + 8))
+        assert info.symbolize(addresses) == [info.lookup(a) for a in addresses]
+
+    def test_optimized(self, debug_info):
+        # the no-op addi is removed, and the rest keep their lines
+        source = ".text\nmain:\n    addi r1, r1, 0;\n    add r2, r2, r3;\n    jr r31;\n"
+        info = debug_info(source, optimize=True)
+        assert info.lookup(PROGRAM_START_ADDR + 1).line == 4
+        assert info.lookup(PROGRAM_START_ADDR + 2).line == 5
+
+    def test_example(self, debug_info):
+        with open(os.path.join(EXAMPLES, "recfib.asm")) as f:
+            source = f.read()
+        info = debug_info(source)
+        lines = source.split("\n")
+        result = resolve(process(source))
+        for i in range(len(result.program)):
+            location = info.lookup(PROGRAM_START_ADDR + result.addresses[i + 1])
+            text = lines[location.line - 1][location.column - 1 :]
+            assert text.startswith(result.program.name(i))
+
+    def test_data_lines(self, debug_info):
+        with open(os.path.join(EXAMPLES, "binsearch.asm")) as f:
+            source = f.read()
+        info = debug_info(source)
+        # A is one item over six lines, with ten values on the first
+        assert info.lookup(DATA_START_ADDR + 9) == Location("program.asm", 14, 1, "A")
+        assert info.lookup(DATA_START_ADDR + 10) == Location("program.asm", 15, 5, "A")
+        assert info.lookup(DATA_START_ADDR + 0x31) == Location(
+            "program.asm", 19, 5, "A"
+        )
+        # and the lines survive dropping unused code
+        statements = list(process(source).statements())
+        assert [value.line for value in statements[0].values[9:11]] == [0, 15]
+
+    def test_not_debug_info(self, tmp_path):
+        path = tmp_path / "program.dat"
+        path.write_bytes(b"@00001000\n" * 4)
+        with pytest.raises(Exception, match="isn't a debug info file"):
+            DebugInfo(str(path))
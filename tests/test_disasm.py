@@ -0,0 +1,107 @@
+import os
+from array import array
+import pytest
+from assembler.assembler import Image, assemble_image, assemble_lines
+from assembler.disasm import compare, decode, disassemble, read_memh, round_trip
+from assembler.grammar import process
+from assembler.translator import ENCODINGS
+
+EXAMPLES = os.path.join(os.path.dirname(__file__), "..", "examples")
+SOURCE = """
+.text
+loop:
+    beq r1, r2, done;
+    addi r1, r1, -1;
+    andi r4, r1, 0xFF00;
+    sll r5, r4, 3;
+    jmp loop;
+done:
+    la r3, B;
+    lui r6, 0x1234;
+    jr r31;
+main:
+    jal loop;
+    push;
+.data
+A: 1, 2, 3;
+B: 0x10;
+"""
+
+
+def image(source):
+    return assemble_image(process(source))
+
+
+class TestDisassembler:
+
+    def test_decode(self):
+        assert decode(0x00411820) == ("add", (3, 2, 1))
+        assert decode(0x2061FFFF) == ("addi", (1, 3, 0xFFFF))
+        assert decode(0x6C000000) == ("push", ())
+        for name, (_, opcode, funct) in ENCODINGS.items():
+            assert decode(opcode << 26 | funct)[0] == name
+        # bits the assembler never sets
+        assert decode(0x00411860) is None
+        assert decode(0x6C000001) is None
+        assert decode(0xFC000000) is None
+
+    def test_source(self):
+        lines = list(disassemble(image(SOURCE), comments=False))
+        assert lines == [
+            ".data",
+            "D_1008000: 0x1, 0x2, 0x3;",
+            "D_1008003: 0x10;",
+            "",
+            ".text",
+            "L_1001:",
+            "    beq r1, r2, L_1006;",
+            "    addi r1, r1, -1;",
+            "    andi r4, r1, 0xFF00;",
+            "    sll r5, r4, 3;",
+            "    jmp L_1001;",
+            "L_1006:",
+            "    la r3, D_1008003;",
+            "    lui r6, 0x1234;",
+            "    jr r31;",
+            "main:",
+            "    jal L_1001;",
+            "    push;",
+        ]
+        annotated = list(disassemble(image(SOURCE)))
+        assert annotated[12].endswith("# 00001006: 3C630100 34638003")
+
+    @pytest.mark.parametrize("name", ["binsearch.asm", "cs147.asm", "recfib.asm"])
+    def test_round_trip(self, name):
+        with open(os.path.join(EXAMPLES, name)) as f:
+            source = f.read()
+        memdump = "\n".join(assemble_lines(process(source)))
+        assembled = read_memh(memdump)
+        assert assembled == image(source)
+        assert round_trip(assembled) == []
+
+    def test_unknown_words(self):
+        assembled = image(SOURCE)
+        assembled.text[3] = 0xFFFFFFFF
+        assembled.text[4] = 0x08000000  # jmp outside the program
+        lines = list(disassemble(assembled, comments=False))
+        assert "    # unknown word 0xFFFFFFFF" in lines
+        assert "    jmp 0x0;" in lines
+        assert round_trip(assembled)[0].startswith(
+            "segment at 00001000 has 11 words, expected 12"
+        )
+
+    def test_read_memh(self):
+        assembled = read_memh("// header\n@00001000\n1 2\n@00001004\n5\n@01008000\nA\n")
+        assert assembled == Image(array("I", [1, 2, 0, 0, 5]), array("I", [10]))
+        with pytest.raises(Exception, match="Expected an @address"):
+            read_memh("00000001\n")
+        with pytest.raises(Exception, match="below the program"):
+            read_memh("@00000010\n1\n")
+
+    def test_compare(self):
+        a = image(SOURCE)
+        b = image(SOURCE.replace("0x10", "0x11"))
+        assert compare(a, b) == ["01008003: 00000011, expected 00000010"]
+        many = Image(a.text, array("I", [0] * 30))
+        differences = compare(Image(a.text, array("I", [1] * 30)), many)
+        assert len(differences) == 21 and differences[-1] == "... and 10 more words"
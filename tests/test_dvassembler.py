@@ -0,0 +1,180 @@
+import json
+import os
+import shutil
+import subprocess
+import sys
+import pytest
+from assembler import dvassembler
+
+EXAMPLES = os.path.join(os.path.dirname(__file__), "..", "examples")
+
+
+def run(monkeypatch, *args):
+    monkeypatch.setattr(sys, "argv", ["dvassembler", *args])
+    dvassembler.main()
+
+
+class TestDvassembler:
+
+    def test_single_file(self, monkeypatch, tmp_path, capsys):
+        run(monkeypatch, os.path.join(EXAMPLES, "cs147.asm"))
+        assert capsys.readouterr().out.startswith("// ------ Program Part ------")
+
+    def test_batch(self, monkeypatch, tmp_path, capsys):
+        for name in ["cs147.asm", "recfib.asm"]:
+            shutil.copy(os.path.join(EXAMPLES, name), tmp_path)
+        (tmp_path / "bad.asm").write_text(".text\nmain: add r1;")
+        out_dir = tmp_path / "out"
+        with pytest.raises(SystemExit) as exit:
+            run(monkeypatch, str(tmp_path), "--out-dir", str(out_dir), "--workers", "2")
+        assert exit.value.code == 1
+        assert sorted(os.listdir(out_dir)) == ["cs147.dat", "recfib.dat"]
+        summary = capsys.readouterr().err
+        assert "FAIL" in summary and "bad.asm" in summary
+        assert "2 succeeded, 1 failed" in summary
+
+    def test_batch_same_names(self, monkeypatch, tmp_path, capsys):
+        for directory in ["a", "b"]:
+            (tmp_path / directory).mkdir()
+            shutil.copy(
+                os.path.join(EXAMPLES, "cs147.asm"), tmp_path / directory / "main.asm"
+            )
+        (tmp_path / "b" / "main.asm").write_text(".text\nmain: add r1;")
+        out_dir = tmp_path / "out"
+        with pytest.raises(SystemExit):
+            run(
+                monkeypatch, str(tmp_path / "*" / "main.asm"), "--out-dir", str(out_dir)
+            )
+        # b failing doesn't take a's output with it
+        assert os.listdir(out_dir / "a") == ["main.dat"]
+        assert os.listdir(out_dir / "b") == []
+        assert "1 succeeded, 1 failed" in capsys.readouterr().err
+        # the same input twice would write one output twice
+        with pytest.raises(SystemExit) as exit:
+            run(monkeypatch, str(tmp_path / "a"), str(tmp_path / "a" / "main.asm"))
+        assert exit.value.code == 2
+        assert "would both be written to" in capsys.readouterr().err
+
+    @pytest.mark.parametrize(
+        "pattern, message",
+        [("empty", "No .asm files in"), ("*.s", "No files match")],
+    )
+    def test_batch_no_inputs(self, monkeypatch, tmp_path, capsys, pattern, message):
+        (tmp_path / "empty").mkdir()
+        (tmp_path / "notes.txt").write_text("")
+        with pytest.raises(SystemExit) as exit:
+            run(monkeypatch, str(tmp_path / pattern), "--out-dir", str(tmp_path))
+        assert exit.value.code == 2
+        assert message in capsys.readouterr().err
+
+    def test_gc_sections(self, monkeypatch, tmp_path, capsys):
+        source = tmp_path / "library.asm"
+        source.write_text(
+            ".data\nUsed: 1;\nUnused: 2, 3;\n.text\nunused:\n    jr r31;\n"
+            "main:\n    la r1, Used;\n"
+        )
+        shutil.copy(source, tmp_path / "copy.asm")
+        output = tmp_path / "library.dat"
+        run(monkeypatch, str(source), "-o", str(output), "--gc-sections")
+        assert "unused" not in output.read_text()
+        assert "removed 3 words: 1 of text, 2 of data" in capsys.readouterr().err
+        # a batch reports the words saved over all its files
+        with pytest.raises(SystemExit) as exit:
+            run(monkeypatch, str(tmp_path / "*.asm"), "--gc-sections")
+        assert exit.value.code == 0
+        assert "removed 6 words: 2 of text, 4 of data" in capsys.readouterr().err
+        # and is checked for options that can't go together, like one file
+        with pytest.raises(SystemExit) as exit:
+            run(monkeypatch, str(tmp_path / "*.asm"), "--gc-sections", "--cache")
+        assert exit.value.code == 2
+        assert "--gc-sections can't be combined" in capsys.readouterr().err
+
+    @pytest.mark.parametrize(
+        "options, message",
+        [
+            (["--jobs", "2", "--stream"], "--jobs can't be combined with -c, --stream"),
+            (["--analyze", "--profile"], "--analyze can't be combined with"),
+            (
+                ["--profile", "-c"],
+                "--profile can't be combined with -c, --stream, " "--cache or --watch",
+            ),
+            (["--debug-info", "x.dbg", "--watch"], "--debug-info can't be combined"),
+        ],
+    )
+    def test_option_conflicts(self, monkeypatch, capsys, options, message):
+        with pytest.raises(SystemExit) as exit:
+            run(monkeypatch, os.path.join(EXAMPLES, "cs147.asm"), *options)
+        assert exit.value.code == 2
+        assert message in capsys.readouterr().err
+
+    def test_profile(self, monkeypatch, tmp_path, capsys):
+        output = tmp_path / "recfib.dat"
+        profile = tmp_path / "profile.json"
+        run(monkeypatch, os.path.join(EXAMPLES, "recfib.asm"), "-o", str(output))
+        expected = output.read_text()
+        run(
+            monkeypatch,
+            os.path.join(EXAMPLES, "recfib.asm"),
+            "-o",
+            str(output),
+            "--profile-json",
+            str(profile),
+        )
+        assert output.read_text() == expected
+        assert "resolve" in capsys.readouterr().err
+        stages = json.loads(profile.read_text())["stages"]
+        assert stages[0]["name"] == "read" and stages[-1]["name"] == "output"
+
+    def test_debug_info(self, monkeypatch, tmp_path):
+        from assembler.debuginfo import DebugInfo
+
+        source = os.path.join(EXAMPLES, "recfib.asm")
+        path = str(tmp_path / "recfib.dbg")
+        run(
+            monkeypatch,
+            source,
+            "-o",
+            str(tmp_path / "recfib.dat"),
+            "--debug-info",
+            path,
+        )
+        with DebugInfo(path) as info:
+            assert info.lookup(0x1001).file == source
+
+    def test_analyze(self, monkeypatch, tmp_path, capsys):
+        output = tmp_path / "cs147.dat"
+        estimates = tmp_path / "analysis.json"
+        source = os.path.join(EXAMPLES, "cs147.asm")
+        run(monkeypatch, source, "-o", str(output), "--cost", "loop=100")
+        run(monkeypatch, source, "--analyze-json", str(estimates))
+        report = capsys.readouterr().err
+        assert "hot spot" in report and "LOOP+1" in report
+        assert json.loads(estimates.read_text())["costs"]["loop"] == 10
+
+    def test_version(self, monkeypatch, capsys):
+        with pytest.raises(SystemExit) as exit:
+            run(monkeypatch, "--version")
+        assert exit.value.code == 0
+        assert capsys.readouterr().out.startswith("dvassembler ")
+
+    def test_lazy_imports(self):
+        # starting up shouldn't load the assembler or anything heavy
+        loaded = subprocess.run(
+            [
+                sys.executable,
+                "-c",
+                "import sys, assembler.dvassembler; print(' '.join(sys.modules))",
+            ],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.split()
+        for module in [
+            "assembler.translator",
+            "assembler.grammar",
+            "concurrent.futures",
+            "dataclasses",
+            "hashlib",
+            "tracemalloc",
+        ]:
+            assert module not in loaded
@@ -0,0 +1,302 @@
+import pytest
+import os
+from array import array
+from assembler.grammar import (
+    MAX_ERRORS,
+    Data,
+    ParseError,
+    Program,
+    Token,
+    iter_parse,
+    lex,
+    lex_lines,
+    parse,
+    preprocess,
+    process,
+    Instruction,
+    Label,
+)
+
+EXAMPLES = os.path.join(os.path.dirname(__file__), "..", "examples")
+
+
+class TestLexer:
+
+    def test_classes(self):
+        assert list(lex("main: addi r1, r1, 0x1F;")) == [
+            Token("label", "main"),
+            Token("colon", ":"),
+            Token("instruction", "addi"),
+            Token("register", "r1"),
+            Token("comma", ","),
+            Token("register", "r1"),
+            Token("comma", ","),
+            Token("literal", "0x1F"),
+            Token("semicolon", ";"),
+        ]
+
+    def test_longest_match(self):
+        # words that only start with a register or instruction are labels
+        assert list(lex("r10 r32 addi addix la lab")) == [
+            Token("register", "r10"),
+            Token("label", "r32"),
+            Token("instruction", "addi"),
+            Token("label", "addix"),
+            Token("instruction", "la"),
+            Token("label", "lab"),
+        ]
+
+    def test_directives(self):
+        assert list(lex('T: .incbin "lut v2.bin"; .data')) == [
+            Token("label", "T"),
+            Token("colon", ":"),
+            Token("directive", ".incbin"),
+            Token("string", '"lut v2.bin"'),
+            Token("semicolon", ";"),
+            Token("data", ".data"),
+        ]
+
+    def test_drops_whitespace_and_comments(self):
+        assert list(lex(".data # comment\n\t.text\n")) == [
+            Token("data", ".data"),
+            Token("text", ".text"),
+        ]
+
+    def test_is_lazy(self):
+        tokens = lex("push; @")
+        assert next(tokens) == Token("instruction", "push")
+        assert next(tokens) == Token("semicolon", ";")
+        with pytest.raises(Exception):
+            next(tokens)
+
+    def test_positions(self):
+        tokens = list(lex("  .text\n\n main: push;\n"))
+        assert [(t.line, t.column) for t in tokens] == [
+            (1, 3),
+            (3, 2),
+            (3, 6),
+            (3, 8),
+            (3, 12),
+        ]
+        lines = list(lex_lines([".text\n", "  pop;\n"]))
+        assert (lines[1].line, lines[1].column) == (2, 3)
+
+    def test_error_position(self):
+        with pytest.raises(Exception, match=r"line 2, column 6"):
+            list(lex(".text\npush @" + "x" * 1000))
+        with pytest.raises(Exception) as e:
+            list(lex(".text\npush @" + "x" * 1000))
+        assert len(str(e.value)) < 100
+
+    def test_process(self):
+        segments = process(".text\nmain: jr r31;").segments()
+        assert segments[0].items == [
+            Label("main"),
+            Instruction("jr", [Token("register", "r31")]),
+        ]
+
+
+class TestIterParse:
+
+    def test_yields_statements(self):
+        statements = list(iter_parse(lex(".data\nA: 1, 2;\n.text\nmain: jr r31;")))
+        assert statements == [
+            Data("A", [Token("literal", "1"), Token("literal", "2")]),
+            Label("main"),
+            Instruction("jr", [Token("register", "r31")]),
+        ]
+
+    def test_errors(self):
+        with pytest.raises(Exception, match="expected semicolon"):
+            list(iter_parse(lex(".text\nmain: jr r31")))
+        with pytest.raises(Exception, match="expected literal"):
+            list(iter_parse(lex(".data\nA: r1;")))
+        with pytest.raises(Exception, match="Error parsing"):
+            list(iter_parse(lex("push;")))
+
+
+class TestParse:
+
+    def test_collects_every_error(self):
+        source = ".text\nmain: add r1 r2, r3;\n  jr r31;\n.data\nA: r1;\nB 1;\nC: 2;"
+        with pytest.raises(ParseError) as e:
+            parse(lex(source))
+        assert e.value.errors == [
+            "Error parsing at line 2, column 14, expected semicolon or comma, "
+            "got register 'r2'",
+            "Error parsing at line 5, column 4, expected literal or directive, "
+            "got register 'r1'",
+            "Error parsing at line 6, column 3, expected colon, got literal '1'",
+        ]
+
+    def test_recovers_at_segments(self):
+        with pytest.raises(ParseError) as e:
+            process(".text\nmain: add r1,\n.data\nA: 1;\nB: ;")
+        assert len(e.value.errors) == 2
+        assert "got data '.data'" in e.value.errors[0]
+        assert "line 5, column 4" in e.value.errors[1]
+
+    def test_end_of_file(self):
+        with pytest.raises(ParseError, match="got end of file"):
+            process(".text\nmain: jr r31")
+
+    def test_bounded_messages(self):
+        source = ".text\n" + "x" * 1000 + " r1;\n" + "1;\n" * (MAX_ERRORS * 2)
+        with pytest.raises(ParseError) as e:
+            process(source)
+        assert len(e.value.errors) == MAX_ERRORS
+        assert all(len(error) < 120 for error in e.value.errors)
+        assert str(e.value).endswith(f"and {MAX_ERRORS + 1} more errors")
+
+    def test_same_result_everywhere(self):
+        for name in ["binsearch", "recfib", "cs147"]:
+            with open(f"{EXAMPLES}/{name}.asm") as f:
+                source = f.read()
+            segments = parse(lex(source))
+            items = [item for segment in segments for item in segment.items]
+            statements = list(iter_parse(lex(source)))
+            assert sorted(map(repr, items)) == sorted(map(repr, statements))
+
+
+class TestProgram:
+
+    def test_columns(self):
+        program = process(".data\nA: 1, 0x2;\n.text\nmain: la r1, A; addi r1, r1, 1;")
+        assert len(program) == 2
+        assert program.name(0) == "la" and program.name(1) == "addi"
+        assert list(program.arg_start) == [0, 2, 5]
+        assert program.operands(0) == [1, "A"]
+        assert program.operands(1) == [1, 1, 1]
+        # literals and symbols are interned
+        assert program.literals.names == ["1", "0x2"]
+        assert program.symbols.names == ["A", "main"]
+        assert list(program.label_at) == [0]
+        assert list(program.data_values) == [0, 1]
+        assert isinstance(program.args, array)
+
+    def test_statements(self):
+        for name in ["binsearch", "recfib", "cs147"]:
+            with open(f"{EXAMPLES}/{name}.asm") as f:
+                source = f.read()
+            statements = list(iter_parse(lex(source)))
+            program = process(source)
+            datas = [s for s in statements if type(s) is Data]
+            items = [s for s in statements if type(s) is not Data]
+            assert list(program.statements()) == datas + items
+            assert Program.from_segments(parse(lex(source))).segments() == (
+                program.segments()
+            )
+
+    def test_trailing_labels(self):
+        program = process(".text\nmain: push;\nend:")
+        assert list(program.statements())[-1] == Label("end")
+
+    def test_records_have_no_dict(self):
+        assert not hasattr(Token("register", "r1"), "__dict__")
+        assert not hasattr(Instruction("pop", []), "__dict__")
+
+
+def expanded(source):
+    return [tok.contents for tok in preprocess(lex(source))]
+
+
+class TestMacros:
+
+    def test_parameters(self):
+        source = """
+.macro swap a, b
+    add \\a, \\a, \\b;
+    sub \\b, \\a, \\b;
+.endm
+swap r1, r31;
+"""
+        assert " ".join(expanded(source)) == (
+            "add r1 , r1 , r31 ; sub r31 , r1 , r31 ;"
+        )
+
+    def test_matches_hand_written(self):
+        with open(f"{EXAMPLES}/binsearch.asm") as f:
+            source = f.read()
+        swap = "add r0, r0, r31;\nsub r31, r0, r31;\nsub r0, r0, r31;"
+        assert swap in source
+        macro = ".macro swap x, y\nadd \\x, \\x, \\y;\nsub \\y, \\x, \\y;\nsub \\x, \\x, \\y;\n.endm\n"
+        with_macro = macro + source.replace(swap, "swap r0, r31;")
+        assert list(process(with_macro).statements()) == list(
+            process(source).statements()
+        )
+
+    def test_local_labels(self):
+        source = """
+.macro wait reg
+loop: addi \\reg, \\reg, -1;
+    bne \\reg, r0, loop;
+.endm
+.text
+main: wait r1;
+    wait r2;
+loop: jmp loop;
+"""
+        statements = list(process(source).statements())
+        labels = [s.name for s in statements if type(s) is Label]
+        assert labels == ["main", "__loop_1", "__loop_2", "loop"]
+        branches = [s.args[-1].contents for s in statements if s.name == "bne"]
+        assert branches == ["__loop_1", "__loop_2"]
+
+    def test_rept(self):
+        source = ".text\nmain:\n.rept 3\n    push;\n.endr\njr r31;"
+        assert expanded(source) == [".text", "main", ":"] + ["push", ";"] * 3 + [
+            "jr",
+            "r31",
+            ";",
+        ]
+
+    def test_nested(self):
+        source = """
+.macro twice
+    .rept 2
+    pop;
+    .endr
+.endm
+.macro four
+    twice; twice;
+.endm
+four;
+"""
+        assert expanded(source) == ["pop", ";"] * 4
+
+    def test_lazy(self):
+        tokens = preprocess(lex(".text\nmain:\n.rept 1000000000\npush;\n.endr"))
+        assert [next(tokens).contents for _ in range(6)] == [
+            ".text",
+            "main",
+            ":",
+            "push",
+            ";",
+            "push",
+        ]
+
+    def test_label_named_like_macro(self):
+        source = ".macro f\npush;\n.endm\nf: f;\njmp f;"
+        assert expanded(source) == ["f", ":", "push", ";", "jmp", "f", ";"]
+
+    def test_stream_agrees(self):
+        source = ".text\n.macro inc r\naddi \\r, \\r, 1;\n.endm\nmain: inc r1;\n.rept 2\ninc r2;\n.endr"
+        streamed = list(iter_parse(preprocess(lex_lines(source.splitlines(True)))))
+        assert streamed == list(process(source).statements())
+
+    @pytest.mark.parametrize(
+        "source, message",
+        [
+            (".macro f\npush;", r"\.macro without \.endm \(line 1, column 1\)"),
+            (".endr", r"\.endr without \.rept"),
+            (".rept 2\npush;\n.endm", r"Expected \.endr, got \.endm"),
+            (".rept -1\n.endr", r"Expected \.rept count"),
+            (".macro f a\npush;\n.endm\nf;", "f takes 1 arguments, got 0"),
+            (".macro f\npush \\x;\n.endm\nf;", r"f has no parameter \\x"),
+            (".macro f\nf;\n.endm\nf;", "Expansion of f is nested too deeply"),
+            (".macro push\n.endm", "Macro push would hide an instruction"),
+        ],
+    )
+    def test_errors(self, source, message):
+        with pytest.raises(Exception, match=message):
+            expanded(source)
@@ -0,0 +1,101 @@
+import io
+import pytest
+from assembler.assembler import assemble_fragment, assemble_image, link
+from assembler.grammar import iter_parse, lex, process
+from assembler.objfile import dump, load
+
+LIBRARY = """
+.data
+A: 1, 2, 3;
+.text
+f:
+    la r1, A;
+    lw r1, r1, 0;
+    beq r1, r0, f;
+    jr r31;
+"""
+PROGRAM = """
+.text
+main:
+    jal f;
+    jmp main;
+"""
+
+
+def fragment(source: str):
+    return assemble_fragment(iter_parse(lex(source)))
+
+
+def roundtrip(source: str):
+    f = io.BytesIO()
+    dump(fragment(source), f)
+    f.seek(0)
+    return load(f)
+
+
+class TestObjectFiles:
+
+    def test_roundtrip(self):
+        original = fragment(LIBRARY)
+        assert roundtrip(LIBRARY) == original
+        assert len(original.fixups) == 2
+        assert original.labels == {"f": 0}
+
+    def test_link(self):
+        image = link([roundtrip(LIBRARY), roundtrip(PROGRAM)])
+        whole = assemble_image(process(LIBRARY + PROGRAM))
+        assert list(image.text[:3]) == [0x08001006, 0x3C210100, 0x34218000]
+        assert list(image.text[6:]) == [0x0C001001, 0x08001006]
+        assert list(image.text) == list(whole.text)
+        assert list(image.data) == list(whole.data)
+
+    def test_duplicate_symbols(self):
+        with pytest.raises(Exception, match="already exists"):
+            link([roundtrip(PROGRAM), roundtrip(PROGRAM)])
+        with pytest.raises(Exception, match="main is defined by more than one"):
+            link([roundtrip(PROGRAM), roundtrip(PROGRAM)], modules=True)
+
+    def test_local_labels(self):
+        module = """
+.data
+N: 3;
+.text
+{name}:
+    la r1, N;
+    lw r1, r1, 0;
+loop:
+    addi r1, r1, -1;
+    bne r1, r0, loop;
+    jmp done;
+done:
+    jr r31;
+"""
+        program = ".text\nmain:\n    jal f;\n    jal g;\n"
+        modules = [roundtrip(module.format(name=name)) for name in ["f", "g"]]
+        image = link(modules + [roundtrip(program)], modules=True)
+        whole = (
+            module.format(name="f")
+            + module.format(name="g")
+            .replace("loop", "loop2")
+            .replace("done", "done2")
+            .replace("N", "N2")
+            + program
+        )
+        assert image == assemble_image(process(whole))
+
+    def test_shared_label_referenced_elsewhere(self):
+        other = ".text\nf: jr r31;\n"
+        with pytest.raises(Exception, match="f is defined by more than one"):
+            link([roundtrip(other), roundtrip(other), roundtrip(PROGRAM)], modules=True)
+
+    def test_bad_magic(self):
+        with pytest.raises(Exception, match="Not a dvassembler object file"):
+            load(io.BytesIO(b"garbage"))
+
+    def test_truncated(self):
+        f = io.BytesIO()
+        dump(fragment(LIBRARY), f)
+        contents = f.getvalue()
+        for size in [len(contents) - 1, len(contents) // 2, 40]:
+            with pytest.raises(Exception, match="Object file is truncated"):
+                load(io.BytesIO(contents[:size]))
@@ -0,0 +1,50 @@
+import io
+from array import array
+from assembler.assembler import Image, assemble_image, assemble_lines
+from assembler.grammar import process
+from assembler.output import ihex_lines, memh_lines, write_bin, write_memh
+
+SOURCE = """
+.data
+A: 10, -1;
+.text
+main: addi r1, r1, 1;
+jmp main;
+"""
+
+
+class TestOutput:
+
+    def test_memh_streams_lines(self):
+        f = io.StringIO()
+        write_memh(assemble_lines(process(SOURCE)), f)
+        lines = f.getvalue().splitlines()
+        assert lines[2] == "08001001    // jmp 0x1001;"
+        assert lines[-1] == "ffffffff"
+
+    def test_memh_without_comments(self):
+        assert list(memh_lines(assemble_image(process(SOURCE)))) == [
+            "@00001000",
+            "08001001",
+            "20210001",
+            "08001001",
+            "@01008000",
+            "0000000a",
+            "ffffffff",
+        ]
+
+    def test_bin(self, tmp_path):
+        path = tmp_path / "out.bin"
+        write_bin(assemble_image(process(SOURCE)), str(path))
+        contents = path.read_bytes()
+        assert len(contents) == (0x01008000 + 2) * 4
+        assert contents[0x4000:0x400C].hex() == "080010012021000108001001"
+        assert contents[0x04020000:].hex() == "0000000affffffff"
+
+    def test_ihex(self):
+        image = Image(array("I", [0x08001001]), array("I"))
+        assert list(ihex_lines(image)) == [
+            ":020000040000FA",
+            ":0440000008001001A3",
+            ":00000001FF",
+        ]
@@ -0,0 +1,115 @@
+import os
+import pytest
+from assembler import parallel
+from assembler.assembler import layout_image, layout_lines, resolve
+from assembler.grammar import process
+
+EXAMPLES = os.path.join(os.path.dirname(__file__), "..", "examples")
+
+
+@pytest.fixture
+def small_chunks(monkeypatch):
+    # so that even the examples are split between workers
+    monkeypatch.setattr(parallel, "MIN_CHUNK", 4)
+    monkeypatch.setattr(parallel, "MIN_SOURCE_CHUNK", 64)
+
+
+def example(name):
+    with open(os.path.join(EXAMPLES, name)) as f:
+        return f.read()
+
+
+def columns(program):
+    found = {}
+    for name in program.__slots__:
+        value = getattr(program, name)
+        if name in ["symbols", "literals"]:
+            value = value.names
+        elif name == "data_blocks":
+            value = {i: block.tokens for i, block in value.items()}
+        found[name] = value
+    return found
+
+
+def resolved(name, optimize=False):
+    with open(os.path.join(EXAMPLES, name)) as f:
+        return resolve(process(f.read()), optimize)
+
+
+class TestParallel:
+
+    def test_chunks(self, small_chunks):
+        result = resolved("binsearch.asm")
+        ranges = parallel.chunks(result, 2)
+        assert len(ranges) == 8
+        assert ranges[0][0] == 0 and ranges[-1][1] == len(result)
+        assert all(a[1] == b[0] for a, b in zip(ranges, ranges[1:]))
+
+    def test_small_programs(self):
+        # aren't worth splitting
+        result = resolved("binsearch.asm")
+        assert parallel.chunks(result, 4) == [(0, len(result))]
+
+    def test_split_source(self):
+        source = example("binsearch.asm")
+        pieces = parallel.split_source(source, 6)
+        assert len(pieces) > 2
+        # every chunk but the first repeats the directive of its segment on
+        # the line before it
+        assert pieces[0] == (1, source[: len(pieces[0][1])])
+        for line, chunk in pieces[1:]:
+            directive, rest = chunk.split("\n", 1)
+            assert directive in [".data", ".text"]
+            assert source.split("\n")[line] == rest.split("\n")[0]
+        # a data item over several lines isn't cut
+        assert all("18, 20, 20" not in chunk for _, chunk in pieces[1:])
+        # nor are .text and .data inside strings taken for directives
+        strings = '.data\nt: .incbin "tbl.text";\nu: 1;\n' * 20
+        pieces = parallel.split_source(strings, 4)
+        assert len(pieces) > 2
+        assert all(chunk.startswith(".data\n") for _, chunk in pieces[1:])
+        macro = ".text\n.macro inc r\naddi \\r, \\r, 1;\n.endm\nmain: inc r1;\n"
+        assert parallel.split_source(macro * 20, 4) == [(1, macro * 20)]
+
+    @pytest.mark.parametrize("name", ["binsearch.asm", "cs147.asm", "recfib.asm"])
+    def test_process_parallel(self, small_chunks, name):
+        # the same columns and ids, down to the source positions
+        source = example(name)
+        program = parallel.process_parallel(source, jobs=3)
+        assert columns(program) == columns(process(source))
+
+    def test_parse_errors(self, small_chunks):
+        source = example("recfib.asm") + "\n    add r1 r2;\n" + example("cs147.asm")
+        with pytest.raises(Exception) as serial:
+            process(source)
+        with pytest.raises(Exception) as parallel_error:
+            parallel.process_parallel(source, jobs=2)
+        assert str(parallel_error.value) == str(serial.value)
+
+    @pytest.mark.parametrize("name", ["binsearch.asm", "cs147.asm", "recfib.asm"])
+    def test_same_as_serial(self, small_chunks, name):
+        for optimize in [False, True]:
+            result = resolved(name, optimize)
+            serial = layout_image(result)
+            image = layout_image(result, jobs=3)
+            assert image == serial
+            assert list(layout_lines(result, image)) == list(layout_lines(result))
+
+    def test_far_branches(self, small_chunks):
+        # relaxed branches take two words, which moves every later chunk
+        source = (
+            ".text\nmain:\n    beq r1, r2, end;\n" + "    addi r1, r1, 1;\n" * 40000
+        )
+        source += "end:\n    bne r1, r2, main;\n    jr r31;\n"
+        result = resolve(process(source))
+        assert result.relaxed
+        assert layout_image(result, jobs=2) == layout_image(result)
+
+    def test_errors(self, small_chunks):
+        source = ".text\nmain:\n" + "    addi r1, r1, 1;\n" * 20 + "    jal nowhere;\n"
+        result = resolve(process(source))
+        with pytest.raises(Exception) as serial:
+            layout_image(result)
+        with pytest.raises(Exception) as parallel_error:
+            layout_image(result, jobs=2)
+        assert str(parallel_error.value) == str(serial.value)
@@ -0,0 +1,99 @@
+from assembler.assembler import assemble_image
+from assembler.grammar import Label, iter_parse, lex, process
+from assembler.peephole import optimize_items
+from assembler.sim import Machine
+
+
+def items(source: str):
+    return list(iter_parse(lex(".text\n" + source)))
+
+
+def optimized(source: str):
+    result, stats = optimize_items(items(source))
+    return [str_of(item) for item in result], dict(stats)
+
+
+def str_of(item):
+    if type(item) is Label:
+        return f"{item.name}:"
+    return " ".join([item.name, ", ".join(arg.contents for arg in item.args)]).strip()
+
+
+class TestPeephole:
+
+    def test_unreachable_and_jump_to_next(self):
+        assert optimized("main: jmp next; push; pop; next: jr r31; pop; f: pop;") == (
+            ["main:", "next:", "jr r31", "f:", "pop"],
+            {"unreachable": 3, "jmp-next": 1},
+        )
+
+    def test_swap_pair(self):
+        swap = "add r0, r0, r31; sub r31, r0, r31; sub r0, r0, r31;"
+        assert optimized(f"main: {swap} {swap} push;") == (
+            ["main:", "push"],
+            {"swap-pair": 6},
+        )
+        # a push in between makes both swaps necessary
+        assert optimized(f"main: {swap} push; {swap}")[1] == {}
+
+    def test_zero_fold(self):
+        assert optimized(
+            "main: sub r1, r1, r1; sub r2, r2, r2; addi r2, r2, 5; sub r1, r1, r1;"
+        ) == (["main:", "sub r1, r1, r1", "addi r2, r1, 5"], {"zero-fold": 2})
+        # a label or a call means r1 may no longer be zero
+        assert (
+            optimized("main: sub r1, r1, r1; l: sub r2, r2, r2; addi r2, r2, 5;")[1]
+            == {}
+        )
+        assert (
+            optimized(
+                "main: sub r1, r1, r1; jal f; sub r2, r2, r2; addi r2, r2, 5; f: jr r31;"
+            )[1]
+            == {}
+        )
+        # add x,x,x still needs the zeroed x
+        assert (
+            optimized("main: sub r1, r1, r1; sub r2, r2, r2; add r2, r2, r2;")[1] == {}
+        )
+
+    def test_nops(self):
+        assert optimized("main: addi r1, r1, 0; or r2, r2, r2; sll r3, r3, 0;")[1] == {
+            "nop": 3
+        }
+
+    def test_same_result(self):
+        source = """
+        .text
+        main:
+            sub r1, r1, r1;
+            sub r2, r2, r2;
+            addi r2, r2, 10;
+            add r3, r3, r2;
+            sub r4, r4, r4;
+            add r4, r4, r3;
+            add r3, r3, r4;
+            sub r4, r3, r4;
+            sub r3, r3, r4;
+            add r3, r3, r4;
+            sub r4, r3, r4;
+            sub r3, r3, r4;
+            jmp end;
+            addi r1, r1, 1;
+        end:
+            addi r5, r4, 0;
+        """
+        plain = Machine.from_image(assemble_image(process(source)))
+        stats = {}
+        fast = Machine.from_image(assemble_image(process(source), True, stats))
+        plain.run()
+        fast.run()
+        assert plain.regs == fast.regs
+        assert fast.executed < plain.executed
+        assert stats == {
+            "unreachable": 1,
+            "jmp-next": 1,
+            "swap-pair": 6,
+            "zero-fold": 2,
+        }
+        # the unreachable addi never ran in the first place
+        assert plain.executed - fast.executed == 9
@@ -0,0 +1,60 @@
+import json
+from assembler.assembler import assemble_image
+from assembler.grammar import process
+from assembler.profiling import Profiler, profile_assembly
+
+SOURCE = """
+.data
+A: 1, 2, 3;
+.text
+main:
+    la r1, A;
+    lw r2, r1, 0;
+loop:
+    addi r2, r2, -1;
+    bne r2, r0, loop;
+"""
+
+
+class TestProfiler:
+
+    def test_stages(self):
+        profiler = Profiler()
+        layout, image = profile_assembly(SOURCE, profiler)
+        assert [stage.name for stage in profiler.stages] == [
+            "lex",
+            "preprocess",
+            "parse",
+            "resolve",
+            "encode",
+        ]
+        counts = {stage.name: stage.counts for stage in profiler.stages}
+        assert counts["lex"] == {"tokens": 40}
+        assert counts["parse"] == {
+            "instructions": 4,
+            "labels": 2,
+            "data": 1,
+            "data_words": 3,
+        }
+        assert counts["resolve"]["words"] == 6
+        assert all(stage.peak_bytes > 0 for stage in profiler.stages)
+        expected = assemble_image(process(SOURCE))
+        assert list(image.text) == list(expected.text)
+        assert list(image.data) == list(expected.data)
+
+    def test_without_memory(self):
+        profiler = Profiler(memory=False)
+        with profiler.stage("nothing") as counts:
+            counts["items"] = 0
+        assert profiler.stages[0].peak_bytes is None
+        assert profiler.report()[1].split()[2] == "-"
+
+    def test_json(self, tmp_path):
+        profiler = Profiler()
+        profile_assembly(SOURCE, profiler)
+        path = tmp_path / "profile.json"
+        profiler.write_json(str(path))
+        numbers = json.loads(path.read_text())
+        assert len(numbers["stages"]) == 5
+        assert numbers["total_seconds"] == profiler.total_seconds()
+        assert numbers["stages"][0]["counts"] == {"tokens": 40}
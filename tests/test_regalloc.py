@@ -0,0 +1,62 @@
+from assembler.regalloc import (
+    CALL,
+    ENTRY,
+    LABEL,
+    RETURN,
+    Function,
+    Liveness,
+    Op,
+    VReg,
+    linear_scan,
+)
+
+
+def registers(count):
+    return [VReg(i, f"v{i}", None, None) for i in range(count)]
+
+
+class TestRegalloc:
+
+    def test_loop_liveness(self):
+        # a is read in every iteration, so it's live across the whole loop
+        a, i, t = registers(3)
+        ops = [
+            Op(ENTRY, [None, a, i], 0, 0),
+            Op(LABEL, ["loop"], 0, 0),
+            Op("add", [t, a, i], 0, 0),
+            Op("addi", [i, i, -1], 0, 0),
+            Op("bne", [i, t, "loop"], 0, 0),
+            Op(RETURN, [i, None], 0, 0),
+        ]
+        intervals = Liveness(Function("f", ops, [a, i, t])).intervals()
+        assert intervals[a] == [1, 9]
+        assert intervals[t] == [5, 8]
+
+    def test_live_across_calls(self):
+        a, b, c = registers(3)
+        ops = [
+            Op(ENTRY, [None, a, b], 0, 0),
+            Op(CALL, ["g", c, b], 0, 0),
+            Op("add", [c, c, a], 0, 0),
+            Op(RETURN, [c, None], 0, 0),
+        ]
+        liveness = Liveness(Function("f", ops, [a, b, c]))
+        assert liveness.live_across_calls() == {1: {a}}
+
+    def test_hints_and_reuse(self):
+        a, b, c = registers(3)
+        a.hint = 3
+        # c starts when b is last read, so it can take b's register
+        registers_, spilled = linear_scan(
+            {a: [1, 10], b: [1, 4], c: [5, 8]}, pool=[7, 3, 5]
+        )
+        assert registers_ == {a: 3, b: 7, c: 7}
+        assert spilled == []
+
+    def test_spills_longest(self):
+        a, b, c = registers(3)
+        registers_, spilled = linear_scan(
+            {a: [1, 20], b: [1, 4], c: [2, 6]}, pool=[1, 2]
+        )
+        assert spilled == [a]
+        assert registers_ == {b: 2, c: 1}
@@ -0,0 +1,88 @@
+import os
+import pytest
+from assembler.assembler import assemble_image
+from assembler.grammar import process
+from assembler.sections import gc_sections
+
+EXAMPLES = os.path.join(os.path.dirname(__file__), "..", "examples")
+SOURCE = """
+.data
+Used: 1, 2, 3;
+Unused: 4, 5, 6, 7;
+Table: .fill 100, 0;
+.text
+unused:
+    la r1, Table;
+    jr r31;
+square:
+    mul r30, r0, r0;
+    beq r30, r0, small;
+    jr r31;
+small:
+    addi r30, r30, 1;
+after_small:
+    jr r31;
+dead_after_jmp:
+    jmp dead_after_jmp;
+main:
+    la r1, Used;
+    lw r0, r1, 0;
+    jal square;
+"""
+TRIMMED = """
+.data
+Used: 1, 2, 3;
+.text
+square:
+    mul r30, r0, r0;
+    beq r30, r0, small;
+    jr r31;
+small:
+    addi r30, r30, 1;
+after_small:
+    jr r31;
+main:
+    la r1, Used;
+    lw r0, r1, 0;
+    jal square;
+"""
+
+
+class TestGcSections:
+
+    def test_drops_unreachable(self):
+        program, saved = gc_sections(process(SOURCE))
+        # la is two words
+        assert saved == {"text": 4, "data": 104}
+        assert assemble_image(program) == assemble_image(process(TRIMMED))
+
+    def test_keeps_positions(self):
+        program, _ = gc_sections(process(SOURCE))
+        assert program.lines[0] == 11 and program.data_lines[0] == 3
+
+    def test_fall_through_and_calls(self):
+        # f is only reached by returning from the jal that ends main's block
+        source = (
+            ".text\nmain:\n    jal g;\nf:\n    addi r1, r1, 1;\n    jr r31;\n"
+            "g:\n    jr r31;\nh:\n    jr r31;\n"
+        )
+        program, saved = gc_sections(process(source))
+        assert saved == {"text": 1, "data": 0}
+        assert "h" not in program.symbols.ids
+
+    def test_absolute_data_addresses(self):
+        # binsearch finds its array with lui/ori instead of la
+        with open(os.path.join(EXAMPLES, "binsearch.asm")) as f:
+            program = process(f.read())
+        trimmed, saved = gc_sections(program)
+        assert saved == {"text": 0, "data": 0}
+        assert assemble_image(trimmed) == assemble_image(program)
+
+    def test_errors_in_dead_code(self):
+        source = ".text\ndead:\n    jmp nowhere;\nmain:\n    jr r31;\n"
+        with pytest.raises(Exception, match="Unknown label nowhere"):
+            gc_sections(process(source))
+
+    def test_without_main(self):
+        program = process(".text\nf:\n    jr r31;\n")
+        assert gc_sections(program) == (program, {"text": 0, "data": 0})
@@ -0,0 +1,136 @@
+import asyncio
+import os
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from assembler.assembler import assemble_lines
+from assembler.client import Client
+from assembler.grammar import process
+from assembler.server import AssemblyServer, assemble_request, remove_stale_socket
+
+EXAMPLES = os.path.join(os.path.dirname(__file__), "..", "examples")
+
+
+def example(name):
+    with open(os.path.join(EXAMPLES, name)) as f:
+        return f.read()
+
+
+def expected(source):
+    return "".join(f"{line}\n" for line in assemble_lines(process(source)))
+
+
+@pytest.fixture
+def serve(tmp_path):
+    """
+    Starts a server with two worker threads in the background, returning
+    how to reach it
+    """
+    servers = []
+
+    def start(port=None, **kwargs):
+        server = AssemblyServer(2, executor=ThreadPoolExecutor(2), **kwargs)
+        started = threading.Event()
+        address = {}
+
+        def ready(listening):
+            address["port"] = listening.sockets[0].getsockname()[1]
+            started.set()
+
+        socket_path = str(tmp_path / "dvassembler.sock")
+        thread = threading.Thread(
+            target=asyncio.run,
+            args=(server.serve(socket_path, port=port, ready=ready),),
+        )
+        thread.start()
+        assert started.wait(5)
+        servers.append((server, thread))
+        if port is None:
+            return Client(socket_path)
+        return Client(port=address["port"])
+
+    yield start
+    for server, thread in servers:
+        server.stop()
+        thread.join(5)
+
+
+class TestServer:
+
+    def test_assemble_request(self):
+        source = example("recfib.asm")
+        response = assemble_request({"source": source})
+        assert response == {"ok": True, "output": expected(source), "removed": {}}
+        response = assemble_request({"source": ".text\nmain: add r1 r2;"})
+        assert not response["ok"] and "line 2" in response["error"]
+        response = assemble_request({"source": source, "format": "bin"})
+        assert response["error"] == "Exception: Unsupported format bin"
+
+    def test_untrusted_sources(self, tmp_path):
+        secret = tmp_path / "secret"
+        secret.write_bytes(b"1234")
+        response = assemble_request({"source": f'.data\nA: .incbin "{secret}";'})
+        assert "Including files isn't allowed here (line 2" in response["error"]
+        # a repeat that would take ages is cut off
+        source = ".text\nmain:\n.rept 1000000000\npush;\n.endr"
+        response = assemble_request({"source": source}, limit=0.2)
+        assert response == {"ok": False, "error": "Exception: Took longer than 0.2 s"}
+
+    def test_unix_socket(self, serve):
+        with serve() as client:
+            for name in ["cs147.asm", "recfib.asm", "binsearch.asm"]:
+                source = example(name)
+                assert client.assemble(source) == expected(source)
+            with pytest.raises(Exception, match="Unknown label"):
+                client.assemble(".text\nmain: jmp nowhere;")
+            # the connection is still usable after an error
+            assert client.assemble(".text\nmain: jr r31;").startswith("//")
+
+    def test_http(self, serve):
+        with serve(port=0) as client:
+            source = example("cs147.asm")
+            output = client.assemble(source, "memh", comments=False)
+            assert output.startswith("@00001000\n")
+            assert client.request({"nope": 1})["error"].startswith("Bad request")
+
+    def test_concurrent(self, serve):
+        client = serve()
+        client.close()
+        sources = [example(name) for name in ["cs147.asm", "recfib.asm"]] * 8
+
+        def assemble(source):
+            with Client(client.socket_path) as own:
+                return own.assemble(source, optimize=True)
+
+        with ThreadPoolExecutor(8) as pool:
+            outputs = list(pool.map(assemble, sources))
+        assert outputs == [
+            "".join(f"{line}\n" for line in assemble_lines(process(s), True))
+            for s in sources
+        ]
+
+    def test_busy(self):
+        async def run():
+            server = AssemblyServer(1, queue_size=1)
+            server.loop = asyncio.get_running_loop()
+            server.queue = asyncio.Queue(1)
+            # nothing dispatches, so the first request fills the queue
+            waiting = asyncio.create_task(server.submit({"source": ""}))
+            await asyncio.sleep(0)
+            response = await server.submit({"source": ""})
+            waiting.cancel()
+            return response
+
+        assert asyncio.run(run())["error"].startswith("Server is busy")
+
+    def test_stale_socket(self, tmp_path):
+        path = str(tmp_path / "stale.sock")
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(path)
+        listener.listen()
+        with pytest.raises(Exception, match="already listening"):
+            remove_stale_socket(path)
+        listener.close()
+        remove_stale_socket(path)
+        assert not os.path.exists(path)
@@ -0,0 +1,78 @@
+import os
+import pytest
+from assembler.assembler import assemble, assemble_image
+from assembler.grammar import process
+from assembler.sim import Machine, load_memh
+
+EXAMPLES = os.path.join(os.path.dirname(__file__), "..", "examples")
+
+
+def machine(source: str) -> Machine:
+    return Machine.from_image(assemble_image(process(source)))
+
+
+def example(name: str) -> str:
+    with open(os.path.join(EXAMPLES, f"{name}.asm")) as f:
+        return f.read()
+
+
+class TestSim:
+
+    def test_recfib(self):
+        m = machine(example("recfib"))
+        m.run()
+        assert m.halted
+        assert m.regs[0] == 55  # fib(10)
+
+    def test_binsearch(self):
+        m = machine(example("binsearch"))
+        m.run()
+        assert m.regs[30] == 3
+        assert m.memory[0x01000000] == 3
+
+    def test_memdump(self):
+        source = example("binsearch")
+        m = Machine(load_memh(assemble(process(source)).splitlines()))
+        m.run()
+        assert m.regs[30] == 3
+
+    def test_arithmetic(self):
+        m = machine("""
+            .text
+            main:
+            addi r1, r1, -3;
+            slti r2, r1, 0;
+            srl r3, r1, 28;
+            lui r4, 0xFFFF;
+            ori r4, r4, 0xFFFF;
+            mul r5, r1, r1;
+            nor r6, r0, r0;
+            """)
+        m.run()
+        assert m.regs[1:7] == [0xFFFFFFFD, 1, 0xF, 0xFFFFFFFF, 9, 0xFFFFFFFF]
+
+    def test_calls_and_stack(self):
+        m = machine("""
+            .text
+            f:
+            addi r0, r0, 7;
+            push;
+            pop;
+            jr r31;
+            main:
+            jal f;
+            addi r1, r0, 1;
+            """)
+        m.run()
+        assert (m.regs[0], m.regs[1], m.regs[31]) == (7, 8, 0x1006)
+        assert m.memory[0x03FFFFFF] == 7
+
+    def test_budget(self):
+        m = machine(".text\nmain: jmp main;")
+        assert m.run(1000) == 1000
+        assert not m.halted
+
+    def test_invalid_instruction(self):
+        m = Machine({0x1000: 0x00000000})
+        with pytest.raises(Exception, match="Invalid instruction"):
+            m.run()
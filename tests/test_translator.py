@@ -1,3 +1,4 @@
+import pytest
 import assembler
 
 
@@ -91,3 +92,52 @@ class TestTranslator:
         assert assembler.encode("pop") == "70000000"
         assert assembler.encode("jal", "31") == "0C00001F"
         assert assembler.encode("andi", "r2", "r3", "-1") == "3062FFFF"
+
+    def test_encode_la(self):
+        assert assembler.encode("la", "r1", "0x01008004") == "3C210100\n34218004"
+
+    def test_encode_li(self):
+        assert assembler.encode_li("r1", "0x00050000") == "3C210005"
+        assert assembler.encode_li("r1", "-1") == "3C21FFFF\n3421FFFF"
+        assert assembler.encode_li("r1", "7") == "3C210000\n34210007"
+
+    def test_encode_far_branch(self):
+        # bne over a jmp to the target
+        assert assembler.encode("beq.far", "r1", "r2", "0x2000") == (
+            "14410001\n08002000"
+        )
+
+    def test_size_of(self):
+        assert assembler.size_of("add", "r1", "r2", "r3") == 1
+        assert assembler.size_of("la", "r1", "A") == 2
+        assert assembler.size_of("li", "r1", "0x10000") == 1
+        assert assembler.size_of("li", "r1", "0x10001") == 2
+
+    def test_encode_word(self):
+        assert assembler.encode_word("addi", "r1", "r1", -1) == 0x2021FFFF
+        assert assembler.encode_word("jmp", "0x3FFFFFF") == 0x0BFFFFFF
+        with pytest.raises(Exception):
+            assembler.encode_word("la", "r1", "0")
+        with pytest.raises(Exception):
+            assembler.encode_word("add", "r1", "r2", "x3")
+
+    def test_encode_many(self):
+        assert assembler.encode_many(
+            [("pop", ()), ("la", ("r1", 0x01008004)), ("bne", ("r1", "r9", "-13"))]
+        ) == [0x70000000, 0x3C210100, 0x34218004, 0x1521FFF3]
+
+    @pytest.mark.parametrize(
+        "inst, args, message",
+        [
+            ("addi", ("r1", "r1", "70000"), "Immediate 70000"),
+            ("ori", ("r1", "r1", "-32769"), "Immediate -32769"),
+            ("lui", ("r1", "0x10000"), "Immediate 0x10000"),
+            ("sll", ("r1", "r1", "40"), "Shift amount 40"),
+            ("srl", ("r1", "r1", "-1"), "Shift amount -1"),
+            ("jmp", ("0xFFFFFFFFFFF",), "Jump address 0xFFFFFFFFFFF"),
+            ("li", ("r1", "0x100000000"), "Value 0x100000000"),
+        ],
+    )
+    def test_out_of_range(self, inst, args, message):
+        with pytest.raises(Exception, match=f"{message} is out of range"):
+            assembler.encode_many([(inst, args)])